@@ -1,24 +1,66 @@
-from flask import Flask, jsonify
-from selenium.webdriver.support import expected_conditions as EC
-from flask import jsonify
-import zipfile
+from flask import Blueprint, Flask, Response, jsonify, request
 import datetime
-import os
+import glob
 import json
-import gzip
-import io
+import os
+import re
+import socket
+import sqlite3
+import threading
 import time
+import xml.etree.ElementTree as ET
 from database_setup import FoodChainDatabase
 from database_hierarchical import HierarchicalFoodDatabase
+from branch_writer import BranchWriter
+from read_replica import READ_REPLICAS, ReplicaPublisher
+from product_catalogue import normalize_name
 
-app = Flask(__name__)
+# Routes live on a blueprint; create_app() (bottom of file) builds the Flask app
+api = Blueprint('api', __name__)
 
-# Configure Flask to use compact JSON (no pretty printing)
-app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+class LazyHandle:
+    """Proxy that builds the wrapped object on first use, so importing app opens no database"""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+    
+    def configure(self, factory):
+        """Replace the factory (e.g. another db_path); takes effect on next use"""
+        with self._lock:
+            self._factory = factory
+            self._instance = None
+    
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
-# Global database instance
-db = FoodChainDatabase()
-hierarchical_db = HierarchicalFoodDatabase()
+def create_price_analytics():
+    # numpy is only imported once analytics are actually requested
+    from price_analytics import PriceAnalytics
+    return PriceAnalytics(db.db_path)
+
+def create_snapshot_exporter():
+    from product_snapshot import SnapshotExporter
+    return SnapshotExporter(db.db_path, on_export=analytics.invalidate)
+
+# Global database instances (initialized lazily)
+db = LazyHandle(FoodChainDatabase)
+hierarchical_db = LazyHandle(HierarchicalFoodDatabase)
+analytics = LazyHandle(create_price_analytics)
+# Writes each branch ingest to both databases in one transaction
+branch_writer = BranchWriter(db, hierarchical_db)
+# Copies food_chains.db for the serving workers after ingests (wsgi.py --read-replicas)
+replica_publisher = LazyHandle(lambda: ReplicaPublisher(db.db_path))
+# Re-exports the analytics snapshot after ingests, coalescing back-to-back requests
+snapshot_exporter = LazyHandle(create_snapshot_exporter)
 data_directory = "data"
 
 def log_message(message):
@@ -206,7 +248,6 @@ def get_files_from_table(chain_url):
     from selenium.webdriver.common.by import By
     from selenium.webdriver.support.ui import WebDriverWait
     from webdriver_manager.chrome import ChromeDriverManager
-    import re
 
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
@@ -263,14 +304,21 @@ def get_files_from_table(chain_url):
                 file_type = "PriceFull"
             elif "PromoFull" in file_name:
                 file_type = "PromoFull"
+            elif file_name.startswith(("Price", "Promo")):
+                # Intra-day Price/Promo files: only the changes since the Full file
+                file_type = "delta"
             else:
                 if branch_code in ['337', '50']:
-                    log_message(f"🔍 DEBUG: Branch {branch_code} file skipped - not PriceFull/PromoFull: {file_name}")
+                    log_message(f"🔍 DEBUG: Branch {branch_code} file skipped - not a Price/Promo file: {file_name}")
                 continue
 
             key = f"{branch_code}"
             if key not in branch_files:
-                branch_files[key] = {"PriceFull": ("", ""), "PromoFull": ("", "")}
+                branch_files[key] = {"PriceFull": ("", ""), "PromoFull": ("", ""), "deltas": []}
+            
+            if file_type == "delta":
+                branch_files[key]["deltas"].append((file_name, file_date))
+                continue
             
             if file_type == "PriceFull" and file_date > branch_files[key]["PriceFull"][1]:
                 branch_files[key]["PriceFull"] = (file_name, file_date)
@@ -302,60 +350,94 @@ def get_files_from_table(chain_url):
         log_message(f"❌ ERROR during file discovery: {str(e)}")
         return {}
 
-def discover_and_store_food_chain_data():
-    """Main function to discover food chain, branches, and store in database"""
+def discover_and_store_food_chain_data(resume=True):
+    """
+    Discover food chains, branches and branch files, and store them in the database.
+    
+    Each phase is checkpointed in discovery_progress, so a run interrupted after
+    the slow Selenium steps picks up from the last finished phase. Returns True
+    when all phases completed.
+    """
     global db
     
     log_message("🚀 Starting comprehensive food chain discovery and database population...")
+    progress = db.get_discovery_progress() if resume else {}
+    if not resume:
+        db.clear_discovery_progress()
+    if 'files' in progress:
+        log_message("✅ Discovery already complete - nothing to resume")
+        return True
     
     # Step 1: Get ALL food chains from government website
-    log_message("📊 Phase 1: Discovering all food chains...")
-    all_food_chains = get_all_food_chains()
-    
-    if not all_food_chains:
-        log_message("❌ Failed to discover any food chains")
-        return
-    
-    # Step 2: Store all food chain metadata in database
-    log_message(f"💾 Storing metadata for {len(all_food_chains)} food chains...")
-    for chain in all_food_chains:
-        try:
-            db.add_food_chain(chain['code'], chain['name'], chain['url'])
-            log_message(f"   ✅ Stored: {chain['name']}")
-        except Exception as e:
-            log_message(f"   ⚠️  Warning: Failed to store {chain['name']}: {str(e)}")
-    
-    log_message("🎉 All food chains stored in database!")
+    set_discovery_status(phase='chains')
+    if 'chains' in progress:
+        all_food_chains = db.get_food_chains()
+        log_message(f"⏩ Phase 1 already done - resuming with {len(all_food_chains)} stored food chains")
+    else:
+        log_message("📊 Phase 1: Discovering all food chains...")
+        all_food_chains = get_all_food_chains()
+        
+        if not all_food_chains:
+            log_message("❌ Failed to discover any food chains")
+            return False
+        
+        # Step 2: Store all food chain metadata in database
+        log_message(f"💾 Storing metadata for {len(all_food_chains)} food chains...")
+        for chain in all_food_chains:
+            try:
+                db.add_food_chain(chain['code'], chain['name'], chain['url'])
+                log_message(f"   ✅ Stored: {chain['name']}")
+            except Exception as e:
+                log_message(f"   ⚠️  Warning: Failed to store {chain['name']}: {str(e)}")
+        
+        db.save_discovery_phase('chains', {"chains": len(all_food_chains)})
+        log_message("🎉 All food chains stored in database!")
     
     # Step 3: Get detailed branch data for KingStore only (to avoid processing all chains)
-    log_message("📊 Phase 2: Getting detailed branch data for KingStore...")
-    branch_dict, chain_url, chain_info = get_food_chain_and_branches()
-    
-    if not branch_dict or not chain_info:
-        log_message("❌ Failed to get detailed KingStore data, but all chains are stored")
-        return
-    
-    # Step 4: Find KingStore's placeholder code and update it with actual chain code
-    log_message(f"💾 Updating KingStore placeholder with actual chain code...")
-    
-    # Find KingStore in the stored chains (should be CHAIN_001 since it's first)
-    kingstore_placeholder = None
-    for chain in all_food_chains:
-        if "קינג סטור" in chain['name'] or "kingstore" in chain['url'].lower():
-            kingstore_placeholder = chain['code']
-            break
-    
-    if kingstore_placeholder:
-        # Update the existing entry with actual chain code
-        success = db.update_actual_chain_code(kingstore_placeholder, chain_info['code'])
-        if success:
-            log_message(f"✅ Updated {kingstore_placeholder} with actual code: {chain_info['code']}")
-        else:
-            log_message(f"⚠️ Failed to update KingStore placeholder code")
+    set_discovery_status(phase='branches')
+    if 'branches' in progress:
+        branch_dict = progress['branches']['branch_dict']
+        chain_url = progress['branches']['chain_url']
+        chain_info = progress['branches']['chain_info']
+        kingstore_placeholder = progress['branches']['placeholder']
+        log_message(f"⏩ Phase 2 already done - resuming with {len(branch_dict)} KingStore branches")
     else:
-        log_message(f"⚠️ Could not find KingStore placeholder in stored chains")
+        log_message("📊 Phase 2: Getting detailed branch data for KingStore...")
+        branch_dict, chain_url, chain_info = get_food_chain_and_branches()
+        
+        if not branch_dict or not chain_info:
+            log_message("❌ Failed to get detailed KingStore data, but all chains are stored")
+            return False
+        
+        # Step 4: Find KingStore's placeholder code and update it with actual chain code
+        log_message(f"💾 Updating KingStore placeholder with actual chain code...")
+        
+        # Find KingStore in the stored chains (should be CHAIN_001 since it's first)
+        kingstore_placeholder = None
+        for chain in all_food_chains:
+            if "קינג סטור" in chain['name'] or "kingstore" in chain['url'].lower():
+                kingstore_placeholder = chain['code']
+                break
+        
+        if kingstore_placeholder:
+            # Update the existing entry with actual chain code
+            success = db.update_actual_chain_code(kingstore_placeholder, chain_info['code'])
+            if success:
+                log_message(f"✅ Updated {kingstore_placeholder} with actual code: {chain_info['code']}")
+            else:
+                log_message(f"⚠️ Failed to update KingStore placeholder code")
+        else:
+            log_message(f"⚠️ Could not find KingStore placeholder in stored chains")
+        
+        db.save_discovery_phase('branches', {
+            "branch_dict": branch_dict,
+            "chain_url": chain_url,
+            "chain_info": chain_info,
+            "placeholder": kingstore_placeholder
+        })
     
     # Step 5: Get file information for branches
+    set_discovery_status(phase='files')
     branch_files = get_files_from_table(chain_url)
     
     # Step 6: Combine branch data with file information
@@ -382,6 +464,13 @@ def discover_and_store_food_chain_data():
     chain_code_for_branches = kingstore_placeholder if kingstore_placeholder else chain_info['code']
     db.insert_branches(chain_code_for_branches, branches_for_db)
     
+    # Full and delta files currently listed, for /refresh-branch (see delta_ingest.py)
+    db.record_published_files(chain_code_for_branches, {
+        branch_code: [files["PriceFull"][0], files["PromoFull"][0]] + [name for name, _ in files["deltas"]]
+        for branch_code, files in branch_files.items()
+    })
+    db.save_discovery_phase('files', {"branches": len(branches_for_db), "branches_with_files": len(branch_files)})
+    
     # Step 8: Show database status
     status = db.get_database_status()
     log_message(f"🎉 SUCCESS: Database populated!")
@@ -389,18 +478,119 @@ def discover_and_store_food_chain_data():
         log_message(f"  📊 Chain {chain_code}: {info['name']} - {info['branches']} branches stored")
     
     log_message(f"📁 Database location: {db.db_path}")
+    publish_read_replica()
+    return True
+
+# ============================================================================
+# BACKGROUND DISCOVERY (the server answers from existing data meanwhile)
+# ============================================================================
+
+discovery_lock = threading.Lock()
+discovery_status = {
+    "state": "idle",
+    "phase": None,
+    "started_at": None,
+    "finished_at": None,
+    "error": None
+}
+
+def set_discovery_status(**fields):
+    with discovery_lock:
+        discovery_status.update(fields)
+
+def get_discovery_status():
+    with discovery_lock:
+        return dict(discovery_status)
+
+def wait_until_listening(port, timeout=30):
+    """Block until something accepts connections on localhost:port"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def run_background_discovery(wait_for_port=None, resume=True):
+    if wait_for_port and not wait_until_listening(wait_for_port):
+        log_message(f"⚠️ Server not listening on port {wait_for_port} yet - starting discovery anyway")
+    
+    try:
+        completed = discover_and_store_food_chain_data(resume=resume)
+        set_discovery_status(
+            state="complete" if completed else "failed",
+            phase=None,
+            finished_at=datetime.datetime.now().isoformat(),
+            error=None if completed else "Discovery stopped early - it will resume from the last finished phase"
+        )
+    except Exception as e:
+        log_message(f"❌ Background discovery failed: {str(e)}")
+        set_discovery_status(state="failed", finished_at=datetime.datetime.now().isoformat(), error=str(e))
+
+def start_background_discovery(wait_for_port=None, resume=True):
+    """Run discovery in a daemon thread; returns False if a run is already in progress"""
+    with discovery_lock:
+        if discovery_status["state"] == "running":
+            return False
+        discovery_status.update(
+            state="running",
+            phase=None,
+            started_at=datetime.datetime.now().isoformat(),
+            finished_at=None,
+            error=None
+        )
+    
+    thread = threading.Thread(
+        target=run_background_discovery,
+        args=(wait_for_port, resume),
+        name="chain-discovery",
+        daemon=True
+    )
+    thread.start()
+    return True
+
+@api.route('/ready')
+def ready():
+    """Readiness: 200 once branch data is available (possibly stale while discovery runs)"""
+    try:
+        branch_count = db.count_branches()
+        phases_completed = sorted(db.get_discovery_progress())
+    except Exception as e:
+        return jsonify({"ready": False, "error": str(e), "discovery": get_discovery_status()}), 503
+    
+    return jsonify({
+        "ready": branch_count > 0,
+        "branches": branch_count,
+        "discovery": get_discovery_status(),
+        "discovery_phases_completed": phases_completed
+    }), 200 if branch_count > 0 else 503
+
+def read_only_response():
+    """503 for ingest endpoints on a read-only serving worker; None when this process can write"""
+    if db.read_only:
+        return jsonify({"error": "Read-only serving worker - ingest runs in the writer process"}), 503
+    return None
 
-@app.route('/get-branches')
+@api.route('/start-discovery')
+def start_discovery():
+    """Start (or resume) discovery in the background; ?restart=1 ignores saved checkpoints"""
+    blocked = read_only_response()
+    if blocked:
+        return blocked
+    resume = request.args.get('restart') != '1'
+    started = start_background_discovery(resume=resume)
+    return jsonify({"started": started, "discovery": get_discovery_status()}), 202 if started else 409
+
+@api.route('/get-branches')
 def get_branches():
     """Return the list of all branches from database"""
     log_message("🔥 NEW REQUEST: /get-branches")
     
     try:
         # Get branches from database
-        conn = db.db.connect() if hasattr(db, 'db') else None
-        if not conn:
-            import sqlite3
-            conn = sqlite3.connect(db.db_path)
+        conn = db.connect()
         
         cursor = conn.cursor()
         cursor.execute('''
@@ -415,7 +605,10 @@ def get_branches():
         
         if not rows:
             log_message("❌ No branch data available in database!")
-            return jsonify({"error": "No branch data available. Server may still be initializing."})
+            return jsonify({
+                "error": "No branch data available. Server may still be initializing.",
+                "discovery": get_discovery_status()
+            }), 503
         
         # Convert to list of objects
         branches_list = [{
@@ -431,8 +624,6 @@ def get_branches():
     
         log_message(f"📤 Returning {len(branches_list)} branches from database (sorted by code)")
         
-        import json
-        from flask import Response
         
         # Custom formatting: compact but with each branch object on its own line
         json_str = '{\n  "branches": [\n'
@@ -447,14 +638,13 @@ def get_branches():
         log_message(f"❌ ERROR serving branches from database: {str(e)}")
         return jsonify({"error": f"Database error: {str(e)}"})
 
-@app.route('/food-chains')
+@api.route('/food-chains')
 def get_food_chains():
     """Return all food chains from database"""
     log_message("🔥 NEW REQUEST: /food-chains")
     
     try:
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
+        conn = db.connect()
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -484,7 +674,7 @@ def get_food_chains():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/status')
+@api.route('/status')
 def status():
     """Show server status and database info"""
     try:
@@ -492,6 +682,7 @@ def status():
         return jsonify({
             "status": "running",
             "database": db_status,
+            "search_cache": db.search_cache.stats(),
             "data_directory": data_directory
         })
     except Exception as e:
@@ -501,11 +692,205 @@ def status():
             "data_directory": data_directory
         })
 
+# ============================================================================
+# PRICE ANALYTICS ENDPOINTS (vectorized over the columnar products snapshot)
+# ============================================================================
+
+MAX_PAIRWISE_BRANCHES = 50
+MAX_ANALYTICS_RESULTS = 500
+
+def unknown_branches(*branches):
+    """Return the (chain_code, branch_code) pairs missing from the analytics snapshot"""
+    known = analytics.matrix().branch_index
+    return [f"{chain}/{branch}" for chain, branch in branches if (chain, branch) not in known]
+
+@api.route('/analytics/summary')
+def analytics_summary():
+    """Size of the price matrix behind the analytics endpoints"""
+    try:
+        return jsonify(analytics.summary())
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+@api.route('/analytics/spread')
+def analytics_spread():
+    """Items with the largest price spread across branches (?limit=50&min_branches=2&sort=ratio|absolute)"""
+    try:
+        limit = max(1, min(request.args.get('limit', 50, type=int), MAX_ANALYTICS_RESULTS))
+        min_branches = request.args.get('min_branches', 2, type=int)
+        sort_by = 'absolute' if request.args.get('sort') == 'absolute' else 'ratio'
+        items = analytics.price_spread(limit, min_branches, sort_by)
+        return jsonify({"total_items": len(items), "sort": sort_by, "items": items})
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+@api.route('/analytics/price-index')
+def analytics_price_index():
+    """Per-branch price index relative to the median branch (100 = typical)"""
+    try:
+        min_branches = request.args.get('min_branches', 2, type=int)
+        branches = analytics.price_index(min_branches)
+        return jsonify({"total_branches": len(branches), "branches": branches})
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+@api.route('/analytics/item/<item_code>')
+def analytics_item(item_code):
+    """Price distribution of one item across all branches"""
+    try:
+        result = analytics.item_prices(item_code)
+        if result is None:
+            return jsonify({"error": f"Item {item_code} not found"}), 404
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+@api.route('/analytics/compare/<chain_a>/<branch_a>/<chain_b>/<branch_b>')
+def analytics_compare(chain_a, branch_a, chain_b, branch_b):
+    """How much cheaper branch A is than branch B on their common catalogue"""
+    try:
+        missing = unknown_branches((chain_a, branch_a), (chain_b, branch_b))
+        if missing:
+            return jsonify({"error": f"No prices for branch {', '.join(missing)}"}), 404
+        limit = max(1, min(request.args.get('limit', 10, type=int), MAX_ANALYTICS_RESULTS))
+        return jsonify(analytics.compare_branches((chain_a, branch_a), (chain_b, branch_b), limit))
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+@api.route('/analytics/pairwise')
+def analytics_pairwise():
+    """Pairwise basket differences (?branches=CHAIN_001:1,CHAIN_001:2,...)"""
+    try:
+        branches = [tuple(value.split(':', 1)) for value in request.args.get('branches', '').split(',') if ':' in value]
+        if len(branches) < 2 or len(branches) > MAX_PAIRWISE_BRANCHES:
+            return jsonify({"error": f"Pass between 2 and {MAX_PAIRWISE_BRANCHES} branches as chain:branch"}), 400
+        missing = unknown_branches(*branches)
+        if missing:
+            return jsonify({"error": f"No prices for branch {', '.join(missing)}"}), 404
+        return jsonify(analytics.pairwise_comparison(branches))
+    except Exception as e:
+        return jsonify({"error": f"Analytics failed: {str(e)}"}), 500
+
+# ============================================================================
+# PRODUCT CATALOGUE (one entry per barcode across chains)
+# ============================================================================
+
+
+@api.route('/catalogue/search')
+def catalogue_search():
+    """Search products by name or barcode (?q=חלב&chain=CHAIN_001)"""
+    search_term = request.args.get('q', '').strip()
+    if not search_term:
+        return jsonify({"error": "Pass a search term as q"}), 400
+    try:
+        products = db.search_products(search_term, request.args.get('chain'))
+        return jsonify({"query": search_term, "total_results": len(products), "products": products})
+    except Exception as e:
+        return jsonify({"error": f"Catalogue search failed: {str(e)}"}), 500
+
+MAX_MATCH_RESULTS = 50
+
+@api.route('/catalogue/match')
+def catalogue_match():
+    """Catalogue products closest to a free-text entry, e.g. a shopping-list line (?q=חלב תנובה 1 ל&limit=5&chain=)"""
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "Pass the text to match as q"}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_MATCH_RESULTS))
+    try:
+        matches = db.match_products(text, limit, request.args.get('chain'))
+        return jsonify({"query": text, "normalized": normalize_name(text), "matches": matches})
+    except Exception as e:
+        return jsonify({"error": f"Catalogue match failed: {str(e)}"}), 500
+
+@api.route('/catalogue/<item_code>')
+def catalogue_product(item_code):
+    """A product's catalogue entry and its price range in every chain (?chain= for internal codes)"""
+    try:
+        product = db.get_catalogue_product(item_code, request.args.get('chain'))
+        if product is None:
+            return jsonify({"error": f"Product {item_code} not found in the catalogue"}), 404
+        product["chains"] = db.compare_product_across_chains(product["product_id"])
+        return jsonify(product)
+    except Exception as e:
+        return jsonify({"error": f"Catalogue lookup failed: {str(e)}"}), 500
+
+CANONICAL_UNITS = ('kg', 'l', 'unit', 'm')
+MAX_UNIT_PRICE_RESULTS = 200
+
+@api.route('/products/cheapest-per-unit/<unit>')
+def cheapest_per_unit(unit):
+    """Lowest price per kg / l / unit / m across branches (?limit=20&chain=CHAIN_001)"""
+    if unit not in CANONICAL_UNITS:
+        return jsonify({"error": f"Unit must be one of {', '.join(CANONICAL_UNITS)}"}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_UNIT_PRICE_RESULTS)
+    try:
+        products = db.cheapest_per_unit(unit, limit, request.args.get('chain'))
+        return jsonify({"unit": unit, "total_results": len(products), "products": products})
+    except Exception as e:
+        return jsonify({"error": f"Unit price lookup failed: {str(e)}"}), 500
+
+# ============================================================================
+# BRANCH LOCATIONS
+# ============================================================================
+
+MAX_NEARBY_BRANCHES = 100
+DEFAULT_NEARBY_BRANCHES = 10
+
+@api.route('/branches/nearby')
+def branches_nearby():
+    """
+    Branches around a point (?lat=32.08&lon=34.78), either every branch within
+    radius_km or the k nearest (default 10). items=code1,code2 prices that
+    basket at each branch found.
+    """
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({"error": "Pass lat and lon in decimal degrees"}), 400
+    radius_km = request.args.get('radius_km', type=float)
+    k = request.args.get('k', type=int)
+    if radius_km is not None and radius_km <= 0:
+        return jsonify({"error": "radius_km must be positive"}), 400
+    k = min(max(k or (MAX_NEARBY_BRANCHES if radius_km else DEFAULT_NEARBY_BRANCHES), 1), MAX_NEARBY_BRANCHES)
+    item_codes = [code for code in request.args.get('items', '').split(',') if code]
+    
+    try:
+        start = time.perf_counter()
+        if radius_km is None:
+            branches = hierarchical_db.nearest_branches(latitude, longitude, k)
+        else:
+            branches = hierarchical_db.branches_in_radius(latitude, longitude, radius_km)[:k]
+        lookup_ms = (time.perf_counter() - start) * 1000
+        
+        result = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "radius_km": radius_km,
+            "total_branches": len(branches),
+            "lookup_ms": round(lookup_ms, 3),
+            "branches": branches
+        }
+        
+        if item_codes and branches:
+            baskets = analytics.basket_totals(
+                item_codes, [(branch["chain_code"], branch["branch_code"]) for branch in branches])
+            for branch, basket in zip(branches, baskets):
+                branch.update(basket)
+            complete = [branch for branch in branches if not branch["missing_items"]]
+            result["items"] = item_codes
+            result["cheapest_complete_basket"] = min(
+                complete, key=lambda branch: (branch["basket_total"], branch["distance_km"]), default=None)
+        
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": f"Nearby branch lookup failed: {str(e)}"}), 500
+
 # ============================================================================
 # HIERARCHICAL DATABASE ENDPOINTS FOR HTML VIEWER
 # ============================================================================
 
-@app.route('/hierarchical-overview')
+@api.route('/hierarchical-overview')
 def get_hierarchical_overview():
     """Get complete hierarchical database overview"""
     try:
@@ -516,12 +901,11 @@ def get_hierarchical_overview():
             "error": f"Failed to get database overview: {str(e)}"
         })
 
-@app.route('/hierarchical-chain/<chain_code>')
+@api.route('/hierarchical-chain/<chain_code>')
 def get_chain_branches(chain_code):
     """Get all branches for a specific chain"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(hierarchical_db.db_path)
+        conn = hierarchical_db.connect()
         cursor = conn.cursor()
         
         # Get branches for this chain
@@ -560,7 +944,7 @@ def get_chain_branches(chain_code):
             "error": f"Failed to get branches for {chain_code}: {str(e)}"
         })
 
-@app.route('/hierarchical-viewer')
+@api.route('/hierarchical-viewer')
 def serve_hierarchical_viewer():
     """Serve the hierarchical database viewer HTML page"""
     try:
@@ -570,12 +954,11 @@ def serve_hierarchical_viewer():
     except Exception as e:
         return f"Error loading viewer: {str(e)}", 500
 
-@app.route('/hierarchical-branch/<chain_code>/<branch_code>')
+@api.route('/hierarchical-branch/<chain_code>/<branch_code>')
 def get_branch_products(chain_code, branch_code):
     """Get products for a specific branch"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(hierarchical_db.db_path)
+        conn = hierarchical_db.connect()
         cursor = conn.cursor()
         
         # Get branch metadata
@@ -686,11 +1069,11 @@ def get_branch_products(chain_code, branch_code):
 # PHASE 1: DOWNLOAD, DECOMPRESS, AND PARSE BRANCH DATA
 # ============================================================================
 
-import requests
-import gzip
-import xml.etree.ElementTree as ET
-import os
-import sqlite3
+from xml_stream import open_xml_stream, read_xml_text
+from chain_formats import get_chain_format
+from parallel_parse import parse_price_file
+from records import normalize_product, normalize_promotion, record_to_dict
+from file_archive import archive_file, archived_file
 
 def download_branch_files(branch_code, price_filename, promo_filename):
     """Download actual files from KingStore website"""
@@ -709,8 +1092,6 @@ def download_branch_files(branch_code, price_filename, promo_filename):
         from selenium.webdriver.support.ui import WebDriverWait
         from selenium.webdriver.support import expected_conditions as EC
         from webdriver_manager.chrome import ChromeDriverManager
-        import os
-        import time
         
         # Configure Chrome options for download with anti-bot measures
         chrome_options = Options()
@@ -738,7 +1119,6 @@ def download_branch_files(branch_code, price_filename, promo_filename):
         
         # Clean up old duplicate files before downloading
         print("🗑️ Cleaning up old duplicate files...")
-        import glob
         duplicate_files = glob.glob(os.path.join(download_dir, "*(*)*"))
         for file_path in duplicate_files:
             os.remove(file_path)
@@ -836,139 +1216,85 @@ def download_branch_files(branch_code, price_filename, promo_filename):
             driver.quit()
         return None
 
+def fetch_branch_files(branch_code, price_filename, promo_filename):
+    """
+    Paths of a branch's Price/Promo files: the archived copies when the archive
+    has them (retries and replays fetch nothing), otherwise fresh downloads,
+    which are archived on the way in (see file_archive.py).
+    """
+    wanted = {'price_file': price_filename, 'promo_file': promo_filename}
+    files = {key: archived_file(db, file_name) for key, file_name in wanted.items()}
+    files = {key: path for key, path in files.items() if path}
+    missing = {key: file_name for key, file_name in wanted.items() if file_name and key not in files}
+    if not missing:
+        return files
+    
+    downloaded = download_branch_files(branch_code, missing.get('price_file', ''), missing.get('promo_file', '')) or {}
+    for key in missing:
+        path = downloaded.get(key)
+        if not path or not os.path.exists(path):
+            continue
+        files[key] = path
+        try:
+            archive_file(db, 'CHAIN_001', branch_code, path)
+        except Exception as e:
+            print(f"⚠️ Archiving {os.path.basename(path)} failed: {str(e)}")
+    return files
+
 def decompress_gz_file(filepath):
-    """Read XML file (handles .gz, .zip, and regular .xml files)"""
+    """Read XML file as text (handles .gz, .zip, and regular .xml files)
+
+    Prefer open_xml_stream() for parsing - it feeds the decompressed bytes
+    straight into the parser without building a str copy of the document.
+    """
     print(f"📦 Reading file: {filepath}")
     
     try:
-        # Check file signature to determine actual format
-        with open(filepath, 'rb') as f:
-            signature = f.read(2)
-        
-        if signature == b'PK':
-            # ZIP file (common for government data files)
-            print("🗜️ Detected ZIP file, extracting...")
-            import zipfile
-            with zipfile.ZipFile(filepath, 'r') as zip_file:
-                # Get the first XML file in the zip
-                xml_files = [name for name in zip_file.namelist() if name.endswith('.xml')]
-                if xml_files:
-                    with zip_file.open(xml_files[0]) as xml_file:
-                        xml_content = xml_file.read().decode('utf-8')
-                else:
-                    raise Exception("No XML file found in ZIP archive")
-                    
-        elif signature == b'\x1f\x8b':
-            # Gzip file
-            print("🗜️ Detected gzip file, decompressing...")
-            with gzip.open(filepath, 'rt', encoding='utf-8') as f:
-                xml_content = f.read()
-        else:
-            # Regular XML file
-            print("📄 Regular XML file, reading directly...")
-            with open(filepath, 'r', encoding='utf-8') as f:
-                xml_content = f.read()
-                
+        xml_content = read_xml_text(filepath)
         print(f"✅ File read successfully, XML size: {len(xml_content)} characters")
         return xml_content
     except Exception as e:
         print(f"❌ Error reading {filepath}: {str(e)}")
         return None
 
-def parse_price_xml(xml_content):
-    """Parse PriceFull XML and return list of products"""
+def parse_xml_root(xml_source):
+    """Parse XML from a str/bytes document or a binary stream from open_xml_stream()"""
+    if isinstance(xml_source, (str, bytes)):
+        return ET.fromstring(xml_source)
+    return ET.parse(xml_source).getroot()
+
+def parse_price_xml(xml_content, chain_format=None):
+    """Parse PriceFull XML (document or binary stream) and return a list of ProductRecords
+
+    The chain's layout comes from the chain_formats registry; when no format is
+    given it is detected from the document structure.
+    """
     print("🔍 Parsing PriceFull XML...")
     
     try:
-        root = ET.fromstring(xml_content)
-        products = []
+        root = parse_xml_root(xml_content)
+        if chain_format is None:
+            chain_format = get_chain_format(root=root)
         
-        # Extract metadata
-        chain_id = root.find('ChainId').text if root.find('ChainId') is not None else ""
-        store_id = root.find('StoreId').text if root.find('StoreId') is not None else ""
-        
-        # Parse items
-        items = root.find('Items')
-        if items is not None:
-            for item in items.findall('Item'):
-                product = {
-                    'chain_id': chain_id,
-                    'store_id': store_id,
-                    'item_code': get_xml_text(item, 'ItemCode'),
-                    'item_name': get_xml_text(item, 'ItemNm'),
-                    'manufacturer_name': get_xml_text(item, 'ManufacturerName'),
-                    'manufacturer_item_description': get_xml_text(item, 'ManufacturerItemDescription'),
-                    'unit_qty': get_xml_text(item, 'UnitQty'),
-                    'quantity': get_xml_text(item, 'Quantity'),
-                    'unit_of_measure': get_xml_text(item, 'UnitOfMeasure'),
-                    'is_weighted': get_xml_text(item, 'bIsWeighted'),
-                    'qty_in_package': get_xml_text(item, 'QtyInPackage'),
-                    'item_price': get_xml_text(item, 'ItemPrice'),
-                    'unit_of_measure_price': get_xml_text(item, 'UnitOfMeasurePrice'),
-                    'allow_discount': get_xml_text(item, 'AllowDiscount'),
-                    'item_status': get_xml_text(item, 'ItemStatus'),
-                    'manufacture_country': get_xml_text(item, 'ManufactureCountry'),
-                    'price_update_date': get_xml_text(item, 'PriceUpdateDate')
-                }
-                products.append(product)
-        
-        print(f"✅ Parsed {len(products)} products from PriceFull XML")
+        products = chain_format.parse_products(root)
+        
+        print(f"✅ Parsed {len(products)} products from PriceFull XML ({chain_format.name} format)")
         return products
         
     except Exception as e:
         print(f"❌ Error parsing PriceFull XML: {str(e)}")
         return []
 
-def parse_promo_xml(xml_content):
-    """Parse PromoFull XML and return list of promotions"""
+def parse_promo_xml(xml_content, chain_format=None):
+    """Parse PromoFull XML (document or binary stream) and return a list of PromotionRecords"""
     print("🎯 Parsing PromoFull XML...")
     
     try:
-        root = ET.fromstring(xml_content)
-        promotions = []
+        root = parse_xml_root(xml_content)
+        if chain_format is None:
+            chain_format = get_chain_format(root=root)
         
-        # Extract metadata
-        chain_id = root.find('ChainId').text if root.find('ChainId') is not None else ""
-        store_id = root.find('StoreId').text if root.find('StoreId') is not None else ""
-        
-        # Parse promotions
-        promos = root.find('Promotions')
-        if promos is not None:
-            for promo in promos.findall('Promotion'):
-                promotion = {
-                    'chain_id': chain_id,
-                    'store_id': store_id,
-                    'promotion_id': get_xml_text(promo, 'PromotionId'),
-                    'promotion_description': get_xml_text(promo, 'PromotionDescription'),
-                    'promotion_update_date': get_xml_text(promo, 'PromotionUpdateDate'),
-                    'promotion_start_date': get_xml_text(promo, 'PromotionStartDate'),
-                    'promotion_start_hour': get_xml_text(promo, 'PromotionStartHour'),
-                    'promotion_end_date': get_xml_text(promo, 'PromotionEndDate'),
-                    'promotion_end_hour': get_xml_text(promo, 'PromotionEndHour'),
-                    'discounted_price': get_xml_text(promo, 'DiscountedPrice'),
-                    'discounted_price_per_unit': get_xml_text(promo, 'DiscountedPricePerMida'),
-                    'discount_rate': get_xml_text(promo, 'DiscountRate'),
-                    'min_quantity': get_xml_text(promo, 'MinQty'),
-                    'max_quantity': get_xml_text(promo, 'MaxQty'),
-                    'min_purchase_amount': get_xml_text(promo, 'MinPurchaseAmnt'),
-                    'allow_multiple_discounts': get_xml_text(promo, 'AllowMultipleDiscounts'),
-                    'reward_type': get_xml_text(promo, 'RewardType'),
-                    'discount_type': get_xml_text(promo, 'DiscountType'),
-                    'remarks': get_xml_text(promo, 'Remarks'),
-                    'items': []
-                }
-                
-                # Parse promotion items
-                promo_items = promo.find('PromotionItems')
-                if promo_items is not None:
-                    for item in promo_items.findall('Item'):
-                        promotion['items'].append({
-                            'item_code': get_xml_text(item, 'ItemCode'),
-                            'is_gift_item': get_xml_text(item, 'IsGiftItem'),
-                            'item_type': get_xml_text(item, 'ItemType')
-                        })
-                
-                promotions.append(promotion)
+        promotions = chain_format.parse_promotions(root)
         
         print(f"✅ Parsed {len(promotions)} promotions from PromoFull XML")
         return promotions
@@ -977,22 +1303,26 @@ def parse_promo_xml(xml_content):
         print(f"❌ Error parsing PromoFull XML: {str(e)}")
         return []
 
-def get_xml_text(element, tag_name):
-    """Helper function to safely get text from XML element"""
-    child = element.find(tag_name)
-    return child.text if child is not None else ""
+def refresh_products_snapshot():
+    """Queue a re-export of the columnar snapshot used by analytics after products changed"""
+    snapshot_exporter.request()
 
-@app.route('/process-branch/<branch_code>')
+def publish_read_replica():
+    """Queue a fresh read replica of food_chains.db for the serving workers (see read_replica.py)"""
+    if READ_REPLICAS and not db.read_only:
+        replica_publisher.request()
+
+@api.route('/process-branch/<branch_code>')
 def process_branch(branch_code):
     """Download, decompress, and parse data for a specific branch"""
     log_message(f"🚀 NEW REQUEST: /process-branch/{branch_code}")
+    blocked = read_only_response()
+    if blocked:
+        return blocked
     
     try:
         # Get branch info from database
-        conn = db.db.connect() if hasattr(db, 'db') else None
-        if not conn:
-            import sqlite3
-            conn = sqlite3.connect(db.db_path)
+        conn = db.connect()
         
         cursor = conn.cursor()
         cursor.execute('''
@@ -1009,8 +1339,8 @@ def process_branch(branch_code):
         
         _, branch_name, price_filename, promo_filename = row
         
-        # Step 1: Download files
-        downloaded_files = download_branch_files(branch_code, price_filename, promo_filename)
+        # Step 1: Download files (archived copies are used when present)
+        downloaded_files = fetch_branch_files(branch_code, price_filename, promo_filename)
         
         if not downloaded_files:
             return jsonify({"error": "Failed to download any files"})
@@ -1023,237 +1353,96 @@ def process_branch(branch_code):
             "files_processed": [],
             "debug_info": []
         }
+        # Parse and write failures; any of them makes the response an error (the scheduler retries)
+        errors = []
         
-        # Step 2 & 3: Decompress and parse PriceFull
+        # Step 2 & 3: Decompress and parse PriceFull (large files are split across processes)
         if 'price_file' in downloaded_files:
-            xml_content = decompress_gz_file(downloaded_files['price_file'])
-            if xml_content:
-                products = parse_price_xml(xml_content)
+            try:
+                print(f"📦 Parsing file: {downloaded_files['price_file']}")
+                products = parse_price_file(downloaded_files['price_file'])
+                print(f"✅ Parsed {len(products)} products from PriceFull file")
                 results['products'] = products
                 results['files_processed'].append(price_filename)
+                if not products and os.path.getsize(downloaded_files['price_file']):
+                    errors.append(f"PriceFull {price_filename} yielded no products")
+            except Exception as e:
+                print(f"❌ Error reading {downloaded_files['price_file']}: {str(e)}")
+                errors.append(f"PriceFull {price_filename} could not be parsed: {str(e)}")
         
-        # Step 2 & 3: Decompress and parse PromoFull  
+        # Step 2 & 3: Decompress and parse PromoFull (parse errors must surface, as for deltas)
         if 'promo_file' in downloaded_files:
-            xml_content = decompress_gz_file(downloaded_files['promo_file'])
-            if xml_content:
-                promotions = parse_promo_xml(xml_content)
+            try:
+                print(f"📦 Streaming file: {downloaded_files['promo_file']}")
+                with open_xml_stream(downloaded_files['promo_file']) as xml_stream:
+                    root = parse_xml_root(xml_stream)
+                promotions = get_chain_format(root=root).parse_promotions(root)
+                print(f"✅ Parsed {len(promotions)} promotions from PromoFull file")
                 results['promotions'] = promotions
                 results['files_processed'].append(promo_filename)
+            except Exception as e:
+                print(f"❌ Error reading {downloaded_files['promo_file']}: {str(e)}")
+                errors.append(f"PromoFull {promo_filename} could not be parsed: {str(e)}")
         
-        # Step 4: INSERT INTO DATABASE with proper relationships
+        # Step 4: INSERT INTO BOTH DATABASES in one transaction (see branch_writer.py)
         database_results = {
             "products_inserted": 0,
             "promotions_inserted": 0,
             "promotion_items_inserted": 0
         }
         
-        if results['products'] or results['promotions']:
-            print(f"💾 Step 4: Inserting data into database for Branch {branch_code}")
+        if errors:
+            # A Full load replaces the branch, so a file that failed to parse must not be written as empty
+            print(f"❌ Branch {branch_code} not written: {'; '.join(errors)}")
+        elif results['files_processed']:
+            print(f"💾 Step 4: Inserting data into both databases for Branch {branch_code}")
             
-            # Insert products with clear chain/branch relationship
-            if results['products']:
-                try:
-                    # Convert field names to match database method expectations
-                    db_products = []
-                    for product in results['products']:
-                        db_product = {
-                            'ItemCode': product['item_code'],
-                            'ItemNm': product['item_name'], 
-                            'ManufacturerName': product['manufacturer_name'],
-                            'ManufacturerItemDescription': product['manufacturer_item_description'],
-                            'ItemPrice': product['item_price'],
-                            'UnitOfMeasurePrice': product['unit_of_measure_price'] or product['item_price'],
-                            'UnitQty': product['unit_qty'] or 'יחידה',
-                            'Quantity': product['quantity'] or '1',
-                            'UnitOfMeasure': product['unit_of_measure'] or 'יחידה',
-                            'bIsWeighted': product['is_weighted'] or '0',
-                            'QtyInPackage': product['qty_in_package'] or '1',
-                            'AllowDiscount': product['allow_discount'] or '1',
-                            'ItemStatus': product['item_status'] or '1',
-                            'ManufactureCountry': 'IL',
-                            'PriceUpdateDate': product['price_update_date']
-                        }
-                        db_products.append(db_product)
-                    
-                    # Call with correct parameters: chain_code, branch_code, products_data
-                    db.insert_products('CHAIN_001', branch_code, db_products)
-                    database_results["products_inserted"] = len(db_products)
-                    print(f"✅ Inserted {len(db_products)} products for Branch {branch_code} → CHAIN_001 (KingStore)")
-                    
-                    # ========================================
-                    # POPULATE HIERARCHICAL DATABASE
-                    # ========================================
-                    try:
-                        # Ensure KingStore exists in hierarchical DB
-                        hierarchical_db.add_food_chain(
-                            'CHAIN_001', 
-                            'אלמשהדאוי קינג סטור בע"מ',
-                            'https://kingstore.binaprojects.com/Main.aspx'
-                        )
-                        
-                        # Get branch name from database
-                        import sqlite3
-                        conn = sqlite3.connect(db.db_path)
-                        cursor = conn.cursor()
-                        cursor.execute('SELECT branch_name FROM branches WHERE branch_code = ?', (branch_code,))
-                        branch_result = cursor.fetchone()
-                        branch_name = branch_result[0] if branch_result else f'Branch {branch_code}'
-                        conn.close()
-                        
-                        # Ensure branch exists in hierarchical DB
-                        hierarchical_db.add_branch_to_chain(
-                            'CHAIN_001', branch_code, branch_name,
-                            price_filename, promo_filename
-                        )
-                        
-                        # Convert products for hierarchical DB
-                        hierarchical_products = []
-                        for product in results['products']:
-                            hierarchical_product = {
-                                'item_code': product['item_code'],
-                                'item_name': product['item_name'],
-                                'manufacturer_name': product['manufacturer_name'],
-                                'item_price': product['item_price'],
-                                'unit_of_measure': product['unit_of_measure'],
-                                'quantity': product['quantity'],
-                                'price_update_date': product['price_update_date']
-                            }
-                            hierarchical_products.append(hierarchical_product)
-                        
-                        # Insert products into hierarchical structure
-                        hierarchical_count = hierarchical_db.insert_branch_products(
-                            'CHAIN_001', branch_code, hierarchical_products
-                        )
-                        
-                        print(f"🏗️ Hierarchical DB: {hierarchical_count} products inserted into branch table")
-                        
-                        # ========================================
-                        # INSERT PROMOTIONS INTO HIERARCHICAL DB
-                        # ========================================
-                        if results['promotions']:
-                            try:
-                                # Convert promotions for hierarchical DB
-                                hierarchical_promotions = []
-                                for promotion in results['promotions']:
-                                    hierarchical_promotion = {
-                                        'promotion_id': promotion['promotion_id'],
-                                        'promotion_description': promotion['promotion_description'],
-                                        'promotion_update_date': promotion['promotion_update_date'],
-                                        'promotion_start_date': promotion['promotion_start_date'],
-                                        'promotion_start_hour': promotion['promotion_start_hour'],
-                                        'promotion_end_date': promotion['promotion_end_date'],
-                                        'promotion_end_hour': promotion['promotion_end_hour'],
-                                        'discounted_price': promotion['discounted_price'],
-                                        'discounted_price_per_unit': promotion['discounted_price_per_unit'],
-                                        'discount_rate': promotion['discount_rate'],
-                                        'min_quantity': promotion['min_quantity'],
-                                        'max_quantity': promotion['max_quantity'],
-                                        'min_purchase_amount': promotion['min_purchase_amount'],
-                                        'allow_multiple_discounts': promotion['allow_multiple_discounts'],
-                                        'reward_type': promotion['reward_type'],
-                                        'discount_type': promotion['discount_type'],
-                                        'remarks': promotion['remarks'],
-                                        'items': promotion['items']
-                                    }
-                                    hierarchical_promotions.append(hierarchical_promotion)
-                                
-                                # Insert promotions into hierarchical structure
-                                hierarchical_promo_count = hierarchical_db.insert_branch_promotions(
-                                    'CHAIN_001', branch_code, hierarchical_promotions
-                                )
-                                
-                                print(f"🏗️ Hierarchical DB: {hierarchical_promo_count} promotions inserted into branch table")
-                                
-                            except Exception as hier_promo_error:
-                                print(f"⚠️ Hierarchical DB promotion insertion failed: {str(hier_promo_error)}")
-                        
-                    except Exception as hier_error:
-                        print(f"⚠️ Hierarchical DB insertion failed: {str(hier_error)}")
-                    
-                except Exception as e:
-                    print(f"❌ Error inserting products: {str(e)}")
-            
-            # Insert promotions with clear chain/branch relationship  
+            # DEBUG: Add info to response
             if results['promotions']:
-                try:
-                    # Convert field names to match database method expectations
-                    db_promotions = []
-                    for promotion in results['promotions']:
-                        # Fix promotion items field names
-                        fixed_items = []
-                        for item in promotion.get('items', []):
-                            fixed_item = {
-                                'ItemCode': item.get('item_code', ''),
-                                'IsGiftItem': item.get('is_gift_item', '0'),
-                                'ItemType': item.get('item_type', '1')
-                            }
-                            fixed_items.append(fixed_item)
-                        
-                        # Helper function to ensure valid numeric values
-                        def safe_num(val, default='0', as_int=False):
-                            if not val or not val.strip():
-                                return default
-                            try:
-                                if as_int:
-                                    # Convert to float first, then to int to handle '1.1' -> 1
-                                    return str(int(float(val.strip())))
-                                else:
-                                    return val.strip()
-                            except (ValueError, TypeError):
-                                return default
-                        
-                        db_promo = {
-                            'PromotionId': promotion['promotion_id'] or '0',
-                            'PromotionDescription': promotion['promotion_description'] or 'No description',
-                            'PromotionStartDate': promotion['promotion_start_date'] or '2025-01-01',
-                            'PromotionStartHour': '00:00:00',  # Default hour
-                            'PromotionEndDate': promotion['promotion_end_date'] or '2025-12-31',
-                            'PromotionEndHour': '23:59:00',    # Default hour
-                            'RewardType': safe_num(promotion['reward_type'], '1', as_int=True),
-                            'DiscountType': '1',  # Default discount type
-                            'DiscountRate': safe_num(promotion['discount_rate'], '0.00'),
-                            'DiscountedPrice': safe_num(promotion['discounted_price'], '0.00'),
-                            'DiscountedPricePerMida': safe_num(promotion['discounted_price'], '0.00'),
-                            'MinQty': safe_num(promotion['min_qty'], '1', as_int=True),
-                            'MaxQty': safe_num(promotion['max_qty'], '0', as_int=True),
-                            'MinPurchaseAmnt': '0.00',  # Default minimum purchase
-                            'PromotionUpdateDate': promotion['promotion_update_date'] or '2025-01-01 00:00:00',
-                            'PromotionItems': fixed_items  # Fixed promotion items with correct field names
-                        }
-                        db_promotions.append(db_promo)
-                    
-                    # DEBUG: Add info to response
-                    results['debug_info'].append(f"About to insert {len(db_promotions)} promotions")
-                    for i, p in enumerate(db_promotions[:1]):  # Show first one
-                        results['debug_info'].append(f"Promotion {i+1}: {p['PromotionId']} - {p['PromotionDescription']}")
-                        results['debug_info'].append(f"Items: {len(p.get('PromotionItems', []))}")
-                    
-                    # Call with correct parameters: chain_code, branch_code, promotions_data
-                    try:
-                        db.insert_promotions('CHAIN_001', branch_code, db_promotions)
-                        database_results["promotions_inserted"] = len(db_promotions)
-                        # Count total promotion items
-                        total_items = sum(len(promo.get('PromotionItems', [])) for promo in db_promotions)
-                        database_results["promotion_items_inserted"] = total_items
-                        
-                        results['debug_info'].append(f"SUCCESS: Inserted {len(db_promotions)} promotions")
-                        results['debug_info'].append(f"SUCCESS: Inserted {total_items} promotion items")
-                    except Exception as insert_error:
-                        results['debug_info'].append(f"ERROR: Promotion insertion failed: {str(insert_error)}")
-                        database_results["promotions_inserted"] = 0
-                        database_results["promotion_items_inserted"] = 0
-                    
-                except Exception as e:
-                    print(f"❌ Error inserting promotions: {str(e)}")
+                results['debug_info'].append(f"About to insert {len(results['promotions'])} promotions")
+                for i, p in enumerate(results['promotions'][:1]):  # Show first one
+                    results['debug_info'].append(f"Promotion {i+1}: {p.promotion_id} - {p.promotion_description}")
+                    results['debug_info'].append(f"Items: {len(p.items)}")
+            
+            try:
+                # One commit for the flat and hierarchical rows; any failure rolls back both
+                database_results = branch_writer.write_branch(
+                    'CHAIN_001',
+                    'אלמשהדאוי קינג סטור בע"מ',
+                    'https://kingstore.binaprojects.com/Main.aspx',
+                    branch_code, branch_name, price_filename, promo_filename,
+                    # None for a file that was not downloaded, so it is not recorded as applied
+                    results['products'] if price_filename in results['files_processed'] else None,
+                    results['promotions'] if promo_filename in results['files_processed'] else None
+                )
+                print(f"✅ Inserted {database_results['products_inserted']} products for Branch {branch_code} → CHAIN_001 (KingStore)")
+                if results['promotions']:
+                    results['debug_info'].append(f"SUCCESS: Inserted {database_results['promotions_inserted']} promotions")
+                    results['debug_info'].append(f"SUCCESS: Inserted {database_results['promotion_items_inserted']} promotion items")
+            except Exception as e:
+                print(f"❌ Error inserting branch data, both databases rolled back: {str(e)}")
+                results['debug_info'].append(f"ERROR: Branch insertion failed: {str(e)}")
+                errors.append(f"Branch insertion failed: {str(e)}")
         
         results['database_insertion'] = database_results
         
+        # Step 5: Refresh the columnar snapshot used by analytics and the read replica
+        if database_results["products_inserted"]:
+            refresh_products_snapshot()
+        if database_results["products_inserted"] or database_results["promotions_inserted"]:
+            publish_read_replica()
+        
         print(f"🎉 COMPLETE: Branch {branch_code} pipeline finished!")
         print(f"   📦 Products parsed: {len(results['products'])}")
         print(f"   🎯 Promotions parsed: {len(results['promotions'])}")
         print(f"   💾 Products in DB: {database_results['products_inserted']}")
         print(f"   💾 Promotions in DB: {database_results['promotions_inserted']}")
         
+        results['products'] = [record_to_dict(product) for product in results['products']]
+        results['promotions'] = [record_to_dict(promotion) for promotion in results['promotions']]
+        
+        if errors:
+            return jsonify({"error": f"Failed to process branch {branch_code}: {'; '.join(errors)}", "data": results})
         return jsonify({
             "success": True,
             "message": f"Successfully processed and stored branch {branch_code}",
@@ -1264,35 +1453,287 @@ def process_branch(branch_code):
         log_message(f"❌ Error processing branch {branch_code}: {str(e)}")
         return jsonify({"error": f"Failed to process branch {branch_code}: {str(e)}"})
 
+# ============================================================================
+# DELTA INGEST: Price/Promo FILES ON TOP OF THE LAST FULL SNAPSHOT
+# ============================================================================
+
+from delta_ingest import plan_refresh
+
+def apply_delta_file(branch_code, published):
+    """Download, parse and upsert one Price/Promo delta file into both databases; returns the records applied"""
+    if published.file_kind == 'price':
+        downloaded = fetch_branch_files(branch_code, published.file_name, '')
+        path = downloaded.get('price_file')
+    else:
+        downloaded = fetch_branch_files(branch_code, '', published.file_name)
+        path = downloaded.get('promo_file')
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"{published.file_name} was not downloaded")
+    
+    if published.file_kind == 'price':
+        products = parse_price_file(path)
+        branch_writer.write_branch('CHAIN_001', None, None, branch_code, None,
+                                   price_file=published.file_name, products=products, delta=True)
+        applied = len(products)
+    else:
+        # Parse errors must surface here: a skipped delta file is a gap
+        with open_xml_stream(path) as xml_stream:
+            root = parse_xml_root(xml_stream)
+        promotions = get_chain_format(root=root).parse_promotions(root)
+        branch_writer.write_branch('CHAIN_001', None, None, branch_code, None,
+                                   promo_file=published.file_name, promotions=promotions, delta=True)
+        applied = len(promotions)
+    
+    print(f"🔁 Applied {published.file_name}: {applied} {published.file_kind} records for branch {branch_code}")
+    return applied
+
+def apply_branch_updates(branch_code):
+    """
+    Bring one branch up to date from the published file listing: apply the
+    pending delta files in order, or reload it from its Full files when the
+    deltas cannot be chained onto what was loaded (see delta_ingest.py).
+    """
+    published = db.get_published_files('CHAIN_001', branch_code)
+    state = db.get_ingest_state('CHAIN_001', branch_code)
+    plans = {kind: plan_refresh(state.get(kind), [f for f in published if f.file_kind == kind])
+             for kind in ('price', 'promo')}
+    result = {
+        "branch_code": branch_code,
+        "plans": {kind: {"mode": plan.mode, "files": [f.file_name for f in plan.files], "reason": plan.reason}
+                  for kind, plan in plans.items()},
+        "deltas_applied": [],
+        "records_applied": 0,
+    }
+    
+    full_reason = next((f"{kind}: {plan.reason}" for kind, plan in plans.items() if plan.mode == 'full'), None)
+    for kind, plan in plans.items():
+        if full_reason or plan.mode != 'delta':
+            continue
+        for published_file in plan.files:
+            try:
+                result["records_applied"] += apply_delta_file(branch_code, published_file)
+                result["deltas_applied"].append(published_file.file_name)
+            except Exception as e:
+                full_reason = f"{kind}: delta {published_file.file_name} failed ({str(e)})"
+                break
+    
+    if full_reason:
+        log_message(f"🔄 Branch {branch_code}: Full reload - {full_reason}")
+        full_files = {plan.files[0].file_kind: plan.files[0].file_name
+                      for plan in plans.values() if plan.mode == 'full' and plan.files}
+        if full_files:
+            db.update_branch_files('CHAIN_001', branch_code, full_files.get('price'), full_files.get('promo'))
+        result["full_reload"] = full_reason
+        result["full_result"] = process_branch(branch_code).get_json()
+    elif result["deltas_applied"]:
+        refresh_products_snapshot()
+        publish_read_replica()
+    return result
+
+@api.route('/refresh-branch/<branch_code>')
+def refresh_branch(branch_code):
+    """Apply a branch's Price/Promo delta files, falling back to a Full reload on gaps"""
+    log_message(f"🚀 NEW REQUEST: /refresh-branch/{branch_code}")
+    blocked = read_only_response()
+    if blocked:
+        return blocked
+    
+    try:
+        return jsonify({"success": True, "data": apply_branch_updates(branch_code)})
+    except Exception as e:
+        log_message(f"❌ Error refreshing branch {branch_code}: {str(e)}")
+        return jsonify({"error": f"Failed to refresh branch {branch_code}: {str(e)}"})
+
+# ============================================================================
+# REPLAY: RE-INGEST A BRANCH AS OF AN EARLIER TIME FROM THE FILE ARCHIVE
+# ============================================================================
+
+from delta_ingest import parse_file_name
+from file_archive import replay_files
+
+@api.route('/replay-branch/<branch_code>')
+def replay_branch(branch_code):
+    """
+    Rebuild a branch from archived files as of ?as_of=YYYYMMDDHHMM: its last
+    Full files up to then, plus the delta files after them. Nothing is
+    downloaded. The next scheduled refresh moves the branch forward again.
+    """
+    log_message(f"🚀 NEW REQUEST: /replay-branch/{branch_code}")
+    blocked = read_only_response()
+    if blocked:
+        return blocked
+    
+    as_of = request.args.get('as_of', '')
+    if not re.fullmatch(r'\d{12}', as_of):
+        return jsonify({"error": "as_of must be a YYYYMMDDHHMM timestamp"}), 400
+    plan = replay_files(db, 'CHAIN_001', branch_code, as_of)
+    if not plan:
+        return jsonify({"error": f"No archived Full file for branch {branch_code} as of {as_of}"}), 404
+    
+    try:
+        full_files = {file_kind: file_names[0] for file_kind, file_names in plan.items()}
+        db.update_branch_files('CHAIN_001', branch_code, full_files.get('price'), full_files.get('promo'))
+        full_result = process_branch(branch_code).get_json()
+        if "error" in full_result:
+            # Deltas on top of a Full load that failed would be a gap, as in apply_branch_updates
+            return jsonify({"error": f"Full replay of branch {branch_code} failed, no deltas applied",
+                            "as_of": as_of, "files": plan, "deltas_applied": [], "full_result": full_result})
+        deltas_applied = []
+        for file_names in plan.values():
+            for file_name in file_names[1:]:
+                apply_delta_file(branch_code, parse_file_name(file_name))
+                deltas_applied.append(file_name)
+        if deltas_applied:
+            refresh_products_snapshot()
+            publish_read_replica()
+        return jsonify({"success": True, "as_of": as_of, "files": plan,
+                        "deltas_applied": deltas_applied, "full_result": full_result})
+    except Exception as e:
+        log_message(f"❌ Error replaying branch {branch_code}: {str(e)}")
+        return jsonify({"error": f"Failed to replay branch {branch_code}: {str(e)}"})
+
+# ============================================================================
+# REFRESH SCHEDULER: RE-LIST CHAINS, INGEST BRANCHES WITH NEW FILES
+# ============================================================================
+
+from refresh_scheduler import DEFAULT_INTERVAL_MINUTES, RefreshScheduler
+
+# Chains the ingest path handles (process_branch / apply_branch_updates write CHAIN_001)
+SCHEDULED_CHAINS = ('CHAIN_001',)
+refresh_scheduler = None
+
+def list_chain_files(chain_code):
+    """Re-read a chain's file table, store the listing and point branches at their latest Full files"""
+    chain = next((chain for chain in db.get_food_chains() if chain['code'] == chain_code), None)
+    if chain is None:
+        raise LookupError(f"Chain {chain_code} not found in database")
+    
+    branch_files = get_files_from_table(chain['url'])
+    listing = {
+        branch_code: [files["PriceFull"][0], files["PromoFull"][0]] + [name for name, _ in files["deltas"]]
+        for branch_code, files in branch_files.items()
+    }
+    db.record_published_files(chain_code, listing)
+    for branch_code, files in branch_files.items():
+        db.update_branch_files(chain_code, branch_code, files["PriceFull"][0], files["PromoFull"][0])
+    return listing
+
+def refresh_scheduled_branch(application, chain_code, branch_code):
+    """Scheduler callback: bring one branch up to date, raising when the ingest failed"""
+    with application.app_context():
+        result = apply_branch_updates(branch_code)
+    error = (result.get("full_result") or {}).get("error")
+    if error:
+        raise RuntimeError(error)
+
+def scheduler_paused():
+    """Discovery rewrites the branch list; refreshes wait for it (and for a first discovery)"""
+    return get_discovery_status()["state"] == "running" or db.count_branches() == 0
+
+def start_refresh_scheduler(application):
+    """Start the background refresh loop in this (writer) process; None on read-only workers"""
+    global refresh_scheduler
+    if db.read_only:
+        return None
+    for chain_code in SCHEDULED_CHAINS:
+        db.ensure_refresh_schedule(chain_code, DEFAULT_INTERVAL_MINUTES)
+    if refresh_scheduler is None:
+        refresh_scheduler = RefreshScheduler(
+            db, list_chain_files,
+            lambda chain_code, branch_code: refresh_scheduled_branch(application, chain_code, branch_code),
+            is_paused=scheduler_paused
+        )
+    refresh_scheduler.start()
+    return refresh_scheduler
+
+@api.route('/refresh-scheduler')
+def refresh_scheduler_status():
+    """Schedule per chain, queued branch refreshes and (in the writer) what is running now"""
+    try:
+        return jsonify({
+            "scheduler": refresh_scheduler.status() if refresh_scheduler else {"running": False},
+            "schedule": db.get_refresh_schedule(),
+            "queue": db.get_refresh_queue()
+        })
+    except Exception as e:
+        return jsonify({"error": f"Failed to read refresh schedule: {str(e)}"}), 500
+
+@api.route('/refresh-scheduler/chain/<chain_code>')
+def configure_chain_refresh(chain_code):
+    """Set a chain's cadence (?interval_minutes=30) and/or switch it on or off (?enabled=0|1)"""
+    blocked = read_only_response()
+    if blocked:
+        return blocked
+    interval_minutes = request.args.get('interval_minutes', type=int)
+    enabled = request.args.get('enabled', type=int)
+    if interval_minutes is not None and interval_minutes < 1:
+        return jsonify({"error": "interval_minutes must be at least 1"}), 400
+    if enabled not in (None, 0, 1):
+        return jsonify({"error": "enabled must be 0 or 1"}), 400
+    
+    db.set_refresh_schedule(chain_code, interval_minutes, enabled)
+    schedule = next(entry for entry in db.get_refresh_schedule() if entry["chain_code"] == chain_code)
+    return jsonify({"success": True, "schedule": schedule})
+
+def create_app(db_path=None, hierarchical_db_path=None, read_only=False):
+    """
+    Build the Flask app. Database handles stay lazy: nothing touches SQLite
+    until a request (or discovery) first needs it.
+    
+    read_only=True is the serving-worker mode (see wsgi.py): both databases
+    are opened read-only and the ingest endpoints answer 503.
+    """
+    if db_path or read_only:
+        food_chains_path = db_path or "data/food_chains.db"
+        db.configure(lambda: FoodChainDatabase(food_chains_path, read_only=read_only))
+        analytics.configure(create_price_analytics)
+    if hierarchical_db_path or read_only:
+        hierarchical_path = hierarchical_db_path or "data/hierarchical_food_chains.db"
+        hierarchical_db.configure(lambda: HierarchicalFoodDatabase(hierarchical_path, read_only=read_only))
+    replica_publisher.configure(lambda: ReplicaPublisher(db.db_path))
+    snapshot_exporter.configure(create_snapshot_exporter)
+    
+    application = Flask(__name__)
+    
+    # Configure Flask to use compact JSON (no pretty printing)
+    application.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    application.register_blueprint(api)
+    return application
+
+app = create_app()
+
 if __name__ == '__main__':
     log_message("🚀 Starting Flask server...")
     
     # Create data directory
     ensure_data_directory()
     
-    # Check if database already has data
-    try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM branches')
-        branch_count = cursor.fetchone()[0]
-        conn.close()
-        
-        if branch_count > 0:
-            log_message(f"✅ Database already contains {branch_count} branches - skipping discovery")
+    # Discovery never blocks startup: existing (possibly stale) data is served
+    # while a missing or interrupted discovery runs once the server is listening
+    progress = db.get_discovery_progress()
+    branch_count = db.count_branches()
+    
+    if branch_count > 0 and (not progress or 'files' in progress):
+        log_message(f"✅ Database already contains {branch_count} branches - skipping discovery")
+    else:
+        if progress:
+            log_message(f"🔍 Resuming interrupted discovery (done: {', '.join(sorted(progress))}) in the background...")
         else:
-            log_message("🔍 Database empty - running discovery...")
-            discover_and_store_food_chain_data()
-    except:
-        log_message("🔍 Database not found - running discovery...")
-        discover_and_store_food_chain_data()
+            log_message("🔍 Database empty - discovery will run in the background...")
+        start_background_discovery(wait_for_port=5000)
     
     log_message("🌐 Server will be available at: http://localhost:5000")
     log_message("📋 Available endpoints:")
     log_message("   - GET /food-chains (all food chains)")
     log_message("   - GET /get-branches (from database)")
     log_message("   - GET /status (database status)")
+    log_message("   - GET /ready (readiness and discovery progress)")
     log_message("   - GET /process-branch/<code> (download, decompress, parse branch data)")
+    log_message("   - GET /refresh-branch/<code> (apply Price/Promo delta files, Full reload on gaps)")
+    log_message("   - GET /refresh-scheduler (periodic refresh schedule and queue)")
     log_message("🔄 Ready to serve food chain information from database!")
     
+    if os.environ.get("REFRESH_SCHEDULER", "1") != "0":
+        start_refresh_scheduler(app)
+    
     app.run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Backfill
+Rebuilds both databases from raw Price/PriceFull/Promo/PromoFull files already
+on disk - after a parser fix or a schema change - instead of downloading every
+branch again. The files come from a directory (downloads/, or any tree of
+.gz/.zip/.xml/.xml.xz files) or from the archive index (file_archive.py).
+
+Chain, branch and date are read from the file names
+(PriceFull7290058108879-001-202508011024.gz: chain id, store id, timestamp);
+the chain id is matched to a chain code through food_chains_metadata. Per
+branch and file kind the files are re-ingested in time order: the last Full
+file, then the delta files after it (every file with --all-history).
+
+Files are decompressed and parsed in a process pool; the parsed records are
+written in the main process through BranchWriter, one transaction per file,
+in order within each branch while other branches' files are still parsing.
+A branch whose file fails is not written past that file.
+
+Progress is checkpointed to a JSON file; --resume skips the files already
+written. A file written just before a crash may be written again on resume,
+which is harmless: Full files reload the branch and deltas are upserts.
+
+    python backfill.py [downloads] [--all-history] [--branch 1] [--as-of YYYYMMDDHHMM] [--resume]
+    python backfill.py --archive [--resume]          # every file in the archive index
+
+Settings: BACKFILL_WORKERS.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from chain_formats import get_chain_format
+from delta_ingest import parse_file_name
+from file_archive import file_stem
+from xml_stream import open_xml_stream
+
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", os.cpu_count() or 1))
+CHECKPOINT_PATH = os.path.join("data", "backfill_checkpoint.json")
+# Checkpoint writes are batched; files written in the gap are simply written again on resume
+CHECKPOINT_SECONDS = 5
+
+BackfillFile = namedtuple('BackfillFile', 'published path chain branch_code')
+
+
+def parse_records(task):
+    """Worker: decompress and parse one file into ProductRecords or PromotionRecords"""
+    path, file_kind, chain_id = task
+    with open_xml_stream(path) as stream:
+        root = ET.parse(stream).getroot()
+    chain_format = get_chain_format(chain_id=chain_id, root=root)
+    if file_kind == 'price':
+        return chain_format.parse_products(root)
+    return chain_format.parse_promotions(root)
+
+
+def directory_files(source_dir):
+    """(file name, path) of every Price/Promo file under a directory; one path per file stem"""
+    found = {}
+    for directory, _, names in sorted(os.walk(source_dir)):
+        for name in sorted(names):
+            if name.endswith('.tmp') or not parse_file_name(name):
+                continue
+            # The same file as .gz and unpacked .xml is ingested once
+            found.setdefault(file_stem(name), (name, os.path.join(directory, name)))
+    return list(found.values())
+
+
+def resolve_files(db, sources, chain_code=None):
+    """BackfillFiles for (file name, path) pairs, with the chain looked up from the chain id in the name"""
+    chains = db.get_chains_by_actual_code()
+    known_codes = {chain["code"]: chain for chain in chains.values()}
+    files = []
+    unknown = set()
+    for file_name, path in sources:
+        published = parse_file_name(file_name)
+        chain = known_codes.get(chain_code) if chain_code else chains.get(published.chain_id)
+        if not chain:
+            unknown.add(chain_code or published.chain_id)
+            continue
+        files.append(BackfillFile(published, path, chain, str(int(published.store_id))))
+    for chain_id in sorted(unknown):
+        print(f"⚠️ Skipping files of chain {chain_id}: no such chain in food_chains_metadata (run discovery first)")
+    return files
+
+
+def archive_sources(db):
+    """BackfillFiles for every file in the archive index whose blob still exists"""
+    chains = {chain["code"]: chain for chain in db.get_food_chains()}
+    files = []
+    for file_name, chain_code, branch_code, archive_path in db.list_archived_sources():
+        published = parse_file_name(file_name)
+        if published and chain_code in chains and os.path.exists(archive_path):
+            files.append(BackfillFile(published, archive_path, chains[chain_code], branch_code))
+    return files
+
+
+def plan_backfill(files, all_history=False, as_of=None, branches=None):
+    """
+    The files to ingest, in order: per branch and kind the last Full file up to
+    as_of and the deltas after it (with all_history, every Full and delta from
+    the first Full on). Deltas with no Full file before them are left out.
+    """
+    grouped = {}
+    for item in files:
+        if as_of and item.published.file_date > as_of:
+            continue
+        if branches and item.branch_code not in branches:
+            continue
+        key = (item.chain["code"], item.branch_code, item.published.file_kind)
+        grouped.setdefault(key, []).append(item)
+
+    planned = []
+    for (chain_code, branch_code, file_kind), items in sorted(grouped.items()):
+        # A Full file sorts before a delta with the same timestamp, which it already contains
+        items.sort(key=lambda item: (item.published.file_date, not item.published.is_full))
+        fulls = [index for index, item in enumerate(items) if item.published.is_full]
+        if not fulls:
+            print(f"⚠️ Branch {branch_code} ({chain_code}): no {file_kind} Full file, {len(items)} delta files skipped")
+            continue
+        if all_history:
+            planned.extend(items[fulls[0]:])
+            continue
+        full = items[fulls[-1]]
+        # As in delta_ingest.plan_refresh, a delta stamped with the Full's time is already in it
+        planned.append(full)
+        planned.extend(item for item in items[fulls[-1] + 1:] if item.published.file_date > full.published.file_date)
+    planned.sort(key=lambda item: (item.published.file_date, item.chain["code"], item.branch_code))
+    return planned
+
+
+class Checkpoint:
+    """File stems already written by a backfill run, saved as JSON so the run can resume"""
+
+    def __init__(self, path, source, resume=False):
+        self.path = path
+        self.source = source
+        self.done = set()
+        self.saved_at = time.monotonic()
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('source') == source:
+                self.done = set(saved.get('done', []))
+            else:
+                print(f"⚠️ Checkpoint {path} is for {saved.get('source')}, not {source} - starting over")
+
+    def __contains__(self, item):
+        return file_stem(item.published.file_name) in self.done
+
+    def add(self, item):
+        self.done.add(file_stem(item.published.file_name))
+        if time.monotonic() - self.saved_at >= CHECKPOINT_SECONDS:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        work_path = self.path + '.tmp'
+        with open(work_path, 'w') as f:
+            json.dump({'source': self.source, 'done': sorted(self.done),
+                       'saved_at': datetime.datetime.now().isoformat()}, f)
+        os.replace(work_path, self.path)
+        self.saved_at = time.monotonic()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BranchState:
+    """A branch's name and current Full files, passed along when a Full file (re)registers it"""
+
+    def __init__(self, branch_name, price_file, promo_file):
+        self.branch_name = branch_name
+        self.full_files = {'price': price_file, 'promo': promo_file}
+        self.failed = None
+
+
+def write_file(branch_writer, item, records, branch):
+    """Store one parsed file in both databases in a single transaction"""
+    published = item.published
+    chain_code = item.chain["code"]
+    if published.file_kind == 'price':
+        payload = {'products': records}
+    else:
+        payload = {'promotions': records}
+
+    if not published.is_full:
+        payload[f'{published.file_kind}_file'] = published.file_name
+        branch_writer.write_branch(chain_code, None, None, item.branch_code, None, delta=True, **payload)
+        return
+
+    branch.full_files[published.file_kind] = published.file_name
+    branch_writer.write_branch(chain_code, item.chain["name"], item.chain["url"], item.branch_code,
+                               branch.branch_name, branch.full_files['price'], branch.full_files['promo'],
+                               update_branch_files=True, **payload)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def run_backfill(db, branch_writer, planned, checkpoint, workers=BACKFILL_WORKERS):
+    """
+    Parse the planned files in a process pool and write them in plan order per
+    branch as their parses finish. Returns {"written", "skipped", "failed"}.
+    """
+    todo = [item for item in planned if item not in checkpoint]
+    skipped = len(planned) - len(todo)
+    if skipped:
+        print(f"⏭️ {skipped} files already written according to {checkpoint.path}")
+    total = len(todo)
+
+    # Each branch's files are written strictly in plan order
+    queues = {}
+    for index, item in enumerate(todo):
+        queues.setdefault((item.chain["code"], item.branch_code), []).append(index)
+    branches = {}
+    for chain_code in {chain_code for chain_code, _ in queues}:
+        for branch_code, (name, price_file, promo_file) in db.get_branch_files(chain_code).items():
+            branches[(chain_code, branch_code)] = BranchState(name, price_file, promo_file)
+    for key in queues:
+        branches.setdefault(key, BranchState(f"Branch {key[1]}", None, None))
+
+    started = time.monotonic()
+    written = 0
+    abandoned = 0
+    failed = []
+    parsed = {}
+    in_flight = {}
+    pending = iter(enumerate(todo))
+    # Bounds memory: parsed files waiting for an earlier file of their branch count too
+    window = max(1, workers) * 2
+
+    def report(item, message):
+        done = written + len(failed)
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0.0
+        eta = format_duration((total - done) / rate) if rate else '?'
+        print(f"📥 [{done}/{total}] {item.published.file_name} (branch {item.branch_code}): {message}"
+              f" · {rate:.1f} files/s · ETA {eta}")
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) + len(parsed) < window:
+                index, item = next(pending, (None, None))
+                if item is None:
+                    exhausted = True
+                    break
+                task = (item.path, item.published.file_kind, item.published.chain_id)
+                in_flight[pool.submit(parse_records, task)] = index
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                parsed[in_flight.pop(future)] = future
+
+            for key, queue in queues.items():
+                branch = branches[key]
+                while queue and queue[0] in parsed:
+                    index = queue.pop(0)
+                    item = todo[index]
+                    future = parsed.pop(index)
+                    if branch.failed:
+                        abandoned += 1
+                        continue
+                    try:
+                        records = future.result()
+                        write_file(branch_writer, item, records, branch)
+                    except Exception as e:
+                        branch.failed = item.published.file_name
+                        failed.append((item, str(e)))
+                        report(item, f"❌ failed ({str(e)}); later files of this branch are skipped")
+                        continue
+                    written += 1
+                    checkpoint.add(item)
+                    report(item, f"{len(records)} {item.published.file_kind} records")
+    checkpoint.save()
+
+    print(f"\n✅ Backfill: {written} files written in {format_duration(time.monotonic() - started)}, "
+          f"{skipped} already done, {len(failed)} failed, {abandoned} skipped after a failure")
+    for item, error in failed:
+        print(f"   ❌ {item.published.file_name}: {error}")
+    return {"written": written, "skipped": skipped, "failed": len(failed)}
+
+
+def refresh_derived(db, planned):
+    """Re-export the analytics snapshot and publish a read replica, as an ingest through the app does"""
+    from read_replica import READ_REPLICAS, publish_read_replica
+    if any(item.published.file_kind == 'price' for item in planned):
+        try:
+            from product_snapshot import export_products_snapshot
+            export_products_snapshot(db.db_path)
+        except Exception as e:
+            print(f"⚠️ Products snapshot export failed: {str(e)}")
+    if READ_REPLICAS:
+        publish_read_replica(db.db_path)
+
+
+def main():
+    from branch_writer import BranchWriter
+    from database_hierarchical import HierarchicalFoodDatabase
+    from database_setup import FoodChainDatabase
+
+    parser = argparse.ArgumentParser(description="Re-ingest raw Price/Promo files into both databases")
+    parser.add_argument("source_dir", nargs="?", default="downloads", help="directory searched for files")
+    parser.add_argument("--archive", action="store_true", help="use every file in the archive index instead")
+    parser.add_argument("--chain", help="chain code for all files (default: looked up from the chain id)")
+    parser.add_argument("--branch", action="append", help="only this branch code (repeatable)")
+    parser.add_argument("--as-of", help="ignore files dated after YYYYMMDDHHMM")
+    parser.add_argument("--all-history", action="store_true", help="every Full and delta file, not just the last Full on")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="parser processes")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--resume", action="store_true", help="skip files written by an earlier run")
+    args = parser.parse_args()
+
+    db = FoodChainDatabase()
+    branch_writer = BranchWriter(db, HierarchicalFoodDatabase())
+    if args.archive:
+        source = 'archive'
+        files = archive_sources(db)
+    else:
+        source = os.path.abspath(args.source_dir)
+        files = resolve_files(db, directory_files(args.source_dir), args.chain)
+
+    planned = plan_backfill(files, args.all_history, args.as_of, set(args.branch or []))
+    print(f"🗂️ {len(files)} files found, {len(planned)} to ingest "
+          f"across {len({(item.chain['code'], item.branch_code) for item in planned})} branches "
+          f"with {args.workers} parser processes")
+    checkpoint = Checkpoint(args.checkpoint, source, args.resume)
+    result = run_backfill(db, branch_writer, planned, checkpoint, args.workers)
+    if result["written"]:
+        refresh_derived(db, planned)
+    if result["failed"]:
+        print(f"💡 Fix the cause and rerun with --resume to continue from {args.checkpoint}")
+        return 1
+    checkpoint.clear()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Parser Benchmark
+Compares the single-pass chain_formats extractors against the original
+find()-per-field parsing on the bundled PriceFull/PromoFull fixtures, and
+measures memory per 100k products for dict vs ProductRecord storage.
+"""
+
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from chain_formats import get_chain_format
+from records import record_to_dict
+from xml_stream import open_xml_stream
+
+PRICE_FIXTURE = "downloads/PriceFull7290058108879-001-202508011024.gz"
+PROMO_FIXTURE = "downloads/PromoFull7290058108879-001-202508011037.gz"
+
+
+def get_xml_text(element, tag_name):
+    """Reference helper from the original parser: one find() per field"""
+    child = element.find(tag_name)
+    return child.text if child is not None else ""
+
+
+def legacy_parse_products(root):
+    """Original parse_price_xml loop, kept here as the benchmark baseline"""
+    chain_id = root.find('ChainId').text if root.find('ChainId') is not None else ""
+    store_id = root.find('StoreId').text if root.find('StoreId') is not None else ""
+    products = []
+    items = root.find('Items')
+    if items is not None:
+        for item in items.findall('Item'):
+            products.append({
+                'chain_id': chain_id,
+                'store_id': store_id,
+                'item_code': get_xml_text(item, 'ItemCode'),
+                'item_name': get_xml_text(item, 'ItemNm'),
+                'manufacturer_name': get_xml_text(item, 'ManufacturerName'),
+                'manufacturer_item_description': get_xml_text(item, 'ManufacturerItemDescription'),
+                'unit_qty': get_xml_text(item, 'UnitQty'),
+                'quantity': get_xml_text(item, 'Quantity'),
+                'unit_of_measure': get_xml_text(item, 'UnitOfMeasure'),
+                'is_weighted': get_xml_text(item, 'bIsWeighted'),
+                'qty_in_package': get_xml_text(item, 'QtyInPackage'),
+                'item_price': get_xml_text(item, 'ItemPrice'),
+                'unit_of_measure_price': get_xml_text(item, 'UnitOfMeasurePrice'),
+                'allow_discount': get_xml_text(item, 'AllowDiscount'),
+                'item_status': get_xml_text(item, 'ItemStatus'),
+                'manufacture_country': get_xml_text(item, 'ManufactureCountry'),
+                'price_update_date': get_xml_text(item, 'PriceUpdateDate')
+            })
+    return products
+
+
+def legacy_parse_promotions(root):
+    """Original parse_promo_xml loop, kept here as the benchmark baseline"""
+    chain_id = root.find('ChainId').text if root.find('ChainId') is not None else ""
+    store_id = root.find('StoreId').text if root.find('StoreId') is not None else ""
+    promotions = []
+    promos = root.find('Promotions')
+    if promos is not None:
+        for promo in promos.findall('Promotion'):
+            promotion = {
+                'chain_id': chain_id,
+                'store_id': store_id,
+                'promotion_id': get_xml_text(promo, 'PromotionId'),
+                'promotion_description': get_xml_text(promo, 'PromotionDescription'),
+                'promotion_update_date': get_xml_text(promo, 'PromotionUpdateDate'),
+                'promotion_start_date': get_xml_text(promo, 'PromotionStartDate'),
+                'promotion_start_hour': get_xml_text(promo, 'PromotionStartHour'),
+                'promotion_end_date': get_xml_text(promo, 'PromotionEndDate'),
+                'promotion_end_hour': get_xml_text(promo, 'PromotionEndHour'),
+                'discounted_price': get_xml_text(promo, 'DiscountedPrice'),
+                'discounted_price_per_unit': get_xml_text(promo, 'DiscountedPricePerMida'),
+                'discount_rate': get_xml_text(promo, 'DiscountRate'),
+                'min_quantity': get_xml_text(promo, 'MinQty'),
+                'max_quantity': get_xml_text(promo, 'MaxQty'),
+                'min_purchase_amount': get_xml_text(promo, 'MinPurchaseAmnt'),
+                'allow_multiple_discounts': get_xml_text(promo, 'AllowMultipleDiscounts'),
+                'reward_type': get_xml_text(promo, 'RewardType'),
+                'discount_type': get_xml_text(promo, 'DiscountType'),
+                'remarks': get_xml_text(promo, 'Remarks'),
+                'items': []
+            }
+            promo_items = promo.find('PromotionItems')
+            if promo_items is not None:
+                for item in promo_items.findall('Item'):
+                    promotion['items'].append({
+                        'item_code': get_xml_text(item, 'ItemCode'),
+                        'is_gift_item': get_xml_text(item, 'IsGiftItem'),
+                        'item_type': get_xml_text(item, 'ItemType')
+                    })
+            promotions.append(promotion)
+    return promotions
+
+
+def best_of(functions, root, repeat):
+    """Return (best seconds, result) per function over several rounds
+
+    Each round runs every function once, so a noisy stretch of the machine
+    does not land on one of them only.
+    """
+    best = [None] * len(functions)
+    results = [None] * len(functions)
+    for _ in range(repeat):
+        for index, function in enumerate(functions):
+            start = time.perf_counter()
+            results[index] = function(root)
+            elapsed = time.perf_counter() - start
+            best[index] = elapsed if best[index] is None else min(best[index], elapsed)
+    return list(zip(best, results))
+
+
+def benchmark_file(label, filepath, legacy_function, kind, repeat=30):
+    with open_xml_stream(filepath) as stream:
+        root = ET.parse(stream).getroot()
+    chain_format = get_chain_format(root=root)
+    extract_rows = getattr(chain_format, f"extract_{kind}")
+    parse_records = getattr(chain_format, f"parse_{kind}")
+
+    (legacy_time, legacy_result), (rows_time, _), (records_time, records) = best_of(
+        [legacy_function, extract_rows, parse_records], root, repeat
+    )
+    identical = legacy_result == [record_to_dict(record) for record in records]
+
+    print(f"\n📊 {label}: {filepath}")
+    print(f"   Records:                  {len(records):,}")
+    print(f"   find() per field (dicts): {legacy_time * 1000:8.1f} ms")
+    print(f"   single-pass (rows):       {rows_time * 1000:8.1f} ms  ({legacy_time / rows_time:.2f}x)")
+    print(f"   single-pass (records):    {records_time * 1000:8.1f} ms  ({legacy_time / records_time:.2f}x)")
+    print(f"   Identical output:         {'✅' if identical else '❌'}")
+    return identical
+
+
+def traced_size(build):
+    """Return bytes still allocated by the object build() returns"""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def benchmark_record_memory(filepath, count=100000):
+    """Compare memory of 100k products held as dicts vs ProductRecords"""
+    with open_xml_stream(filepath) as stream:
+        root = ET.parse(stream).getroot()
+    chain_format = get_chain_format(root=root)
+    records = chain_format.parse_products(root)
+    # Strings are shared between both layouts, so only the per-record containers differ
+    source = (records * (count // len(records) + 1))[:count]
+
+    dict_size = traced_size(lambda: [record._asdict() for record in source])
+    record_size = traced_size(lambda: [record._replace() for record in source])
+
+    print(f"\n💾 Memory per {count:,} products (containers only, strings shared)")
+    print(f"   dict per product:         {dict_size / 1e6:8.1f} MB")
+    print(f"   ProductRecord:            {record_size / 1e6:8.1f} MB  ({dict_size / record_size:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    price_file = sys.argv[1] if len(sys.argv) > 1 else PRICE_FIXTURE
+    promo_file = sys.argv[2] if len(sys.argv) > 2 else PROMO_FIXTURE
+
+    print("🚀 PARSER BENCHMARK (extraction only, XML tree already built)")
+    print("=" * 60)
+    ok = benchmark_file("PromoFull", promo_file, legacy_parse_promotions, "promotions")
+    ok = benchmark_file("PriceFull", price_file, legacy_parse_products, "products") and ok
+    benchmark_record_memory(price_file)
+    sys.exit(0 if ok else 1)
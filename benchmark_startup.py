@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+Measures how long `import app` takes in a fresh interpreter, the time to the
+first served request, and which top-level imports dominate (python -X importtime).
+Every run uses a new process, so nothing is cached between measurements.
+"""
+
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+client = {module}.app.test_client()
+response = client.get({path!r})
+print(time.perf_counter() - start, response.status_code)
+"""
+
+
+def run_snippet(snippet):
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1].split()
+
+
+def measure(snippet, runs):
+    """Return (best, median) seconds of a snippet over several fresh interpreters"""
+    timings = [float(run_snippet(snippet)[0]) for _ in range(runs)]
+    return min(timings), statistics.median(timings)
+
+
+def slowest_imports(module, top=10):
+    """Return [(cumulative seconds, name)] for the heaviest direct imports of module"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    # importtime prints children before their parent, so the module's subtree is
+    # the run of lines ending at its own top-level line (interpreter startup
+    # imports such as site hooks belong to earlier subtrees)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            if name.strip() == module:
+                break
+            imports = []
+        # Three leading spaces mark an import made directly by the top-level module
+        elif not name.startswith("    "):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else "app"
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print(f"🚀 STARTUP BENCHMARK: import {module} ({runs} fresh interpreters each)")
+    print("=" * 60)
+
+    best, median = measure(IMPORT_SNIPPET.format(module=module), runs)
+    print(f"📦 import {module}:        best {best * 1000:7.1f} ms   median {median * 1000:7.1f} ms")
+
+    best, median = measure(FIRST_REQUEST_SNIPPET.format(module=module, path="/status"), runs)
+    print(f"🌐 first request (/status): best {best * 1000:7.1f} ms   median {median * 1000:7.1f} ms")
+
+    print(f"\n🐢 Heaviest imports made by {module}:")
+    for seconds, name in slowest_imports(module):
+        print(f"   {seconds * 1000:7.1f} ms  {name}")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Branch Locations
+Branch coordinates for the /branches/nearby endpoint. They are read from a
+chain's Stores file (Store elements carrying Latitude/Longitude) or from a
+local gazetteer CSV, and stored in the hierarchical database, where the
+branch_locations_rtree R*Tree indexes them (see migrations.py).
+
+    python branch_locations.py --gazetteer data/branch_locations.csv
+    python branch_locations.py --stores CHAIN_001 downloads/Stores7290058108879-202508010000.xml
+
+Gazetteer columns: chain_code, branch_code, latitude, longitude and optionally
+branch_name, address, city.
+"""
+
+import argparse
+import csv
+import math
+import xml.etree.ElementTree as ET
+
+from xml_stream import open_xml_stream
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Lower-cased Stores file tags, covering the spellings different chains use
+STORE_TAGS = ('store', 'branch')
+STORE_FIELDS = {
+    'branch_code': ('storeid', 'store_id', 'branchid'),
+    'branch_name': ('storename', 'store_name', 'branchname'),
+    'address': ('address', 'storeaddress'),
+    'city': ('city', 'cityname'),
+    'latitude': ('latitude', 'lat'),
+    'longitude': ('longitude', 'lon', 'lng'),
+}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km"""
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-9 or radius_km >= math.pi * EARTH_RADIUS_KM:
+        delta_lon = 180.0
+    else:
+        delta_lon = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return (max(-90.0, latitude - delta_lat), min(90.0, latitude + delta_lat),
+            max(-180.0, longitude - delta_lon), min(180.0, longitude + delta_lon))
+
+
+def normalize_branch_code(code):
+    """Stores files use zero-padded store ids ('001'); branches are keyed without padding"""
+    code = (code or '').strip()
+    return str(int(code)) if code.isdigit() else code
+
+
+def valid_coordinates(latitude, longitude):
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or (latitude == 0 and longitude == 0):
+        return None
+    return latitude, longitude
+
+
+def parse_stores_file(filepath, chain_code):
+    """Return (locations, skipped) from a Stores XML file; stores without coordinates are skipped"""
+    locations = []
+    skipped = 0
+    with open_xml_stream(filepath) as xml_stream:
+        for _, element in ET.iterparse(xml_stream, events=('end',)):
+            if element.tag.lower() not in STORE_TAGS:
+                continue
+            values = {child.tag.lower(): (child.text or '').strip() for child in element}
+            store = {field: next((values[tag] for tag in tags if values.get(tag)), '')
+                     for field, tags in STORE_FIELDS.items()}
+            coordinates = valid_coordinates(store['latitude'], store['longitude'])
+            if store['branch_code'] and coordinates:
+                store.update(chain_code=chain_code, branch_code=normalize_branch_code(store['branch_code']),
+                             latitude=coordinates[0], longitude=coordinates[1], source='stores')
+                locations.append(store)
+            else:
+                skipped += 1
+            element.clear()
+    return locations, skipped
+
+
+def read_gazetteer(path):
+    """Return (locations, skipped) from a gazetteer CSV"""
+    locations = []
+    skipped = 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            coordinates = valid_coordinates(row.get('latitude'), row.get('longitude'))
+            if not row.get('chain_code') or not row.get('branch_code') or not coordinates:
+                skipped += 1
+                continue
+            locations.append({
+                'chain_code': row['chain_code'].strip(),
+                'branch_code': normalize_branch_code(row['branch_code']),
+                'branch_name': (row.get('branch_name') or '').strip(),
+                'address': (row.get('address') or '').strip(),
+                'city': (row.get('city') or '').strip(),
+                'latitude': coordinates[0],
+                'longitude': coordinates[1],
+                'source': 'gazetteer',
+            })
+    return locations, skipped
+
+
+if __name__ == "__main__":
+    from database_hierarchical import HierarchicalFoodDatabase
+
+    parser = argparse.ArgumentParser(description="Load branch coordinates into the spatial index")
+    parser.add_argument("--gazetteer", help="CSV with chain_code, branch_code, latitude, longitude")
+    parser.add_argument("--stores", nargs=2, metavar=("CHAIN_CODE", "FILE"), help="a chain's Stores XML file")
+    args = parser.parse_args()
+    if not args.gazetteer and not args.stores:
+        parser.error("pass --gazetteer and/or --stores")
+
+    sources = []
+    if args.gazetteer:
+        sources.append(('gazetteer', read_gazetteer(args.gazetteer)))
+    if args.stores:
+        sources.append(('stores', parse_stores_file(args.stores[1], args.stores[0])))
+
+    database = HierarchicalFoodDatabase()
+    for source, (locations, skipped) in sources:
+        stored = database.upsert_branch_locations(locations)
+        print(f"📍 {source}: {stored} branch locations stored, {skipped} rows without coordinates skipped")
@@ -0,0 +1,113 @@
+"""
+Branch Writer
+One branch ingest writes to both database files: the flat products/promotions
+tables in food_chains.db and the per-branch tables in
+hierarchical_food_chains.db. Done through the two database classes on their
+own, that is a connection and a commit per step (about seven fsyncs per
+branch), and a failure halfway leaves the files disagreeing.
+
+BranchWriter ATTACHes hierarchical_food_chains.db to a food_chains.db
+connection and runs the branch data update - flat rows, chain and branch
+registration, shadow-table loads and swaps - in one BEGIN IMMEDIATE
+transaction with one commit. Any error rolls back both files.
+
+SQLite commits a transaction across attached files atomically only in
+rollback-journal mode (its super-journal). In WAL mode (wsgi.py switches both
+files to WAL) each file commits or rolls back as a whole, but the two commit
+one after the other, food_chains.db first, so a crash in between can leave
+the hierarchical file behind. The ingest state (branch_ingest_state, which
+plan_refresh reads) is therefore advanced in a second, short transaction
+only once both files have committed. After a crash anywhere before that the
+state still names the previous file, and the next refresh applies the file
+again: a Full load replaces the branch in both files, and delta upserts are
+idempotent. The state never runs ahead of the data.
+"""
+
+import contextlib
+
+from records import normalize_product, normalize_promotion
+
+# Schema name of hierarchical_food_chains.db on the writer's connection
+HIERARCHICAL_SCHEMA = 'hierarchical'
+
+
+class BranchWriter:
+    """Writes one branch's products and promotions to both databases in a single transaction"""
+
+    def __init__(self, db, hierarchical_db):
+        self.db = db
+        self.hierarchical_db = hierarchical_db
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Cursor on food_chains.db with the hierarchical DB attached, inside one write transaction"""
+        conn = self.db.connect()
+        try:
+            conn.execute(f'ATTACH DATABASE ? AS {HIERARCHICAL_SCHEMA}', (self.hierarchical_db.db_path,))
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn.cursor()
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                # Tables and branches recorded during the transaction no longer exist
+                self.hierarchical_db.registry.invalidate()
+                raise
+        finally:
+            conn.close()
+
+    def write_branch(self, chain_code, chain_name, chain_url, branch_code, branch_name,
+                     price_file=None, promo_file=None, products=None, promotions=None, delta=False,
+                     update_branch_files=False):
+        """
+        Store parsed ProductRecords/PromotionRecords of one branch in both
+        databases, all or nothing, then advance its ingest state (see the
+        module docstring). A Full load (re)registers the chain and branch;
+        delta=True applies Price/Promo delta files as targeted upserts.
+        update_branch_files=True also points the branches row of food_chains.db
+        at the Full files written, in the same transaction. products or
+        promotions given, even empty, mean that file was parsed, so it counts
+        as applied; None means it was not read. Returns the counts inserted.
+        """
+        # A parsed file is applied whatever its record count (a delta with no changes, no promotions)
+        applied_files = [file_name for file_name, records in ((price_file, products), (promo_file, promotions))
+                         if file_name and records is not None]
+        products = products or []
+        promotions = promotions or []
+        counts = {"products_inserted": 0, "promotions_inserted": 0, "promotion_items_inserted": 0}
+
+        with self.transaction() as cursor:
+            if not delta:
+                self.hierarchical_db.add_food_chain(chain_code, chain_name, chain_url,
+                                                    cursor, HIERARCHICAL_SCHEMA)
+                self.hierarchical_db.add_branch_to_chain(chain_code, branch_code, branch_name,
+                                                         price_file, promo_file, cursor, HIERARCHICAL_SCHEMA)
+                if update_branch_files:
+                    self.db.update_branch_files(chain_code, branch_code,
+                                                price_file if price_file in applied_files else None,
+                                                promo_file if promo_file in applied_files else None, cursor)
+
+            if products:
+                # Records are shared by both writers; only the flat DB needs defaults filled
+                self.db.insert_products(chain_code, branch_code,
+                                        [normalize_product(product) for product in products], cursor)
+                self.hierarchical_db.insert_branch_products(chain_code, branch_code, products, delta,
+                                                            cursor, HIERARCHICAL_SCHEMA)
+                counts["products_inserted"] = len(products)
+
+            if promotions:
+                db_promotions = [normalize_promotion(promotion) for promotion in promotions]
+                self.db.insert_promotions(chain_code, branch_code, db_promotions, cursor)
+                self.hierarchical_db.insert_branch_promotions(chain_code, branch_code, promotions, delta,
+                                                              cursor, HIERARCHICAL_SCHEMA)
+                counts["promotions_inserted"] = len(db_promotions)
+                counts["promotion_items_inserted"] = sum(len(promotion.items) for promotion in db_promotions)
+
+        # Only now that both files have committed (food_chains.db goes first in WAL mode)
+        with self.db.connections.writing(immediate=True) as cursor:
+            for file_name in applied_files:
+                self.db.record_file_applied(chain_code, branch_code, file_name, cursor)
+
+        print(f"💾 Branch {branch_code}: {counts['products_inserted']} products, "
+              f"{counts['promotions_inserted']} promotions written to both databases")
+        return counts
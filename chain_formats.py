@@ -0,0 +1,331 @@
+"""
+Chain File Formats
+Registry of per-chain PriceFull/PromoFull layouts. Each format maps XML tags to our
+columns and compiles that mapping once into single-pass extractors.
+"""
+
+from itertools import repeat
+
+from records import (
+    PRODUCT_COLUMNS, PROMOTION_COLUMNS, PROMOTION_ITEM_COLUMNS,
+    ProductRecord, PromotionRecord, PromotionItemRecord
+)
+
+# Tag names seen across the chains on the gov.il list. Matching is case-insensitive,
+# so only genuinely different spellings need to be listed here.
+DEFAULT_PRODUCT_FIELDS = {
+    'item_code': ['ItemCode'],
+    'item_name': ['ItemNm', 'ItemName'],
+    'manufacturer_name': ['ManufacturerName', 'ManufactureName'],
+    'manufacturer_item_description': ['ManufacturerItemDescription', 'ManufactureItemDescription'],
+    'unit_qty': ['UnitQty'],
+    'quantity': ['Quantity'],
+    'unit_of_measure': ['UnitOfMeasure', 'UnitMeasure'],
+    'is_weighted': ['bIsWeighted', 'IsWeighted'],
+    'qty_in_package': ['QtyInPackage'],
+    'item_price': ['ItemPrice'],
+    'unit_of_measure_price': ['UnitOfMeasurePrice'],
+    'allow_discount': ['AllowDiscount'],
+    'item_status': ['ItemStatus'],
+    'manufacture_country': ['ManufactureCountry', 'ManufacturerCountry'],
+    'price_update_date': ['PriceUpdateDate', 'PriceUpdateTime'],
+}
+
+DEFAULT_PROMOTION_FIELDS = {
+    'promotion_id': ['PromotionId'],
+    'promotion_description': ['PromotionDescription'],
+    'promotion_update_date': ['PromotionUpdateDate'],
+    'promotion_start_date': ['PromotionStartDate'],
+    'promotion_start_hour': ['PromotionStartHour'],
+    'promotion_end_date': ['PromotionEndDate'],
+    'promotion_end_hour': ['PromotionEndHour'],
+    'discounted_price': ['DiscountedPrice'],
+    'discounted_price_per_unit': ['DiscountedPricePerMida'],
+    'discount_rate': ['DiscountRate'],
+    'min_quantity': ['MinQty'],
+    'max_quantity': ['MaxQty'],
+    'min_purchase_amount': ['MinPurchaseAmnt', 'MinPurchaseAmount'],
+    'allow_multiple_discounts': ['AllowMultipleDiscounts'],
+    'reward_type': ['RewardType'],
+    'discount_type': ['DiscountType'],
+    'remarks': ['Remarks'],
+    'items': ['PromotionItems'],
+}
+
+DEFAULT_PROMOTION_ITEM_FIELDS = {
+    'item_code': ['ItemCode'],
+    'is_gift_item': ['IsGiftItem'],
+    'item_type': ['ItemType'],
+}
+
+
+class TagIndex(dict):
+    """Tag -> column position, learning other capitalizations of known tags on first sight
+
+    Tags that are not a column map to the extra slot at the end of a record.
+    """
+
+    def __init__(self, field_positions, width):
+        super().__init__(field_positions)
+        self.lower = {tag.lower(): position for tag, position in field_positions.items()}
+        self.width = width
+
+    def __missing__(self, tag):
+        position = self.lower.get(tag.lower(), self.width)
+        self[tag] = position
+        return position
+
+
+class RecordExtractor:
+    """Fill a fixed list of columns from an element's children in one pass
+
+    Each child's tag is looked up in a compiled tag -> column index, so a
+    record costs one walk over its children instead of one find() per column.
+    Like find(), the first child with a tag wins. A field the record does not
+    have is '', an empty element is None, as with the old get_xml_text().
+    """
+
+    def __init__(self, columns, field_tags):
+        self.columns = list(columns)
+        self.width = len(self.columns)
+        self.field_positions = {}
+        for position, column in enumerate(self.columns):
+            for tag in field_tags.get(column) or [column]:
+                self.field_positions.setdefault(tag, position)
+        self.indexes = {}
+
+    def tag_index(self, offset):
+        """TagIndex for records holding offset values ahead of the columns"""
+        index = self.indexes.get(offset)
+        if index is None:
+            positions = {tag: position + offset for tag, position in self.field_positions.items()}
+            index = self.indexes[offset] = TagIndex(positions, offset + self.width)
+        return index
+
+    def extract_all(self, elements, head=()):
+        """Return one list of column values per element, after the values in head"""
+        index = self.tag_index(len(head))
+        end = len(head) + self.width
+        # One extra slot takes the text of children that are not a column
+        template = [*head, *[''] * self.width, '']
+
+        rows = []
+        for element in elements:
+            values = template[:]
+            for child in element:
+                position = index[child.tag]
+                if values[position] == '':
+                    values[position] = child.text
+            del values[end]
+            rows.append(values)
+        return rows
+
+    def extract(self, element):
+        return self.extract_all([element])[0]
+
+    def extract_dict(self, element):
+        return dict(zip(self.columns, self.extract(element)))
+
+
+def find_path(element, path):
+    """Case-insensitive find for a slash separated path like 'Items/Item'"""
+    current = element
+    for part in path.split('/'):
+        wanted = part.lower()
+        current = next((child for child in current if child.tag.lower() == wanted), None)
+        if current is None:
+            return None
+    return current
+
+
+def find_all_path(element, path):
+    """Case-insensitive findall: the parent is located with find_path, the last step is matched on tag"""
+    parent_path, _, leaf = path.rpartition('/')
+    parent = find_path(element, parent_path) if parent_path else element
+    if parent is None:
+        return []
+    wanted = leaf.lower()
+    return [child for child in parent if child.tag.lower() == wanted]
+
+
+class ChainFormat:
+    """PriceFull/PromoFull layout for one family of chains"""
+
+    def __init__(self, name, item_paths, product_fields=None, root_tags=None,
+                 chain_ids=None, url_patterns=None, promotion_paths=None,
+                 promotion_fields=None, promotion_item_fields=None, promotion_item_tag='Item'):
+        self.name = name
+        self.item_paths = item_paths
+        self.promotion_paths = promotion_paths or ['Promotions/Promotion']
+        self.promotion_item_tag = promotion_item_tag.lower()
+        self.root_tags = [tag.lower() for tag in (root_tags or [])]
+        self.chain_ids = set(chain_ids or [])
+        self.url_patterns = [pattern.lower() for pattern in (url_patterns or [])]
+
+        fields = dict(DEFAULT_PRODUCT_FIELDS)
+        fields.update(product_fields or {})
+        self.product_extractor = RecordExtractor(PRODUCT_COLUMNS, fields)
+
+        fields = dict(DEFAULT_PROMOTION_FIELDS)
+        fields.update(promotion_fields or {})
+        # 'items' is a nested section: promotion_rows() fills it from the section's items
+        self.promotion_extractor = RecordExtractor(PROMOTION_COLUMNS, fields)
+        self.promotion_items_tags = [tag.lower() for tag in fields['items']]
+
+        fields = dict(DEFAULT_PROMOTION_ITEM_FIELDS)
+        fields.update(promotion_item_fields or {})
+        self.promotion_item_extractor = RecordExtractor(PROMOTION_ITEM_COLUMNS, fields)
+
+        self.metadata_extractor = RecordExtractor(
+            ['chain_id', 'store_id'], {'chain_id': ['ChainId'], 'store_id': ['StoreId']}
+        )
+
+    def matches_root(self, root):
+        if self.root_tags and root.tag.lower() not in self.root_tags:
+            return False
+        paths = self.item_paths + self.promotion_paths
+        return any(find_path(root, path.rpartition('/')[0] or path) is not None for path in paths)
+
+    def read_metadata(self, root):
+        """Return (chain_id, store_id) from the document header"""
+        chain_id, store_id = self.metadata_extractor.extract(root)
+        return chain_id or "", store_id or ""
+
+    def find_records(self, root, paths):
+        for path in paths:
+            records = find_all_path(root, path)
+            if records:
+                return records
+        return []
+
+    def iter_items(self, root):
+        return self.find_records(root, self.item_paths)
+
+    def extract_products(self, root):
+        """Return (chain_id, store_id, rows) with one PRODUCT_COLUMNS list per item"""
+        chain_id, store_id = self.read_metadata(root)
+        return chain_id, store_id, self.product_extractor.extract_all(self.iter_items(root))
+
+    def promotion_rows(self, root, head=()):
+        """Return (rows, item_rows, counts) for the promotions of a PromoFull document
+
+        rows hold the values in head followed by the PROMOTION_COLUMNS values,
+        with 'items' left for the caller. Items of every promotion are
+        extracted in a single batch: the first counts[0] entries of item_rows
+        belong to the first promotion, and so on.
+        """
+        promotions = self.find_records(root, self.promotion_paths)
+        rows = self.promotion_extractor.extract_all(promotions, head)
+        items_tag = None
+        item_tag = None
+
+        all_items = []
+        counts = []
+        for promotion in promotions:
+            items_element = promotion.find(items_tag) if items_tag else None
+            if items_element is None:
+                # Resolve the section spelling on the first promotion that has one
+                items_element = next((child for child in promotion
+                                      if child.tag.lower() in self.promotion_items_tags), None)
+                if items_element is not None:
+                    items_tag = items_element.tag
+            before = len(all_items)
+            if items_element is not None and len(items_element):
+                if item_tag is None:
+                    # Resolve the item tag spelling once per document
+                    item_tag = next((item.tag for item in items_element
+                                     if item.tag.lower() == self.promotion_item_tag), self.promotion_item_tag)
+                items = items_element.findall(item_tag)
+                if not items:
+                    items = [item for item in items_element if item.tag.lower() == self.promotion_item_tag]
+                all_items.extend(items)
+            counts.append(len(all_items) - before)
+
+        return rows, self.promotion_item_extractor.extract_all(all_items), counts
+
+    def extract_promotions(self, root):
+        """Return (chain_id, store_id, rows) with one PROMOTION_COLUMNS list per promotion
+
+        The 'items' column holds a list of PROMOTION_ITEM_COLUMNS lists.
+        """
+        chain_id, store_id = self.read_metadata(root)
+        rows, item_rows, counts = self.promotion_rows(root)
+        offset = 0
+        for values, count in zip(rows, counts):
+            values[-1] = item_rows[offset:offset + count]
+            offset += count
+        return chain_id, store_id, rows
+
+    def parse_products(self, root):
+        """Return a ProductRecord for every item in a PriceFull document"""
+        rows = self.product_extractor.extract_all(self.iter_items(root), self.read_metadata(root))
+        return list(map(tuple.__new__, repeat(ProductRecord), rows))
+
+    def parse_promotions(self, root):
+        """Return a PromotionRecord (with PromotionItemRecord items) per promotion"""
+        rows, item_rows, counts = self.promotion_rows(root, self.read_metadata(root))
+        items = list(map(tuple.__new__, repeat(PromotionItemRecord), item_rows))
+
+        offset = 0
+        for values, count in zip(rows, counts):
+            values[-1] = tuple(items[offset:offset + count])
+            offset += count
+        return list(map(tuple.__new__, repeat(PromotionRecord), rows))
+
+
+CHAIN_FORMATS = {}
+
+
+def register_chain_format(chain_format):
+    """Add a format to the registry (later registrations take precedence)"""
+    CHAIN_FORMATS[chain_format.name] = chain_format
+    return chain_format
+
+
+def get_chain_format(chain_id=None, chain_url=None, root=None):
+    """Pick the format for a chain by chain id, site URL, or the document structure"""
+    formats = list(CHAIN_FORMATS.values())[::-1]
+
+    if chain_id:
+        for chain_format in formats:
+            if chain_id in chain_format.chain_ids:
+                return chain_format
+
+    if chain_url:
+        url = chain_url.lower()
+        for chain_format in formats:
+            if any(pattern in url for pattern in chain_format.url_patterns):
+                return chain_format
+
+    if root is not None:
+        for chain_format in formats:
+            if chain_format.matches_root(root):
+                return chain_format
+
+    return CHAIN_FORMATS['binaprojects']
+
+
+# ========================================
+# BUILT-IN FORMATS
+# ========================================
+
+register_chain_format(ChainFormat(
+    'prices_products',
+    item_paths=['Products/Product'],
+    root_tags=['Prices'],
+    product_fields={'price_update_date': ['PriceUpdateDate', 'PriceUpdateTime', 'UpdateDate']},
+))
+
+register_chain_format(ChainFormat(
+    'root_items',
+    item_paths=['Items/Item', 'Root/Items/Item'],
+))
+
+# KingStore and the other binaprojects.com chains
+register_chain_format(ChainFormat(
+    'binaprojects',
+    item_paths=['Items/Item'],
+    root_tags=['Root'],
+    chain_ids=['7290058108879'],
+    url_patterns=['binaprojects.com'],
+))
@@ -1,13 +1,116 @@
+import contextlib
 import sqlite3
 import os
+import threading
+import math
 import json
+import re
 from datetime import datetime
+from branch_locations import EARTH_RADIUS_KM, bounding_box, haversine_km
+from db_connections import ConnectionProvider
+from migrations import HIERARCHICAL_MIGRATIONS, apply_migrations, create_branch_indexes, latest_version
+
+class SchemaRegistry:
+    """
+    What the hierarchical DB already holds: its tables, the chains in
+    main_index and each chain's branches with the files last registered. Read
+    once from the file, then kept up to date by the writes below, so a repeat
+    ingest of a known branch skips every CREATE TABLE/INDEX and the chain and
+    branch metadata writes. A failed write forgets it all (the transaction may
+    have rolled back DDL it recorded); the next write reloads it. Every read
+    and update holds self.lock, since ingests and discovery run on different
+    threads.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = None
+        self.chains = {}
+        self.branches = {}
+    
+    def invalidate(self):
+        with self.lock:
+            self.tables = None
+            self.chains = {}
+            self.branches = {}
+    
+    def load(self, cursor, schema='main'):
+        """Read tables and chains from the file unless already known"""
+        with self.lock:
+            if self.tables is not None:
+                return
+            cursor.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")
+            self.tables = {row[0] for row in cursor.fetchall()}
+            cursor.execute(f'SELECT chain_code, chain_name, chain_url FROM {schema}.main_index')
+            self.chains = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            self.branches = {}
+    
+    def has_tables(self, *table_names):
+        with self.lock:
+            return self.tables is not None and self.tables.issuperset(table_names)
+    
+    def add_tables(self, *table_names):
+        """Record tables created by the current write (nothing to do once invalidated)"""
+        with self.lock:
+            if self.tables is not None:
+                self.tables.update(table_names)
+    
+    def chain(self, chain_code):
+        """(chain_name, chain_url) registered for a chain, or None"""
+        with self.lock:
+            return self.chains.get(chain_code)
+    
+    def set_chain(self, chain_code, chain_name, chain_url):
+        with self.lock:
+            if self.tables is not None:
+                self.chains[chain_code] = (chain_name, chain_url)
+    
+    def chain_branches(self, cursor, chain_code, schema='main'):
+        """Copy of {branch_code: (branch_name, price_file, promo_file)} of a chain, read once"""
+        with self.lock:
+            if chain_code not in self.branches:
+                table_name = f"chain_{chain_code}_branches"
+                rows = []
+                if self.tables is not None and table_name in self.tables:
+                    cursor.execute(f'SELECT branch_code, branch_name, price_file_name, promo_file_name FROM {schema}.{table_name}')
+                    rows = cursor.fetchall()
+                self.branches[chain_code] = {row[0]: tuple(row[1:]) for row in rows}
+            return dict(self.branches[chain_code])
+    
+    def set_branch(self, chain_code, branch_code, registered):
+        """Record a branch registered by the current write, if its chain's branches are loaded"""
+        with self.lock:
+            branches = self.branches.get(chain_code)
+            if branches is not None:
+                branches[branch_code] = registered
 
 class HierarchicalFoodDatabase:
-    def __init__(self, db_path="data/hierarchical_food_chains.db"):
+    # Stored in PRAGMA user_version; add a migration to change the schema
+    SCHEMA_VERSION = latest_version(HIERARCHICAL_MIGRATIONS)
+    
+    def __init__(self, db_path="data/hierarchical_food_chains.db", read_only=False):
         self.db_path = db_path
-        self.ensure_data_directory()
-        self.init_database()
+        self.read_only = read_only
+        self.connections = ConnectionProvider(db_path, read_only=read_only)
+        self.registry = SchemaRegistry()
+        # Read-only handles (serving workers) never create or migrate the schema
+        if not read_only:
+            self.ensure_data_directory()
+            self.init_database()
+    
+    def connect(self):
+        """Read-write connection, or this thread's shared read-only connection"""
+        return self.connections.connect()
+    
+    @contextlib.contextmanager
+    def writing(self, cursor=None, immediate=False):
+        """connections.writing() that drops the registry when the write fails"""
+        try:
+            with self.connections.writing(cursor, immediate) as cursor:
+                yield cursor
+        except BaseException:
+            self.registry.invalidate()
+            raise
     
     def ensure_data_directory(self):
         """Ensure the data directory exists"""
@@ -15,428 +118,559 @@ class HierarchicalFoodDatabase:
         print(f"✅ Database will be created at: {self.db_path}")
     
     def init_database(self):
-        """Initialize the hierarchical database structure"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # ========================================
-        # MAIN INDEX TABLE
-        # ========================================
-        # Metadata: Root URL, total number of food chains
-        # Rows: One row per food chain
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS main_index (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chain_code TEXT UNIQUE NOT NULL,
-                chain_name TEXT NOT NULL,
-                chain_url TEXT NOT NULL,
-                last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                -- Table metadata (stored as JSON for flexibility)
-                table_metadata TEXT DEFAULT '{}',
-                
-                UNIQUE(chain_code)
-            )
-        ''')
-        
-        # Metadata table for main_index
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS main_index_metadata (
-                id INTEGER PRIMARY KEY,
-                root_url TEXT NOT NULL,
-                total_chains INTEGER DEFAULT 0,
-                last_discovery_update TIMESTAMP,
-                notes TEXT DEFAULT ''
-            )
-        ''')
-        
-        # Create metadata for main_index table
-        cursor.execute('''
-            INSERT OR REPLACE INTO main_index_metadata (
-                id, root_url, total_chains, last_discovery_update
-            ) VALUES (1, ?, ?, ?)
-        ''', (
-            'https://www.gov.il/he/pages/cpfta_prices_regulations',
-            0,  # Will be updated when we populate
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
+        """Create the hierarchical structure or upgrade it to the latest migration (see migrations.py)"""
+        conn = self.connect()
+        applied = apply_migrations(conn, HIERARCHICAL_MIGRATIONS, self.db_path)
         conn.close()
-        print("✅ Hierarchical database structure initialized")
+        if applied:
+            print("✅ Hierarchical database structure initialized")
     
-    def create_chain_table(self, chain_code, chain_name, chain_url):
+    def create_chain_table(self, chain_code, chain_name, chain_url, cursor=None, schema='main'):
         """Create a food chain table with metadata"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Table name for this chain's branches
         table_name = f"chain_{chain_code}_branches"
-        
-        # Create branches table for this chain
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                branch_code TEXT UNIQUE NOT NULL,
-                branch_name TEXT NOT NULL,
-                
-                -- File tracking (for downloads)
-                price_file_name TEXT,
-                price_file_date TEXT,
-                promo_file_name TEXT,
-                promo_file_date TEXT,
-                
-                -- Location info (placeholders for future)
-                address TEXT DEFAULT '',
-                coordinates TEXT DEFAULT '',
-                
-                -- Metadata
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                UNIQUE(branch_code)
-            )
-        ''')
-        
-        # Create metadata table for this chain
         metadata_table = f"{table_name}_metadata"
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {metadata_table} (
-                id INTEGER PRIMARY KEY,
-                chain_name TEXT NOT NULL,
-                chain_code TEXT NOT NULL,
-                chain_url TEXT NOT NULL,
-                total_branches INTEGER DEFAULT 0,
-                last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT DEFAULT ''
-            )
-        ''')
         
-        # Insert metadata
-        cursor.execute(f'''
-            INSERT OR REPLACE INTO {metadata_table} (
-                id, chain_name, chain_code, chain_url, total_branches, last_update
-            ) VALUES (1, ?, ?, ?, 0, ?)
-        ''', (chain_name, chain_code, chain_url, datetime.now().isoformat()))
+        with self.writing(cursor) as cursor:
+            self.registry.load(cursor, schema)
+            if not self.registry.has_tables(table_name, metadata_table):
+                # Create branches table for this chain
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        branch_code TEXT UNIQUE NOT NULL,
+                        branch_name TEXT NOT NULL,
+                        
+                        -- File tracking (for downloads)
+                        price_file_name TEXT,
+                        price_file_date TEXT,
+                        promo_file_name TEXT,
+                        promo_file_date TEXT,
+                        
+                        -- Location info (placeholders for future)
+                        address TEXT DEFAULT '',
+                        coordinates TEXT DEFAULT '',
+                        
+                        -- Metadata
+                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        
+                        UNIQUE(branch_code)
+                    )
+                ''')
+                
+                # Create metadata table for this chain
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{metadata_table} (
+                        id INTEGER PRIMARY KEY,
+                        chain_name TEXT NOT NULL,
+                        chain_code TEXT NOT NULL,
+                        chain_url TEXT NOT NULL,
+                        total_branches INTEGER DEFAULT 0,
+                        last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        notes TEXT DEFAULT ''
+                    )
+                ''')
+                self.registry.add_tables(table_name, metadata_table)
+            
+            # Upsert metadata, keeping the branch count
+            cursor.execute(f'''
+                INSERT INTO {schema}.{metadata_table} (
+                    id, chain_name, chain_code, chain_url, total_branches, last_update
+                ) VALUES (1, ?, ?, ?, 0, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    chain_name = excluded.chain_name,
+                    chain_code = excluded.chain_code,
+                    chain_url = excluded.chain_url,
+                    last_update = excluded.last_update
+            ''', (chain_name, chain_code, chain_url, datetime.now().isoformat()))
         
-        conn.commit()
-        conn.close()
         print(f"✅ Created chain table: {table_name}")
         return table_name
     
-    def create_branch_table(self, chain_code, branch_code, branch_name, price_file=None, promo_file=None):
+    def create_branch_table(self, chain_code, branch_code, branch_name, price_file=None, promo_file=None,
+                            cursor=None, schema='main'):
         """Create a branch table with metadata for products"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         # Table name for this branch's products
         table_name = f"branch_{chain_code}_{branch_code}_products"
-        
-        # Create products table for this branch
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                
-                -- Product identification
-                item_code TEXT NOT NULL,
-                item_name TEXT NOT NULL,
-                manufacturer_name TEXT,
-                
-                -- Pricing information
-                item_price REAL NOT NULL,
-                unit_of_measure TEXT,
-                quantity REAL,
-                
-                -- Metadata
-                price_update_date TIMESTAMP,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create metadata table for this branch
         metadata_table = f"{table_name}_metadata"
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {metadata_table} (
-                id INTEGER PRIMARY KEY,
-                chain_code TEXT NOT NULL,
-                branch_code TEXT NOT NULL,
-                branch_name TEXT NOT NULL,
-                latest_price_file TEXT DEFAULT '',
-                latest_promo_file TEXT DEFAULT '',
-                total_products INTEGER DEFAULT 0,
-                total_promotions INTEGER DEFAULT 0,
-                last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT DEFAULT ''
-            )
-        ''')
-        
-        # Insert metadata
-        cursor.execute(f'''
-            INSERT OR REPLACE INTO {metadata_table} (
-                id, chain_code, branch_code, branch_name, 
-                latest_price_file, latest_promo_file, last_update
-            ) VALUES (1, ?, ?, ?, ?, ?, ?)
-        ''', (
-            chain_code, branch_code, branch_name,
-            price_file or '', promo_file or '',
-            datetime.now().isoformat()
-        ))
-        
-        # ========================================
-        # CREATE PROMOTIONS TABLE
-        # ========================================
         promotions_table = f"branch_{chain_code}_{branch_code}_promotions"
+        promotion_items_table = f"branch_{chain_code}_{branch_code}_promotion_items"
+        branch_tables = (table_name, metadata_table, promotions_table, promotion_items_table)
         
-        # Create promotions table for this branch
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {promotions_table} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                
-                -- Promotion identification
-                promotion_id TEXT NOT NULL,
-                promotion_description TEXT NOT NULL,
+        with self.writing(cursor) as cursor:
+            self.registry.load(cursor, schema)
+            if not self.registry.has_tables(*branch_tables):
+                # Create products table for this branch
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        
+                        -- Product identification
+                        item_code TEXT NOT NULL,
+                        item_name TEXT NOT NULL,
+                        manufacturer_name TEXT,
+                        
+                        -- Pricing information
+                        item_price REAL NOT NULL,
+                        unit_of_measure TEXT,
+                        quantity REAL,
+                        
+                        -- Metadata
+                        price_update_date TIMESTAMP,
+                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
                 
-                -- Dates and times
-                promotion_update_date TIMESTAMP,
-                promotion_start_date DATE,
-                promotion_start_hour TIME,
-                promotion_end_date DATE,
-                promotion_end_hour TIME,
+                # Create metadata table for this branch
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{metadata_table} (
+                        id INTEGER PRIMARY KEY,
+                        chain_code TEXT NOT NULL,
+                        branch_code TEXT NOT NULL,
+                        branch_name TEXT NOT NULL,
+                        latest_price_file TEXT DEFAULT '',
+                        latest_promo_file TEXT DEFAULT '',
+                        total_products INTEGER DEFAULT 0,
+                        total_promotions INTEGER DEFAULT 0,
+                        last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        notes TEXT DEFAULT ''
+                    )
+                ''')
                 
-                -- Pricing information
-                discounted_price REAL,
-                discounted_price_per_unit REAL,
-                discount_rate REAL,
+                # ========================================
+                # CREATE PROMOTIONS TABLE
+                # ========================================
                 
-                -- Rules and restrictions
-                min_quantity INTEGER,
-                max_quantity INTEGER,
-                min_purchase_amount REAL,
-                allow_multiple_discounts INTEGER,
-                reward_type INTEGER,
-                discount_type INTEGER,
+                # Create promotions table for this branch
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{promotions_table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        
+                        -- Promotion identification
+                        promotion_id TEXT NOT NULL,
+                        promotion_description TEXT NOT NULL,
+                        
+                        -- Dates and times
+                        promotion_update_date TIMESTAMP,
+                        promotion_start_date DATE,
+                        promotion_start_hour TIME,
+                        promotion_end_date DATE,
+                        promotion_end_hour TIME,
+                        
+                        -- Pricing information
+                        discounted_price REAL,
+                        discounted_price_per_unit REAL,
+                        discount_rate REAL,
+                        
+                        -- Rules and restrictions
+                        min_quantity INTEGER,
+                        max_quantity INTEGER,
+                        min_purchase_amount REAL,
+                        allow_multiple_discounts INTEGER,
+                        reward_type INTEGER,
+                        discount_type INTEGER,
+                        
+                        -- Additional info
+                        remarks TEXT,
+                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
                 
-                -- Additional info
-                remarks TEXT,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create promotion items table for this branch
-        promotion_items_table = f"branch_{chain_code}_{branch_code}_promotion_items"
-        
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {promotion_items_table} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                promotion_id TEXT NOT NULL,
-                item_code TEXT NOT NULL,
-                is_gift_item INTEGER DEFAULT 0,
-                item_type INTEGER DEFAULT 1,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                # Create promotion items table for this branch
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {schema}.{promotion_items_table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        promotion_id TEXT NOT NULL,
+                        item_code TEXT NOT NULL,
+                        is_gift_item INTEGER DEFAULT 0,
+                        item_type INTEGER DEFAULT 1,
+                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        
+                        FOREIGN KEY (promotion_id) REFERENCES {promotions_table} (promotion_id)
+                    )
+                ''')
                 
-                FOREIGN KEY (promotion_id) REFERENCES {promotions_table} (promotion_id)
-            )
-        ''')
+                # Indexes for the branch endpoint's ordering and promotion item lookups
+                create_branch_indexes(cursor, f"branch_{chain_code}_{branch_code}", schema=schema)
+                self.registry.add_tables(*branch_tables)
+            
+            # Upsert metadata, keeping the product and promotion counts
+            cursor.execute(f'''
+                INSERT INTO {schema}.{metadata_table} (
+                    id, chain_code, branch_code, branch_name, 
+                    latest_price_file, latest_promo_file, last_update
+                ) VALUES (1, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    chain_code = excluded.chain_code,
+                    branch_code = excluded.branch_code,
+                    branch_name = excluded.branch_name,
+                    latest_price_file = excluded.latest_price_file,
+                    latest_promo_file = excluded.latest_promo_file,
+                    last_update = excluded.last_update
+            ''', (
+                chain_code, branch_code, branch_name,
+                price_file or '', promo_file or '',
+                datetime.now().isoformat()
+            ))
         
-        conn.commit()
-        conn.close()
         print(f"✅ Created branch tables: {table_name}, {promotions_table}, {promotion_items_table}")
         return table_name
     
-    def add_food_chain(self, chain_code, chain_name, chain_url):
-        """Add a food chain to the main index"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO main_index (chain_code, chain_name, chain_url, last_update)
-            VALUES (?, ?, ?, ?)
-        ''', (chain_code, chain_name, chain_url, datetime.now().isoformat()))
-        
-        # Update total chains count
-        cursor.execute('SELECT COUNT(*) FROM main_index')
-        total_chains = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            UPDATE main_index_metadata 
-            SET total_chains = ?, last_discovery_update = ?
-            WHERE id = 1
-        ''', (total_chains, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
-        
-        # Create the chain table
-        self.create_chain_table(chain_code, chain_name, chain_url)
+    def add_food_chain(self, chain_code, chain_name, chain_url, cursor=None, schema='main'):
+        """Add a food chain to the main index; a chain already registered as is needs no writes"""
+        with self.writing(cursor) as cursor:
+            self.registry.load(cursor, schema)
+            if (self.registry.chain(chain_code) == (chain_name, chain_url)
+                    and self.registry.has_tables(f"chain_{chain_code}_branches", f"chain_{chain_code}_branches_metadata")):
+                return
+            
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {schema}.main_index (chain_code, chain_name, chain_url, last_update)
+                VALUES (?, ?, ?, ?)
+            ''', (chain_code, chain_name, chain_url, datetime.now().isoformat()))
+            
+            # Update total chains count
+            cursor.execute(f'SELECT COUNT(*) FROM {schema}.main_index')
+            total_chains = cursor.fetchone()[0]
+            
+            cursor.execute(f'''
+                UPDATE {schema}.main_index_metadata 
+                SET total_chains = ?, last_discovery_update = ?
+                WHERE id = 1
+            ''', (total_chains, datetime.now().isoformat()))
+            
+            # Create the chain table
+            self.create_chain_table(chain_code, chain_name, chain_url, cursor, schema)
+            self.registry.set_chain(chain_code, chain_name, chain_url)
         
         print(f"✅ Added food chain: {chain_name} ({chain_code})")
     
-    def add_branch_to_chain(self, chain_code, branch_code, branch_name, price_file=None, promo_file=None):
-        """Add a branch to a food chain"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def add_branch_to_chain(self, chain_code, branch_code, branch_name, price_file=None, promo_file=None,
+                            cursor=None, schema='main'):
+        """Add a branch to a food chain; a branch already registered with these files needs no writes"""
         # Add to chain's branches table
         table_name = f"chain_{chain_code}_branches"
-        cursor.execute(f'''
-            INSERT OR REPLACE INTO {table_name} (
-                branch_code, branch_name, price_file_name, promo_file_name, 
-                price_file_date, promo_file_date, last_updated
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            branch_code, branch_name, price_file, promo_file,
-            datetime.now().isoformat(), datetime.now().isoformat(),
-            datetime.now().isoformat()
-        ))
-        
-        # Update branch count in metadata
-        cursor.execute(f'SELECT COUNT(*) FROM {table_name}')
-        total_branches = cursor.fetchone()[0]
-        
         metadata_table = f"{table_name}_metadata"
-        cursor.execute(f'''
-            UPDATE {metadata_table} 
-            SET total_branches = ?, last_update = ?
-            WHERE id = 1
-        ''', (total_branches, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
-        
-        # Create the branch products table
-        self.create_branch_table(chain_code, branch_code, branch_name, price_file, promo_file)
+        branch_prefix = f"branch_{chain_code}_{branch_code}"
+        registered = (branch_name, price_file, promo_file)
+        
+        with self.writing(cursor) as cursor:
+            self.registry.load(cursor, schema)
+            known_branches = self.registry.chain_branches(cursor, chain_code, schema)
+            if (known_branches.get(branch_code) == registered
+                    and self.registry.has_tables(f"{branch_prefix}_products", f"{branch_prefix}_products_metadata",
+                                                 f"{branch_prefix}_promotions", f"{branch_prefix}_promotion_items")):
+                return
+            
+            # Upsert rather than REPLACE, so address/coordinates from branch_locations survive
+            cursor.execute(f'''
+                INSERT INTO {schema}.{table_name} (
+                    branch_code, branch_name, price_file_name, promo_file_name, 
+                    price_file_date, promo_file_date, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(branch_code) DO UPDATE SET
+                    branch_name = excluded.branch_name,
+                    price_file_name = excluded.price_file_name,
+                    promo_file_name = excluded.promo_file_name,
+                    price_file_date = excluded.price_file_date,
+                    promo_file_date = excluded.promo_file_date,
+                    last_updated = excluded.last_updated
+            ''', (
+                branch_code, branch_name, price_file, promo_file,
+                datetime.now().isoformat(), datetime.now().isoformat(),
+                datetime.now().isoformat()
+            ))
+            
+            # Update branch count in metadata (only a new branch changes it)
+            if branch_code not in known_branches:
+                cursor.execute(f'SELECT COUNT(*) FROM {schema}.{table_name}')
+                total_branches = cursor.fetchone()[0]
+                
+                cursor.execute(f'''
+                    UPDATE {schema}.{metadata_table} 
+                    SET total_branches = ?, last_update = ?
+                    WHERE id = 1
+                ''', (total_branches, datetime.now().isoformat()))
+            
+            # Create the branch products table
+            self.create_branch_table(chain_code, branch_code, branch_name, price_file, promo_file, cursor, schema)
+            self.registry.set_branch(chain_code, branch_code, registered)
         
         print(f"✅ Added branch: {branch_name} ({branch_code}) to chain {chain_code}")
     
-    def insert_branch_products(self, chain_code, branch_code, products_data):
-        """Insert products into a branch table"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        table_name = f"branch_{chain_code}_{branch_code}_products"
-        metadata_table = f"{table_name}_metadata"
-        
-        # Clear existing products
-        cursor.execute(f'DELETE FROM {table_name}')
-        
-        # Insert products
-        for product in products_data:
-            cursor.execute(f'''
-                INSERT INTO {table_name} (
+    def create_shadow_table(self, cursor, table_name, schema='main'):
+        """Empty, index-free copy of a branch table, named {table_name}_shadow, for a bulk reload"""
+        shadow_table = f"{table_name}_shadow"
+        # A reload that died before its swap leaves its shadow behind
+        cursor.execute(f'DROP TABLE IF EXISTS {schema}.{shadow_table}')
+        cursor.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise sqlite3.OperationalError(f"no such table: {table_name}")
+        cursor.execute(re.sub(r'^CREATE TABLE\s+\S+', f'CREATE TABLE {schema}.{shadow_table}', row[0], count=1))
+        return shadow_table
+    
+    def swap_shadow_tables(self, table_prefix, table_names, metadata_update, cursor=None, schema='main'):
+        """
+        Replace live branch tables with their loaded shadows in one short
+        transaction: readers see the old rows until the commit and the new ones
+        after it, never an empty or half-filled table. Indexes are built once on
+        the full tables, so the bulk load itself did no index maintenance.
+        """
+        with self.writing(cursor, immediate=True) as cursor:
+            for table_name in table_names:
+                cursor.execute(f'DROP TABLE {schema}.{table_name}')
+                cursor.execute(f'ALTER TABLE {schema}.{table_name}_shadow RENAME TO {table_name}')
+            create_branch_indexes(cursor, table_prefix, set(table_names), schema)
+            cursor.execute(*metadata_update)
+    
+    def insert_branch_products(self, chain_code, branch_code, products_data, delta=False, cursor=None, schema='main'):
+        """
+        Insert ProductRecords into a branch table. A full reload fills a shadow
+        table and swaps it in; delta=True replaces only the items given.
+        """
+        table_prefix = f"branch_{chain_code}_{branch_code}"
+        table_name = f"{table_prefix}_products"
+        metadata_table = f"{schema}.{table_name}_metadata"
+        
+        # The shadow load commits on its own unless it runs inside a caller's transaction
+        with self.writing(cursor) as write_cursor:
+            if delta:
+                # A Price delta file lists only the items that changed
+                write_cursor.executemany(f'DELETE FROM {schema}.{table_name} WHERE item_code = ?',
+                                         [(product.item_code or '',) for product in products_data])
+                target_table = table_name
+            else:
+                target_table = self.create_shadow_table(write_cursor, table_name, schema)
+            
+            # Insert products
+            write_cursor.executemany(f'''
+                INSERT INTO {schema}.{target_table} (
                     item_code, item_name, manufacturer_name, item_price,
                     unit_of_measure, quantity, price_update_date
                 ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                product.get('item_code', ''),
-                product.get('item_name', ''),
-                product.get('manufacturer_name', ''),
-                float(product.get('item_price', 0)),
-                product.get('unit_of_measure', ''),
-                float(product.get('quantity', 0)) if product.get('quantity') else 0,
-                product.get('price_update_date', '')
-            ))
-        
-        # Update metadata
-        cursor.execute(f'''
-            UPDATE {metadata_table} 
-            SET total_products = ?, last_update = ?
-            WHERE id = 1
-        ''', (len(products_data), datetime.now().isoformat()))
-        
-        # Also update total_promotions if the column exists
-        try:
-            cursor.execute(f'''
+            ''', [(
+                product.item_code or '',
+                product.item_name or '',
+                product.manufacturer_name or '',
+                float(product.item_price or 0),
+                product.unit_of_measure or '',
+                float(product.quantity) if product.quantity else 0,
+                product.price_update_date or ''
+            ) for product in products_data])
+            
+            if delta:
+                total_products = write_cursor.execute(f'SELECT COUNT(*) FROM {schema}.{table_name}').fetchone()[0]
+                write_cursor.execute(f'''
+                    UPDATE {metadata_table} 
+                    SET total_products = ?, last_update = ?
+                    WHERE id = 1
+                ''', (total_products, datetime.now().isoformat()))
+        
+        if not delta:
+            self.swap_shadow_tables(table_prefix, [table_name], (f'''
                 UPDATE {metadata_table} 
-                SET total_promotions = total_promotions
+                SET total_products = ?, last_update = ?
                 WHERE id = 1
-            ''')
-        except sqlite3.Error:
-            # Column might not exist, that's okay
-            pass
-        
-        conn.commit()
-        conn.close()
+            ''', (len(products_data), datetime.now().isoformat())), cursor, schema)
         
         print(f"✅ Inserted {len(products_data)} products into {table_name}")
         return len(products_data)
     
-    def insert_branch_promotions(self, chain_code, branch_code, promotions_data):
-        """Insert promotions into a branch table"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        promotions_table = f"branch_{chain_code}_{branch_code}_promotions"
-        promotion_items_table = f"branch_{chain_code}_{branch_code}_promotion_items"
-        metadata_table = f"branch_{chain_code}_{branch_code}_products_metadata"
-        
-        # Clear existing promotions and items
-        cursor.execute(f'DELETE FROM {promotion_items_table}')
-        cursor.execute(f'DELETE FROM {promotions_table}')
+    def insert_branch_promotions(self, chain_code, branch_code, promotions_data, delta=False, cursor=None, schema='main'):
+        """
+        Insert PromotionRecords into a branch table. A full reload fills shadow
+        tables and swaps them in; delta=True replaces only the promotions given.
+        """
+        table_prefix = f"branch_{chain_code}_{branch_code}"
+        promotions_table = f"{table_prefix}_promotions"
+        promotion_items_table = f"{table_prefix}_promotion_items"
+        metadata_table = f"{schema}.{table_prefix}_products_metadata"
         
         total_promotions = 0
         total_items = 0
         
-        # Insert promotions
-        for promotion in promotions_data:
-            cursor.execute(f'''
-                INSERT INTO {promotions_table} (
-                    promotion_id, promotion_description, promotion_update_date,
-                    promotion_start_date, promotion_start_hour, promotion_end_date, promotion_end_hour,
-                    discounted_price, discounted_price_per_unit, discount_rate,
-                    min_quantity, max_quantity, min_purchase_amount, allow_multiple_discounts,
-                    reward_type, discount_type, remarks
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        with self.writing(cursor) as write_cursor:
+            if delta:
+                # A Promo delta file carries each changed promotion with all of its items
+                promotion_ids = [(promotion.promotion_id or '',) for promotion in promotions_data]
+                write_cursor.executemany(f'DELETE FROM {schema}.{promotion_items_table} WHERE promotion_id = ?',
+                                         promotion_ids)
+                write_cursor.executemany(f'DELETE FROM {schema}.{promotions_table} WHERE promotion_id = ?',
+                                         promotion_ids)
+                target_promotions, target_items = promotions_table, promotion_items_table
+            else:
+                target_promotions = self.create_shadow_table(write_cursor, promotions_table, schema)
+                target_items = self.create_shadow_table(write_cursor, promotion_items_table, schema)
+            
+            # Insert promotions
+            for promotion in promotions_data:
+                write_cursor.execute(f'''
+                    INSERT INTO {schema}.{target_promotions} (
+                        promotion_id, promotion_description, promotion_update_date,
+                        promotion_start_date, promotion_start_hour, promotion_end_date, promotion_end_hour,
+                        discounted_price, discounted_price_per_unit, discount_rate,
+                        min_quantity, max_quantity, min_purchase_amount, allow_multiple_discounts,
+                        reward_type, discount_type, remarks
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    promotion.promotion_id or '',
+                    promotion.promotion_description or '',
+                    promotion.promotion_update_date or '',
+                    promotion.promotion_start_date or '',
+                    promotion.promotion_start_hour or '',
+                    promotion.promotion_end_date or '',
+                    promotion.promotion_end_hour or '',
+                    float(promotion.discounted_price or 0),
+                    float(promotion.discounted_price_per_unit or 0),
+                    float(promotion.discount_rate or 0),
+                    int(float(promotion.min_quantity or 0)),
+                    int(float(promotion.max_quantity or 0)),
+                    float(promotion.min_purchase_amount or 0),
+                    int(float(promotion.allow_multiple_discounts or 0)),
+                    int(float(promotion.reward_type or 0)),
+                    int(float(promotion.discount_type or 0)),
+                    promotion.remarks or ''
+                ))
+                
+                total_promotions += 1
+                
+                # Insert promotion items
+                write_cursor.executemany(f'''
+                    INSERT INTO {schema}.{target_items} (
+                        promotion_id, item_code, is_gift_item, item_type
+                    ) VALUES (?, ?, ?, ?)
+                ''', [(
+                    promotion.promotion_id or '',
+                    item.item_code or '',
+                    int(float(item.is_gift_item or 0)),
+                    int(float(item.item_type or 1))
+                ) for item in promotion.items])
+                total_items += len(promotion.items)
+            
+            # Update metadata
+            if delta:
+                stored_promotions = write_cursor.execute(
+                    f'SELECT COUNT(*) FROM {schema}.{promotions_table}').fetchone()[0]
+                write_cursor.execute(f'''
+                    UPDATE {metadata_table} 
+                    SET total_promotions = ?, last_update = ?
+                    WHERE id = 1
+                ''', (stored_promotions, datetime.now().isoformat()))
+        
+        if not delta:
+            self.swap_shadow_tables(table_prefix, [promotion_items_table, promotions_table], (f'''
+                UPDATE {metadata_table} 
+                SET total_promotions = ?, last_update = ?
+                WHERE id = 1
+            ''', (total_promotions, datetime.now().isoformat())), cursor, schema)
+        
+        print(f"✅ Inserted {total_promotions} promotions and {total_items} items into {promotions_table}")
+        return total_promotions
+    
+    def upsert_branch_locations(self, locations):
+        """Store branch coordinates (dicts from branch_locations.py) and index them in the R*Tree"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        
+        for location in locations:
+            cursor.execute('''
+                INSERT INTO branch_locations (
+                    chain_code, branch_code, branch_name, address, city,
+                    latitude, longitude, source, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chain_code, branch_code) DO UPDATE SET
+                    branch_name = COALESCE(NULLIF(excluded.branch_name, ''), branch_name),
+                    address = COALESCE(NULLIF(excluded.address, ''), address),
+                    city = COALESCE(NULLIF(excluded.city, ''), city),
+                    latitude = excluded.latitude,
+                    longitude = excluded.longitude,
+                    source = excluded.source,
+                    last_updated = excluded.last_updated
             ''', (
-                promotion.get('promotion_id', ''),
-                promotion.get('promotion_description', ''),
-                promotion.get('promotion_update_date', ''),
-                promotion.get('promotion_start_date', ''),
-                promotion.get('promotion_start_hour', ''),
-                promotion.get('promotion_end_date', ''),
-                promotion.get('promotion_end_hour', ''),
-                float(promotion.get('discounted_price', 0) or 0),
-                float(promotion.get('discounted_price_per_unit', 0) or 0),
-                float(promotion.get('discount_rate', 0) or 0),
-                int(float(promotion.get('min_quantity', 0) or 0)),
-                int(float(promotion.get('max_quantity', 0) or 0)),
-                float(promotion.get('min_purchase_amount', 0) or 0),
-                int(float(promotion.get('allow_multiple_discounts', 0) or 0)),
-                int(float(promotion.get('reward_type', 0) or 0)),
-                int(float(promotion.get('discount_type', 0) or 0)),
-                promotion.get('remarks', '')
+                location['chain_code'], location['branch_code'],
+                location.get('branch_name', ''), location.get('address', ''), location.get('city', ''),
+                location['latitude'], location['longitude'],
+                location.get('source', ''), datetime.now().isoformat()
             ))
             
-            total_promotions += 1
+            cursor.execute('SELECT id FROM branch_locations WHERE chain_code = ? AND branch_code = ?',
+                           (location['chain_code'], location['branch_code']))
+            location_id = cursor.fetchone()[0]
+            cursor.execute('''
+                INSERT OR REPLACE INTO branch_locations_rtree (id, min_lat, max_lat, min_lon, max_lon)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (location_id, location['latitude'], location['latitude'],
+                  location['longitude'], location['longitude']))
             
-            # Insert promotion items
-            for item in promotion.get('items', []):
+            # Fill the placeholder columns of the chain's branches table too
+            table_name = f"chain_{location['chain_code']}_branches"
+            if table_name in tables:
                 cursor.execute(f'''
-                    INSERT INTO {promotion_items_table} (
-                        promotion_id, item_code, is_gift_item, item_type
-                    ) VALUES (?, ?, ?, ?)
+                    UPDATE {table_name}
+                    SET address = COALESCE(NULLIF(?, ''), address), coordinates = ?
+                    WHERE branch_code = ?
                 ''', (
-                    promotion.get('promotion_id', ''),
-                    item.get('item_code', ''),
-                                    int(float(item.get('is_gift_item', 0) or 0)),
-                int(float(item.get('item_type', 1) or 1))
+                    ", ".join(part for part in (location.get('address'), location.get('city')) if part),
+                    f"{location['latitude']},{location['longitude']}",
+                    location['branch_code']
                 ))
-                total_items += 1
-        
-        # Update metadata
-        cursor.execute(f'''
-            UPDATE {metadata_table} 
-            SET total_promotions = ?, last_update = ?
-            WHERE id = 1
-        ''', (total_promotions, datetime.now().isoformat()))
         
         conn.commit()
         conn.close()
+        return len(locations)
+    
+    def branches_in_radius(self, latitude, longitude, radius_km):
+        """Branches within radius_km, nearest first, each with its distance_km"""
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
         
-        print(f"✅ Inserted {total_promotions} promotions and {total_items} items into {promotions_table}")
-        return total_promotions
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT l.chain_code, l.branch_code, l.branch_name, l.address, l.city, l.latitude, l.longitude
+            FROM branch_locations_rtree r
+            JOIN branch_locations l ON l.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+        ''', (min_lat, max_lat, min_lon, max_lon))
+        rows = cursor.fetchall()
+        conn.close()
+        
+        branches = []
+        for chain_code, branch_code, branch_name, address, city, lat, lon in rows:
+            distance = haversine_km(latitude, longitude, lat, lon)
+            if distance <= radius_km:
+                branches.append({
+                    "chain_code": chain_code,
+                    "branch_code": branch_code,
+                    "branch_name": branch_name,
+                    "address": address,
+                    "city": city,
+                    "latitude": lat,
+                    "longitude": lon,
+                    "distance_km": round(distance, 3)
+                })
+        branches.sort(key=lambda branch: branch["distance_km"])
+        return branches
+    
+    def nearest_branches(self, latitude, longitude, k, max_radius_km=None, start_radius_km=2.0):
+        """
+        The k nearest branches. The search radius doubles until it holds k
+        branches: everything nearer than the k-th is then inside the circle.
+        """
+        radius = start_radius_km if max_radius_km is None else min(start_radius_km, max_radius_km)
+        limit = max_radius_km if max_radius_km is not None else math.pi * EARTH_RADIUS_KM
+        while True:
+            branches = self.branches_in_radius(latitude, longitude, radius)
+            if len(branches) >= k or radius >= limit:
+                return branches[:k]
+            radius = min(radius * 2, limit)
     
     def get_database_overview(self):
         """Get a complete overview of the hierarchical database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         overview = {
@@ -495,5 +729,7 @@ class HierarchicalFoodDatabase:
         conn.close()
         return overview
 
-# Initialize the hierarchical database
-db = HierarchicalFoodDatabase() 
\ No newline at end of file
+# Initialize the hierarchical database when run directly (importing stays side-effect free)
+if __name__ == "__main__":
+    HierarchicalFoodDatabase()
+ 
\ No newline at end of file
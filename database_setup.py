@@ -1,158 +1,51 @@
 import sqlite3
 import os
 import datetime
+import json
+from db_connections import ConnectionProvider
+from delta_ingest import parse_file_name
+from migrations import FOOD_CHAINS_MIGRATIONS, apply_migrations, latest_version
+from name_matching import trigram_rows, trigrams
+from product_catalogue import canonical_barcode, catalogue_entry, normalize_name
+from read_replica import READ_REPLICAS, ReplicaPointer
+from search_cache import SearchCache, search_key
+from unit_normalization import product_unit_price
 
 class FoodChainDatabase:
-    def __init__(self, db_path="data/food_chains.db"):
+    # Stored in PRAGMA user_version; add a migration to change the schema
+    SCHEMA_VERSION = latest_version(FOOD_CHAINS_MIGRATIONS)
+    
+    def __init__(self, db_path="data/food_chains.db", read_only=False):
         self.db_path = db_path
-        self.ensure_data_directory()
-        self.init_database()
+        self.read_only = read_only
+        # Serving workers read the newest published replica when replicas are on (read_replica.py)
+        replicas = ReplicaPointer(db_path) if read_only and READ_REPLICAS else None
+        self.connections = ConnectionProvider(db_path, read_only=read_only, replicas=replicas)
+        self.search_cache = SearchCache()
+        # Read-only handles (serving workers) never create or migrate the schema
+        if not read_only:
+            self.ensure_data_directory()
+            self.init_database()
+    
+    def connect(self):
+        """Read-write connection, or this thread's shared read-only connection"""
+        return self.connections.connect()
     
     def ensure_data_directory(self):
         """Create data directory if it doesn't exist"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
     
     def init_database(self):
-        """Initialize database with optimized schema for product price lookups"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create metadata table to track food chains
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS food_chains_metadata (
-                chain_code TEXT PRIMARY KEY,
-                actual_chain_code TEXT,
-                chain_name TEXT NOT NULL,
-                chain_url TEXT NOT NULL,
-                last_updated TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create branches table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS branches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chain_code TEXT NOT NULL,
-                branch_code TEXT NOT NULL,
-                branch_name TEXT NOT NULL,
-                
-                price_file_name TEXT,
-                price_file_date TEXT,
-                price_file_status TEXT DEFAULT 'pending',
-                
-                promo_file_name TEXT,
-                promo_file_date TEXT,
-                promo_file_status TEXT DEFAULT 'pending',
-                
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                FOREIGN KEY (chain_code) REFERENCES food_chains_metadata(chain_code),
-                UNIQUE(chain_code, branch_code)
-            )
-        ''')
-        
-        # Create products table - stores all products with prices per branch
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chain_code TEXT NOT NULL,
-                branch_code TEXT NOT NULL,
-                
-                -- Product identification
-                item_code TEXT NOT NULL,
-                item_name TEXT NOT NULL,
-                manufacturer_name TEXT,
-                manufacturer_item_description TEXT,
-                
-                -- Pricing information
-                item_price REAL NOT NULL,
-                unit_of_measure_price REAL,
-                unit_qty TEXT,
-                quantity REAL,
-                unit_of_measure TEXT,
-                
-                -- Product attributes
-                is_weighted INTEGER DEFAULT 0,
-                qty_in_package REAL,
-                allow_discount INTEGER DEFAULT 1,
-                item_status INTEGER DEFAULT 1,
-                manufacture_country TEXT,
-                
-                -- Metadata
-                price_update_date TIMESTAMP,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                FOREIGN KEY (chain_code, branch_code) REFERENCES branches(chain_code, branch_code),
-                UNIQUE(chain_code, branch_code, item_code)
-            )
-        ''')
-        
-        # Create promotions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS promotions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chain_code TEXT NOT NULL,
-                branch_code TEXT NOT NULL,
-                
-                promotion_id TEXT NOT NULL,
-                promotion_description TEXT NOT NULL,
-                
-                -- Date and time ranges
-                promotion_start_date DATE,
-                promotion_start_hour TIME,
-                promotion_end_date DATE,
-                promotion_end_hour TIME,
-                
-                -- Discount details
-                reward_type INTEGER,
-                discount_type INTEGER,
-                discount_rate REAL,
-                discounted_price REAL,
-                discounted_price_per_mida REAL,
-                
-                -- Quantity rules
-                min_qty INTEGER DEFAULT 1,
-                max_qty INTEGER DEFAULT 0,
-                min_purchase_amount REAL DEFAULT 0,
-                
-                -- Metadata  
-                promotion_update_date TIMESTAMP,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                FOREIGN KEY (chain_code, branch_code) REFERENCES branches(chain_code, branch_code),
-                UNIQUE(chain_code, branch_code, promotion_id)
-            )
-        ''')
-        
-        # Create promotion_items table - links promotions to products
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS promotion_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                promotion_id INTEGER NOT NULL,
-                item_code TEXT NOT NULL,
-                is_gift_item INTEGER DEFAULT 0,
-                item_type INTEGER DEFAULT 1,
-                
-                FOREIGN KEY (promotion_id) REFERENCES promotions(id),
-                UNIQUE(promotion_id, item_code)
-            )
-        ''')
-        
-        # Create indexes for fast lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item_code ON products(item_code)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item_name ON products(item_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_branch ON products(chain_code, branch_code)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_promotions_dates ON promotions(promotion_start_date, promotion_end_date)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_promotion_items_code ON promotion_items(item_code)')
-        
-        conn.commit()
+        """Create the schema or upgrade it to the latest migration (see migrations.py)"""
+        conn = self.connect()
+        applied = apply_migrations(conn, FOOD_CHAINS_MIGRATIONS, self.db_path)
         conn.close()
-        print(f"✅ Database initialized at: {self.db_path}")
+        if applied:
+            print(f"✅ Database initialized at: {self.db_path}")
     
     def add_food_chain(self, chain_code, chain_name, chain_url, actual_chain_code=None):
         """Add a food chain to the metadata table"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -168,7 +61,7 @@ class FoodChainDatabase:
     
     def update_actual_chain_code(self, placeholder_code, actual_chain_code):
         """Update the actual chain code for an existing food chain"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -190,7 +83,7 @@ class FoodChainDatabase:
     
     def insert_branches(self, chain_code, branches_data):
         """Insert branch information"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         for branch_code, branch_info in branches_data.items():
@@ -215,104 +108,554 @@ class FoodChainDatabase:
         conn.close()
         print(f"✅ Inserted {len(branches_data)} branches for chain {chain_code}")
     
-    def insert_products(self, chain_code, branch_code, products_data):
-        """Insert parsed product data from PriceFull XML"""
-        conn = sqlite3.connect(self.db_path)
+    def update_branch_files(self, chain_code, branch_code, price_file=None, promo_file=None, cursor=None):
+        """Point a branch at newer PriceFull/PromoFull files; None leaves a file unchanged"""
+        with self.connections.writing(cursor) as cursor:
+            for prefix, file_name in (('price', price_file), ('promo', promo_file)):
+                published = parse_file_name(file_name)
+                if not published:
+                    continue
+                cursor.execute(f'''
+                    UPDATE branches
+                    SET {prefix}_file_name = ?, {prefix}_file_date = ?, {prefix}_file_status = 'found'
+                    WHERE chain_code = ? AND branch_code = ?
+                ''', (file_name, published.file_date, chain_code, branch_code))
+    
+    def get_food_chains(self):
+        """Return stored food chains as dicts with code, name and url"""
+        conn = self.connect()
         cursor = conn.cursor()
-        
-        for product in products_data:
-            cursor.execute('''
+        cursor.execute('SELECT chain_code, chain_name, chain_url FROM food_chains_metadata ORDER BY chain_code')
+        chains = [{"code": row[0], "name": row[1], "url": row[2]} for row in cursor.fetchall()]
+        conn.close()
+        return chains
+    
+    def get_chains_by_actual_code(self):
+        """{chain code used in file names: {"code", "name", "url"}} for chains whose code is known"""
+        conn = self.connect()
+        rows = conn.execute('SELECT chain_code, actual_chain_code, chain_name, chain_url FROM food_chains_metadata').fetchall()
+        conn.close()
+        return {row[1]: {"code": row[0], "name": row[2], "url": row[3]} for row in rows if row[1]}
+    
+    def get_branch_files(self, chain_code):
+        """{branch_code: (branch_name, price_file_name, promo_file_name)} for one chain"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT branch_code, branch_name, price_file_name, promo_file_name
+            FROM branches WHERE chain_code = ?
+        ''', (chain_code,)).fetchall()
+        conn.close()
+        return {row[0]: tuple(row[1:]) for row in rows}
+    
+    def count_branches(self):
+        """Return the number of stored branches (0 before the first discovery)"""
+        conn = self.connect()
+        count = conn.execute('SELECT COUNT(*) FROM branches').fetchone()[0]
+        conn.close()
+        return count
+    
+    def save_discovery_phase(self, phase, details=None):
+        """Record that a discovery phase finished, with whatever it needs to resume"""
+        conn = self.connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO discovery_progress (phase, details, completed_at)
+            VALUES (?, ?, ?)
+        ''', (phase, json.dumps(details or {}, ensure_ascii=False), datetime.datetime.now()))
+        conn.commit()
+        conn.close()
+    
+    def get_discovery_progress(self):
+        """Return {phase: details} for every completed discovery phase"""
+        conn = self.connect()
+        rows = conn.execute('SELECT phase, details FROM discovery_progress').fetchall()
+        conn.close()
+        return {phase: json.loads(details or '{}') for phase, details in rows}
+    
+    def clear_discovery_progress(self):
+        """Forget discovery checkpoints so the next run starts from scratch"""
+        conn = self.connect()
+        conn.execute('DELETE FROM discovery_progress')
+        conn.commit()
+        conn.close()
+    
+    def insert_products(self, chain_code, branch_code, products_data, cursor=None):
+        """Insert normalized ProductRecords parsed from PriceFull XML, linked to the product catalogue"""
+        with self.connections.writing(cursor) as cursor:
+            # New barcodes get a catalogue entry; known ones only refresh last_seen
+            seen_at = datetime.datetime.now()
+            entries = {}
+            for product in products_data:
+                entry = catalogue_entry(chain_code, product, seen_at)
+                entries.setdefault(entry[0], entry)
+            cursor.executemany('''
+                INSERT INTO product_catalogue (
+                    barcode, item_name, normalized_name, manufacturer_name, unit_of_measure,
+                    unit_qty, quantity, is_weighted, first_seen, last_seen
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(barcode) DO UPDATE SET last_seen = excluded.last_seen
+            ''', list(entries.values()))
+            
+            # New entries get their trigrams for fuzzy matching (name_matching.py)
+            cursor.execute('SELECT product_id, normalized_name FROM product_catalogue WHERE trigram_count IS NULL')
+            index_rows = []
+            trigram_counts = []
+            for product_id, normalized in cursor.fetchall():
+                rows = trigram_rows(product_id, normalized)
+                index_rows.extend(rows)
+                trigram_counts.append((len(rows), product_id))
+            cursor.executemany('INSERT OR IGNORE INTO catalogue_trigrams (trigram, product_id) VALUES (?, ?)', index_rows)
+            cursor.executemany('UPDATE product_catalogue SET trigram_count = ? WHERE product_id = ?', trigram_counts)
+            
+            cursor.executemany('''
                 INSERT OR REPLACE INTO products 
                 (chain_code, branch_code, item_code, item_name, manufacturer_name,
                  manufacturer_item_description, item_price, unit_of_measure_price,
                  unit_qty, quantity, unit_of_measure, is_weighted, qty_in_package,
-                 allow_discount, item_status, manufacture_country, price_update_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                chain_code, branch_code, product['ItemCode'], product['ItemNm'],
-                product['ManufacturerName'], product['ManufacturerItemDescription'],
-                float(product['ItemPrice']), float(product['UnitOfMeasurePrice']),
-                product['UnitQty'], float(product['Quantity']), product['UnitOfMeasure'],
-                int(product['bIsWeighted']), float(product['QtyInPackage']),
-                int(product['AllowDiscount']), int(product['ItemStatus']),
-                product['ManufactureCountry'], product['PriceUpdateDate']
-            ))
-        
-        conn.commit()
-        conn.close()
+                 allow_discount, item_status, manufacture_country, price_update_date,
+                 canonical_unit, canonical_quantity, price_per_canonical_unit, product_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        (SELECT product_id FROM product_catalogue WHERE barcode = ?))
+            ''', [(
+                chain_code, branch_code, product.item_code, product.item_name,
+                product.manufacturer_name, product.manufacturer_item_description,
+                float(product.item_price), float(product.unit_of_measure_price),
+                product.unit_qty, float(product.quantity), product.unit_of_measure,
+                int(product.is_weighted), float(product.qty_in_package),
+                int(product.allow_discount), int(product.item_status),
+                product.manufacture_country, product.price_update_date
+            ) + product_unit_price(product) + (
+                canonical_barcode(chain_code, product.item_code),
+            ) for product in products_data])
         print(f"✅ Inserted {len(products_data)} products for branch {branch_code}")
     
-    def insert_promotions(self, chain_code, branch_code, promotions_data):
-        """Insert parsed promotion data from PromoFull XML"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        for promo in promotions_data:
-            # Insert promotion
-            cursor.execute('''
-                INSERT OR REPLACE INTO promotions 
-                (chain_code, branch_code, promotion_id, promotion_description,
-                 promotion_start_date, promotion_start_hour, promotion_end_date, promotion_end_hour,
-                 reward_type, discount_type, discount_rate, discounted_price,
-                 discounted_price_per_mida, min_qty, max_qty, min_purchase_amount,
-                 promotion_update_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                chain_code, branch_code, promo['PromotionId'], promo['PromotionDescription'],
-                promo['PromotionStartDate'], promo['PromotionStartHour'],
-                promo['PromotionEndDate'], promo['PromotionEndHour'],
-                int(promo['RewardType']), int(promo['DiscountType']),
-                float(promo['DiscountRate']), float(promo['DiscountedPrice']),
-                float(promo['DiscountedPricePerMida']), int(promo['MinQty']),
-                int(promo['MaxQty']), float(promo['MinPurchaseAmnt']),
-                promo['PromotionUpdateDate']
-            ))
-            
-            promotion_db_id = cursor.lastrowid
-            
-            # Insert promotion items
-            for item in promo['PromotionItems']:
+    def insert_promotions(self, chain_code, branch_code, promotions_data, cursor=None):
+        """Insert normalized PromotionRecords parsed from PromoFull XML"""
+        with self.connections.writing(cursor) as cursor:
+            for promo in promotions_data:
+                # REPLACE gives a re-published promotion a new id; drop the old row's items
+                cursor.execute('''
+                    DELETE FROM promotion_items WHERE promotion_id IN (
+                        SELECT id FROM promotions WHERE chain_code = ? AND branch_code = ? AND promotion_id = ?
+                    )
+                ''', (chain_code, branch_code, promo.promotion_id))
+                
+                # Insert promotion
                 cursor.execute('''
+                    INSERT OR REPLACE INTO promotions 
+                    (chain_code, branch_code, promotion_id, promotion_description,
+                     promotion_start_date, promotion_start_hour, promotion_end_date, promotion_end_hour,
+                     reward_type, discount_type, discount_rate, discounted_price,
+                     discounted_price_per_mida, min_qty, max_qty, min_purchase_amount,
+                     promotion_update_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    chain_code, branch_code, promo.promotion_id, promo.promotion_description,
+                    promo.promotion_start_date, promo.promotion_start_hour,
+                    promo.promotion_end_date, promo.promotion_end_hour,
+                    int(promo.reward_type), int(promo.discount_type),
+                    float(promo.discount_rate), float(promo.discounted_price),
+                    float(promo.discounted_price_per_unit), int(promo.min_quantity),
+                    int(promo.max_quantity), float(promo.min_purchase_amount),
+                    promo.promotion_update_date
+                ))
+                
+                promotion_db_id = cursor.lastrowid
+                
+                # Insert promotion items
+                cursor.executemany('''
                     INSERT OR REPLACE INTO promotion_items
                     (promotion_id, item_code, is_gift_item, item_type)
                     VALUES (?, ?, ?, ?)
-                ''', (promotion_db_id, item['ItemCode'], int(item['IsGiftItem']), int(item['ItemType'])))
+                ''', [(promotion_db_id, item.item_code, int(item.is_gift_item), int(item.item_type))
+                      for item in promo.items])
+        print(f"✅ Inserted {len(promotions_data)} promotions for branch {branch_code}")
+    
+    def record_published_files(self, chain_code, branch_files):
+        """Replace the file listing of each branch ({branch_code: [file_name, ...]})"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        listed_at = datetime.datetime.now()
+        
+        for branch_code, file_names in branch_files.items():
+            cursor.execute('DELETE FROM published_files WHERE chain_code = ? AND branch_code = ?',
+                           (chain_code, branch_code))
+            published = [parse_file_name(file_name) for file_name in file_names]
+            cursor.executemany('''
+                INSERT OR IGNORE INTO published_files
+                (chain_code, branch_code, file_kind, file_date, file_name, is_full, listed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(chain_code, branch_code, f.file_kind, f.file_date, f.file_name, int(f.is_full), listed_at)
+                  for f in published if f])
         
         conn.commit()
         conn.close()
-        print(f"✅ Inserted {len(promotions_data)} promotions for branch {branch_code}")
+    
+    def get_published_files(self, chain_code, branch_code):
+        """PublishedFiles listed for a branch, oldest first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT file_name FROM published_files
+            WHERE chain_code = ? AND branch_code = ?
+            ORDER BY file_kind, file_date
+        ''', (chain_code, branch_code)).fetchall()
+        conn.close()
+        return [parse_file_name(row[0]) for row in rows]
+    
+    def get_ingest_state(self, chain_code, branch_code):
+        """{file_kind: state dict} of what has been loaded for a branch"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT file_kind, full_file_name, full_file_date, applied_file_name,
+                   applied_through, deltas_applied, updated_at
+            FROM branch_ingest_state
+            WHERE chain_code = ? AND branch_code = ?
+        ''', (chain_code, branch_code)).fetchall()
+        conn.close()
+        return {r[0]: {'full_file_name': r[1], 'full_file_date': r[2], 'applied_file_name': r[3],
+                       'applied_through': r[4], 'deltas_applied': r[5], 'updated_at': r[6]} for r in rows}
+    
+    def record_file_applied(self, chain_code, branch_code, file_name, cursor=None):
+        """Advance a branch's ingest state past a Full or delta file that was loaded"""
+        published = parse_file_name(file_name)
+        if not published:
+            print(f"⚠️ Not a Price/Promo file name, ingest state unchanged: {file_name}")
+            return
+        
+        with self.connections.writing(cursor) as cursor:
+            if published.is_full:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO branch_ingest_state
+                    (chain_code, branch_code, file_kind, full_file_name, full_file_date,
+                     applied_file_name, applied_through, deltas_applied, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+                ''', (chain_code, branch_code, published.file_kind, file_name, published.file_date,
+                      file_name, published.file_date, datetime.datetime.now()))
+            else:
+                cursor.execute('''
+                    UPDATE branch_ingest_state
+                    SET applied_file_name = ?, applied_through = ?, deltas_applied = deltas_applied + 1, updated_at = ?
+                    WHERE chain_code = ? AND branch_code = ? AND file_kind = ?
+                ''', (file_name, published.file_date, datetime.datetime.now(),
+                      chain_code, branch_code, published.file_kind))
+    
+    def ensure_refresh_schedule(self, chain_code, interval_minutes):
+        """Add a chain to the refresh schedule (listed right away); an existing entry keeps its settings"""
+        conn = self.connect()
+        conn.execute('''
+            INSERT OR IGNORE INTO refresh_schedule (chain_code, interval_minutes, enabled, next_run_at)
+            VALUES (?, ?, 1, ?)
+        ''', (chain_code, interval_minutes, datetime.datetime.now()))
+        conn.commit()
+        conn.close()
+    
+    def set_refresh_schedule(self, chain_code, interval_minutes=None, enabled=None):
+        """Change a chain's listing cadence and/or switch it on or off; None leaves a value unchanged"""
+        conn = self.connect()
+        conn.execute('''
+            INSERT INTO refresh_schedule (chain_code, interval_minutes, enabled, next_run_at)
+            VALUES (?, COALESCE(?, 60), COALESCE(?, 1), ?)
+            ON CONFLICT(chain_code) DO UPDATE SET
+                interval_minutes = COALESCE(?, interval_minutes),
+                enabled = COALESCE(?, enabled)
+        ''', (chain_code, interval_minutes, enabled, datetime.datetime.now(), interval_minutes, enabled))
+        conn.commit()
+        conn.close()
+    
+    def get_refresh_schedule(self):
+        """Every scheduled chain with its cadence, next run and failure streak"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT chain_code, interval_minutes, enabled, next_run_at, last_run_at,
+                   last_success_at, consecutive_failures, last_error
+            FROM refresh_schedule ORDER BY chain_code
+        ''').fetchall()
+        conn.close()
+        return [{'chain_code': r[0], 'interval_minutes': r[1], 'enabled': bool(r[2]), 'next_run_at': r[3],
+                 'last_run_at': r[4], 'last_success_at': r[5], 'consecutive_failures': r[6],
+                 'last_error': r[7]} for r in rows]
+    
+    def due_refresh_chains(self, now):
+        """(chain_code, interval_minutes, consecutive_failures) of enabled chains due for a listing"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT chain_code, interval_minutes, consecutive_failures
+            FROM refresh_schedule
+            WHERE enabled = 1 AND next_run_at <= ?
+        ''', (now,)).fetchall()
+        conn.close()
+        return rows
+    
+    def record_chain_listing(self, chain_code, next_run_at, error=None):
+        """Store the outcome of a chain's file listing and when to list it next"""
+        conn = self.connect()
+        now = datetime.datetime.now()
+        if error:
+            conn.execute('''
+                UPDATE refresh_schedule
+                SET last_run_at = ?, next_run_at = ?, consecutive_failures = consecutive_failures + 1, last_error = ?
+                WHERE chain_code = ?
+            ''', (now, next_run_at, error, chain_code))
+        else:
+            conn.execute('''
+                UPDATE refresh_schedule
+                SET last_run_at = ?, last_success_at = ?, next_run_at = ?, consecutive_failures = 0, last_error = NULL
+                WHERE chain_code = ?
+            ''', (now, now, next_run_at, chain_code))
+        conn.commit()
+        conn.close()
+    
+    def enqueue_branch_refreshes(self, chain_code, branch_codes, now):
+        """Queue branches for an ingest; queued branches keep their attempts and backoff"""
+        conn = self.connect()
+        conn.executemany('''
+            INSERT OR IGNORE INTO refresh_queue (chain_code, branch_code, enqueued_at, next_attempt_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(chain_code, branch_code, now, now) for branch_code in branch_codes])
+        conn.commit()
+        conn.close()
+    
+    def due_branch_refreshes(self, now, limit):
+        """(chain_code, branch_code, attempts) of queued branches whose next attempt is due, oldest first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT chain_code, branch_code, attempts FROM refresh_queue
+            WHERE next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+        ''', (now, limit)).fetchall()
+        conn.close()
+        return rows
+    
+    def complete_branch_refresh(self, chain_code, branch_code):
+        conn = self.connect()
+        conn.execute('DELETE FROM refresh_queue WHERE chain_code = ? AND branch_code = ?', (chain_code, branch_code))
+        conn.commit()
+        conn.close()
+    
+    def fail_branch_refresh(self, chain_code, branch_code, error, next_attempt_at):
+        """Keep a failed branch queued and push its next attempt back"""
+        conn = self.connect()
+        conn.execute('''
+            UPDATE refresh_queue SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?
+            WHERE chain_code = ? AND branch_code = ?
+        ''', (error, next_attempt_at, chain_code, branch_code))
+        conn.commit()
+        conn.close()
+    
+    def get_refresh_queue(self, limit=100):
+        """Queued branch refreshes, next due first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT chain_code, branch_code, enqueued_at, next_attempt_at, attempts, last_error
+            FROM refresh_queue ORDER BY next_attempt_at LIMIT ?
+        ''', (limit,)).fetchall()
+        conn.close()
+        return [{'chain_code': r[0], 'branch_code': r[1], 'enqueued_at': r[2], 'next_attempt_at': r[3],
+                 'attempts': r[4], 'last_error': r[5]} for r in rows]
+    
+    def record_archived_file(self, entry):
+        """Index one file of the raw file archive (file_archive.py); entry maps archived_files columns"""
+        conn = self.connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO archived_files
+            (file_stem, file_name, chain_code, branch_code, file_kind, is_full, file_date,
+             sha256, archive_path, raw_size, stored_size, archived_at)
+            VALUES (:file_stem, :file_name, :chain_code, :branch_code, :file_kind, :is_full, :file_date,
+                    :sha256, :archive_path, :raw_size, :stored_size, :archived_at)
+        ''', entry)
+        conn.commit()
+        conn.close()
+    
+    def get_archived_file(self, file_stem):
+        """archive_path of an archived file, or None"""
+        conn = self.connect()
+        row = conn.execute('SELECT archive_path FROM archived_files WHERE file_stem = ?', (file_stem,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def find_archived_blob(self, sha256):
+        """archive_path already holding this content, or None"""
+        conn = self.connect()
+        row = conn.execute('SELECT archive_path FROM archived_files WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def get_archived_files_through(self, chain_code, branch_code, file_kind, as_of):
+        """(file_name, is_full, file_date) of a branch's archived files of one kind dated up to as_of, oldest first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT file_name, is_full, file_date FROM archived_files
+            WHERE chain_code = ? AND branch_code = ? AND file_kind = ? AND file_date <= ?
+            ORDER BY file_date
+        ''', (chain_code, branch_code, file_kind, as_of)).fetchall()
+        conn.close()
+        return rows
+    
+    def list_archived_files(self):
+        """Every archived file as (archive_path, stored_size, chain_code, branch_code, file_kind, is_full, file_date), oldest first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT archive_path, stored_size, chain_code, branch_code, file_kind, is_full, file_date
+            FROM archived_files ORDER BY file_date
+        ''').fetchall()
+        conn.close()
+        return rows
+    
+    def list_archived_sources(self):
+        """Every archived file as (file_name, chain_code, branch_code, archive_path), oldest first"""
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT file_name, chain_code, branch_code, archive_path
+            FROM archived_files ORDER BY file_date
+        ''').fetchall()
+        conn.close()
+        return rows
+    
+    def remove_archived_blob(self, archive_path):
+        """Drop every archived file stored in one blob"""
+        conn = self.connect()
+        conn.execute('DELETE FROM archived_files WHERE archive_path = ?', (archive_path,))
+        conn.commit()
+        conn.close()
+    
+    def ingest_stamp(self, chain_code=None, conn=None):
+        """When a branch of the chain (or any chain) last had a file applied; search cache validity"""
+        if chain_code:
+            query, params = 'SELECT MAX(updated_at) FROM branch_ingest_state WHERE chain_code = ?', (chain_code,)
+        else:
+            query, params = 'SELECT MAX(updated_at) FROM branch_ingest_state', ()
+        if conn is not None:
+            return conn.execute(query, params).fetchone()[0]
+        conn = self.connect()
+        stamp = conn.execute(query, params).fetchone()[0]
+        conn.close()
+        return stamp
     
     def search_products(self, search_term, chain_code=None):
-        """Search for products by name or code"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Search the product catalogue by name or barcode; price stats per chain (cached, see search_cache.py)"""
+        conn = self.connect()
+        # Read before the query: an ingest committing meanwhile leaves the entry already stale
+        stamp = self.ingest_stamp(chain_code, conn)
+        results = self.search_cache.get(chain_code, search_term, stamp)
         
-        query = '''
-            SELECT DISTINCT p.item_code, p.item_name, p.chain_code, 
-                   COUNT(DISTINCT p.branch_code) as branch_count,
-                   MIN(p.item_price) as min_price,
-                   MAX(p.item_price) as max_price
-            FROM products p
-            WHERE (p.item_name LIKE ? OR p.item_code LIKE ?)
-        '''
-        params = [f'%{search_term}%', f'%{search_term}%']
+        if results is None:
+            # The LIKE runs over one catalogue row per product instead of one row per branch
+            query = '''
+                SELECT c.product_id, MIN(p.item_code), c.item_name, p.chain_code,
+                       COUNT(DISTINCT p.branch_code) as branch_count,
+                       MIN(p.item_price) as min_price,
+                       MAX(p.item_price) as max_price,
+                       c.normalized_name, c.barcode
+                FROM product_catalogue c
+                JOIN products p ON p.product_id = c.product_id
+                WHERE ({name_likes} OR c.barcode LIKE ?)
+            '''
+            name_terms, code_term = search_key(search_term)
+            query = query.format(name_likes=' OR '.join(['c.normalized_name LIKE ?'] * len(name_terms)))
+            params = [f'%{term}%' for term in name_terms] + [f'%{code_term}%']
+            
+            if chain_code:
+                query += ' AND p.chain_code = ?'
+                params.append(chain_code)
+            
+            query += ' GROUP BY c.product_id, p.chain_code ORDER BY c.item_name'
+            
+            results = conn.execute(query, params).fetchall()
+            self.search_cache.put(chain_code, search_term, stamp, results)
+        conn.close()
+        
+        return [{'product_id': r[0], 'item_code': r[1], 'item_name': r[2], 'chain_code': r[3],
+                'branch_count': r[4], 'min_price': r[5], 'max_price': r[6]} for r in results]
+    
+    def match_products(self, text, limit=10, chain_code=None, min_coverage=0.5):
+        """
+        Catalogue entries closest to free text (a shopping-list line), best first:
+        ranked by the share of the text's trigrams found in the name, then by
+        trigram similarity. Each carries the item code and price range per chain.
+        """
+        query_grams = sorted(trigrams(normalize_name(text)))
+        if not query_grams:
+            return []
+        conn = self.connect()
         
+        query = f'''
+            SELECT c.product_id, c.barcode, c.item_name, COUNT(*) AS shared, c.trigram_count
+            FROM catalogue_trigrams t
+            JOIN product_catalogue c ON c.product_id = t.product_id
+            WHERE t.trigram IN ({', '.join('?' * len(query_grams))})
+        '''
+        params = list(query_grams)
         if chain_code:
-            query += ' AND p.chain_code = ?'
+            query += ' AND EXISTS (SELECT 1 FROM products p WHERE p.product_id = t.product_id AND p.chain_code = ?)'
             params.append(chain_code)
+        query += '''
+            GROUP BY t.product_id
+            HAVING COUNT(*) >= ?
+            ORDER BY shared DESC, shared * 1.0 / (c.trigram_count + ? - shared) DESC, c.product_id
+            LIMIT ?
+        '''
+        params += [max(1, round(min_coverage * len(query_grams))), len(query_grams), limit]
+        matches = conn.execute(query, params).fetchall()
         
-        query += ' GROUP BY p.item_code, p.item_name, p.chain_code ORDER BY p.item_name'
+        chains = {}
+        if matches:
+            query = f'''
+                SELECT product_id, chain_code, MIN(item_code), MIN(item_price), MAX(item_price)
+                FROM products WHERE product_id IN ({', '.join('?' * len(matches))})
+            '''
+            params = [match[0] for match in matches]
+            if chain_code:
+                query += ' AND chain_code = ?'
+                params.append(chain_code)
+            query += ' GROUP BY product_id, chain_code'
+            for product_id, chain, item_code, min_price, max_price in conn.execute(query, params):
+                chains.setdefault(product_id, []).append({'chain_code': chain, 'item_code': item_code,
+                                                          'min_price': min_price, 'max_price': max_price})
+        conn.close()
         
-        cursor.execute(query, params)
+        return [{'product_id': product_id, 'barcode': barcode, 'item_name': item_name,
+                 'coverage': round(shared / len(query_grams), 3),
+                 'similarity': round(shared / (trigram_count + len(query_grams) - shared), 3),
+                 'chains': chains.get(product_id, [])}
+                for product_id, barcode, item_name, shared, trigram_count in matches]
+    
+    def get_catalogue_product(self, item_code, chain_code=None):
+        """Catalogue entry for a barcode (or a chain's internal item code), or None"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT product_id, barcode, item_name, normalized_name, manufacturer_name,
+                   unit_of_measure, unit_qty, quantity, is_weighted, first_seen, last_seen
+            FROM product_catalogue WHERE barcode = ?
+        ''', (canonical_barcode(chain_code, item_code),))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        return {'product_id': row[0], 'barcode': row[1], 'item_name': row[2], 'normalized_name': row[3],
+                'manufacturer_name': row[4], 'unit_of_measure': row[5], 'unit_qty': row[6],
+                'quantity': row[7], 'is_weighted': row[8], 'first_seen': row[9], 'last_seen': row[10]}
+    
+    def compare_product_across_chains(self, product_id):
+        """Price range of one catalogue product in every chain that sells it"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT chain_code, COUNT(*), MIN(item_price), MAX(item_price), AVG(item_price)
+            FROM products
+            WHERE product_id = ?
+            GROUP BY chain_code
+            ORDER BY MIN(item_price)
+        ''', (product_id,))
         results = cursor.fetchall()
         conn.close()
         
-        return [{'item_code': r[0], 'item_name': r[1], 'chain_code': r[2], 
-                'branch_count': r[3], 'min_price': r[4], 'max_price': r[5]} for r in results]
+        return [{'chain_code': r[0], 'branch_count': r[1], 'min_price': r[2],
+                 'max_price': r[3], 'avg_price': round(r[4], 2)} for r in results]
     
     def get_product_prices(self, item_codes, chain_code):
         """Get prices for specific products across all branches"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         placeholders = ','.join(['?' for _ in item_codes])
@@ -333,9 +676,35 @@ class FoodChainDatabase:
                 'branch_name': r[3], 'price': r[4], 'unit_price': r[5], 
                 'updated': r[6]} for r in results]
     
+    def cheapest_per_unit(self, canonical_unit, limit=20, chain_code=None):
+        """Products with the lowest price per kg / l / unit / m (canonical_unit 'kg', 'l', 'unit', 'm')"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        query = '''
+            SELECT item_code, item_name, chain_code, branch_code, item_price,
+                   canonical_quantity, price_per_canonical_unit, product_id
+            FROM products
+            WHERE canonical_unit = ? AND price_per_canonical_unit > 0
+        '''
+        params = [canonical_unit]
+        if chain_code:
+            query += ' AND chain_code = ?'
+            params.append(chain_code)
+        query += ' ORDER BY price_per_canonical_unit LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [{'item_code': r[0], 'item_name': r[1], 'chain_code': r[2], 'branch_code': r[3],
+                 'item_price': r[4], 'canonical_quantity': r[5], 'canonical_unit': canonical_unit,
+                 'price_per_unit': r[6], 'product_id': r[7]} for r in results]
+    
     def get_database_status(self):
         """Get comprehensive database status"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         # Get chain info
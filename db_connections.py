@@ -0,0 +1,112 @@
+"""
+SQLite Connections
+Opens connections for the two database classes. The ingest writer gets a fresh
+read-write connection per call (the original behaviour). Serving workers open
+the files read-only (mode=ro, optionally immutable) with memory-mapped I/O and
+reuse one connection per thread, so read endpoints never take a write lock.
+Given a ReplicaPointer (read_replica.py), they read the newest published copy
+of the file instead and move to the next one as soon as it is published.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+# Bytes of each database file memory-mapped by read-only connections
+READ_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# immutable=1 skips all locking and change detection; only safe when nothing
+# writes the file while workers run (e.g. serving a frozen copy)
+IMMUTABLE_READS = os.environ.get("SQLITE_IMMUTABLE") == "1"
+
+
+class SharedConnection(sqlite3.Connection):
+    """Read-only connection reused by every query on a thread; close() keeps it open"""
+
+    def close(self):
+        pass
+
+    def close_for_real(self):
+        super().close()
+
+
+def read_only_uri(db_path, immutable=False):
+    uri = "file:" + urllib.parse.quote(os.path.abspath(db_path)) + "?mode=ro"
+    return uri + "&immutable=1" if immutable else uri
+
+
+class ConnectionProvider:
+    """Hands out connections for one database file in read-write or read-only mode"""
+
+    # tracer(db_path, sql) sees every statement run on connections opened while
+    # it is set (verify_query_plans.py); None in normal operation
+    tracer = None
+
+    def __init__(self, db_path, read_only=False, immutable=IMMUTABLE_READS, mmap_size=READ_MMAP_SIZE,
+                 replicas=None):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.replicas = replicas
+        self._local = threading.local()
+
+    def connect(self):
+        if not self.read_only:
+            return self._traced(sqlite3.connect(self.db_path))
+
+        # Published replicas are never written again, so they are always opened immutable
+        replica_path = self.replicas.current() if self.replicas else None
+        read_path, immutable = (replica_path, True) if replica_path else (self.db_path, self.immutable)
+
+        conn = getattr(self._local, 'conn', None)
+        # A connection must never cross a fork (preforking servers)
+        if conn is None or self._local.pid != os.getpid() or self._local.path != read_path:
+            if conn is not None and self._local.pid == os.getpid():
+                conn.close_for_real()
+            conn = sqlite3.connect(read_only_uri(read_path, immutable), uri=True,
+                                   factory=SharedConnection, check_same_thread=False)
+            conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+            conn.execute('PRAGMA query_only = ON')
+            self._traced(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.path = read_path
+        return conn
+
+    @contextlib.contextmanager
+    def writing(self, cursor=None, immediate=False):
+        """
+        Cursor for a batch of writes. A caller's cursor (an open transaction,
+        see branch_writer.py) is used as is and the caller commits; otherwise a
+        new connection is committed on success, rolled back on error and closed.
+        """
+        if cursor is not None:
+            yield cursor
+            return
+        conn = self.connect()
+        try:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _traced(self, conn):
+        tracer = ConnectionProvider.tracer
+        if tracer is not None:
+            db_path = self.db_path
+            conn.set_trace_callback(lambda sql: tracer(db_path, sql))
+        return conn
+
+    def enable_wal(self):
+        """Switch the file to WAL so read-only workers and the writer do not block each other"""
+        conn = sqlite3.connect(self.db_path)
+        mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+        conn.close()
+        return mode
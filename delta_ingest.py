@@ -0,0 +1,72 @@
+"""
+Delta Ingest
+Besides the PriceFull/PromoFull snapshot of every branch, chains publish
+incremental Price/Promo files several times a day holding only the items and
+promotions that changed since. A branch stays current by applying those files,
+in order, on top of its last Full snapshot as targeted upserts.
+
+branch_ingest_state (food_chains.db) remembers, per branch and file kind, the
+Full file loaded and the timestamp of the last file applied; published_files
+holds the file listing from the chain's site. plan_refresh() compares the two:
+
+    current  nothing newer than what was applied
+    delta    apply these incremental files in order
+    full     reload the branch from its Full file - no baseline yet, a newer
+             Full was published, or the listing no longer reaches back to the
+             last applied file (deltas may have been missed)
+    missing  no baseline yet and no Full file is published for the branch
+"""
+
+import re
+from collections import namedtuple
+
+# PriceFull7290058108879-001-202508011024.gz, Price7290058108879-001-202508011024.gz
+FILE_NAME = re.compile(r'^(PriceFull|PromoFull|Price|Promo)(\d+)-(\d+)-(\d{12})\b')
+
+FILE_KINDS = {
+    'PriceFull': ('price', True),
+    'Price': ('price', False),
+    'PromoFull': ('promo', True),
+    'Promo': ('promo', False),
+}
+
+PublishedFile = namedtuple('PublishedFile', 'file_name file_kind is_full chain_id store_id file_date')
+RefreshPlan = namedtuple('RefreshPlan', 'mode files reason')
+
+
+def parse_file_name(file_name):
+    """PublishedFile for a Price/PriceFull/Promo/PromoFull file name, else None"""
+    match = FILE_NAME.match(file_name or '')
+    if not match:
+        return None
+    file_kind, is_full = FILE_KINDS[match.group(1)]
+    return PublishedFile(file_name, file_kind, is_full, match.group(2), match.group(3), match.group(4))
+
+
+def plan_refresh(state, published):
+    """
+    Decide how to bring one branch's price or promo data up to date.
+
+    state is the branch_ingest_state row as a dict (or None before the first
+    Full load); published is the list of PublishedFiles of that kind currently
+    listed for the branch.
+    """
+    fulls = sorted((f for f in published if f.is_full), key=lambda f: f.file_date)
+    deltas = sorted((f for f in published if not f.is_full), key=lambda f: f.file_date)
+    applied_through = (state or {}).get('applied_through') or ''
+
+    if not applied_through:
+        if not fulls:
+            return RefreshPlan('missing', [], 'no Full file published')
+        return RefreshPlan('full', [fulls[-1]], 'no Full snapshot loaded yet')
+    if fulls and fulls[-1].file_date > applied_through:
+        return RefreshPlan('full', [fulls[-1]], f"newer Full file {fulls[-1].file_name}")
+
+    pending = [f for f in deltas if f.file_date > applied_through]
+    if not pending:
+        return RefreshPlan('current', [], f"up to date through {applied_through}")
+
+    # Deltas only chain onto the last applied file if the listing still covers it
+    if not any(f.file_date <= applied_through for f in published):
+        return RefreshPlan('full', fulls[-1:], f"gap: listing starts after {applied_through}")
+    return RefreshPlan('delta', pending, f"{len(pending)} delta files after {applied_through}")
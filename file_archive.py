@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Raw File Archive
+Keeps every downloaded Price/PriceFull/Promo/PromoFull file once, as its XML
+recompressed with xz (about a fifth smaller than the chains' gzip/zip, and a
+fraction of the plain .xml copies left in downloads/), in a
+chain/branch/date layout. archived_files in food_chains.db indexes the copies,
+so a branch can be re-ingested as of any archived point in time without
+fetching anything (replay_files()), and downloads/ can be emptied.
+
+Layout: archive/<chain id>/<store id>/<YYYY-MM-DD>/<file stem>.xml.xz
+
+Content seen before (the same file as .gz and .xml, or a re-published copy)
+is stored once; its rows share one blob. When the archive grows past
+ARCHIVE_MAX_MB the oldest blobs are deleted, except each branch's newest Full
+files, which any replay of the present needs.
+
+    python file_archive.py archive downloads [--remove]   # archive existing files
+    python file_archive.py replay <branch> <YYYYMMDDHHMM>  # files a replay would use
+
+Settings: ARCHIVE_DIR, ARCHIVE_MAX_MB.
+"""
+
+import argparse
+import datetime
+import hashlib
+import lzma
+import os
+import re
+import sys
+
+from delta_ingest import FILE_KINDS, parse_file_name
+from xml_stream import open_xml_stream
+
+ARCHIVE_ROOT = os.environ.get("ARCHIVE_DIR", "archive")
+ARCHIVE_MAX_BYTES = int(float(os.environ.get("ARCHIVE_MAX_MB", 2048)) * 1024 * 1024)
+ARCHIVE_SUFFIX = '.xml.xz'
+# Preset 6 and 9 compress a PriceFull file alike; 9 | PRESET_EXTREME saves another ~15% at 4x the time
+XZ_PRESET = 6
+
+DOWNLOAD_SUFFIXES = re.compile(r'(\.(gz|zip|xml|xz))+$', re.IGNORECASE)
+
+
+def file_stem(file_name):
+    """File name without its download extensions: PriceFull7290058108879-001-202508011024"""
+    return DOWNLOAD_SUFFIXES.sub('', os.path.basename(file_name))
+
+
+def blob_path(published, archive_root=ARCHIVE_ROOT):
+    """Where a file is archived: <chain id>/<store id>/<YYYY-MM-DD>/<stem>.xml.xz"""
+    day = f"{published.file_date[:4]}-{published.file_date[4:6]}-{published.file_date[6:8]}"
+    return os.path.join(archive_root, published.chain_id, published.store_id, day,
+                        file_stem(published.file_name) + ARCHIVE_SUFFIX)
+
+
+def compress_to(source_path, target_path):
+    """Stream a downloaded file's XML into an .xz file; returns (sha256 of the XML, XML bytes)"""
+    digest = hashlib.sha256()
+    raw_size = 0
+    with open_xml_stream(source_path) as stream, lzma.open(target_path, 'wb', preset=XZ_PRESET) as out:
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            raw_size += len(chunk)
+    return digest.hexdigest(), raw_size
+
+
+def archive_file(db, chain_code, branch_code, source_path, archive_root=ARCHIVE_ROOT, max_bytes=ARCHIVE_MAX_BYTES):
+    """
+    Archive one downloaded file (unless it already is) and return the path of
+    its archived copy; None for names that are not Price/Promo files.
+    """
+    published = parse_file_name(os.path.basename(source_path))
+    if not published:
+        return None
+    stem = file_stem(published.file_name)
+    existing = db.get_archived_file(stem)
+    if existing and os.path.exists(existing):
+        return existing
+
+    final_path = blob_path(published, archive_root)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    work_path = final_path + '.tmp'
+    sha256, raw_size = compress_to(source_path, work_path)
+
+    same_content = db.find_archived_blob(sha256)
+    if same_content and os.path.exists(same_content):
+        os.remove(work_path)
+        final_path = same_content
+    else:
+        os.replace(work_path, final_path)
+
+    db.record_archived_file({
+        'file_stem': stem,
+        'file_name': published.file_name,
+        'chain_code': chain_code,
+        'branch_code': branch_code,
+        'file_kind': published.file_kind,
+        'is_full': int(published.is_full),
+        'file_date': published.file_date,
+        'sha256': sha256,
+        'archive_path': final_path,
+        'raw_size': raw_size,
+        'stored_size': os.path.getsize(final_path),
+        'archived_at': datetime.datetime.now().isoformat(),
+    })
+    print(f"🗄️ Archived {published.file_name}: {raw_size:,} → {os.path.getsize(final_path):,} bytes")
+    enforce_budget(db, max_bytes)
+    return final_path
+
+
+def archived_file(db, file_name):
+    """Path of the archived copy of a file, or None"""
+    path = db.get_archived_file(file_stem(file_name)) if file_name else None
+    return path if path and os.path.exists(path) else None
+
+
+def enforce_budget(db, max_bytes=ARCHIVE_MAX_BYTES):
+    """Delete the oldest blobs until the archive fits max_bytes, keeping each branch's newest Full files"""
+    blobs = {}
+    newest_full = {}
+    for archive_path, stored_size, chain_code, branch_code, file_kind, is_full, file_date in db.list_archived_files():
+        blobs.setdefault(archive_path, stored_size or 0)
+        if is_full:
+            newest_full[(chain_code, branch_code, file_kind)] = archive_path
+    total = sum(blobs.values())
+    if total <= max_bytes:
+        return 0
+
+    protected = set(newest_full.values())
+    removed = 0
+    # Rows came oldest first, so dict order is the order blobs were first dated
+    for archive_path, stored_size in blobs.items():
+        if total <= max_bytes:
+            break
+        if archive_path in protected:
+            continue
+        try:
+            os.remove(archive_path)
+        except FileNotFoundError:
+            pass
+        db.remove_archived_blob(archive_path)
+        total -= stored_size
+        removed += 1
+    print(f"🧹 Archive over budget: removed {removed} oldest files, {total:,} bytes kept")
+    return removed
+
+
+def replay_files(db, chain_code, branch_code, as_of):
+    """
+    {file_kind: [file names]} that rebuild a branch as of as_of (YYYYMMDDHHMM):
+    the last archived Full file of each kind, then the delta files after it.
+    """
+    plan = {}
+    for file_kind in sorted({kind for kind, _ in FILE_KINDS.values()}):
+        files = db.get_archived_files_through(chain_code, branch_code, file_kind, as_of)
+        fulls = [(file_date, file_name) for file_name, is_full, file_date in files if is_full]
+        if not fulls:
+            continue
+        full_date, full_name = fulls[-1]
+        # As in delta_ingest.plan_refresh, a delta stamped with the Full's time is already in it
+        plan[file_kind] = [full_name] + [file_name for file_name, is_full, file_date in files
+                                         if not is_full and file_date > full_date]
+    return plan
+
+
+def archive_directory(db, chain_code, download_dir, remove=False):
+    """Archive every Price/Promo file in a directory (branch code taken from the store id)"""
+    archived = 0
+    for name in sorted(os.listdir(download_dir)):
+        published = parse_file_name(name)
+        if not published:
+            continue
+        source_path = os.path.join(download_dir, name)
+        if archive_file(db, chain_code, str(int(published.store_id)), source_path):
+            archived += 1
+            if remove:
+                os.remove(source_path)
+    return archived
+
+
+def main():
+    from database_setup import FoodChainDatabase
+
+    parser = argparse.ArgumentParser(description="Compressed archive of raw Price/Promo files")
+    parser.add_argument("--chain", default="CHAIN_001", help="chain code the files belong to")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive = commands.add_parser("archive", help="archive the files of a download directory")
+    archive.add_argument("download_dir", nargs="?", default="downloads")
+    archive.add_argument("--remove", action="store_true", help="delete each file once archived")
+    replay = commands.add_parser("replay", help="list the archived files a replay would ingest")
+    replay.add_argument("branch_code")
+    replay.add_argument("as_of", help="YYYYMMDDHHMM")
+    args = parser.parse_args()
+
+    db = FoodChainDatabase()
+    if args.command == "archive":
+        archived = archive_directory(db, args.chain, args.download_dir, args.remove)
+        print(f"✅ {archived} files archived under {os.path.abspath(ARCHIVE_ROOT)}")
+    else:
+        for file_kind, file_names in replay_files(db, args.chain, args.branch_code, args.as_of).items():
+            for file_name in file_names:
+                print(f"{file_kind}\t{file_name}\t{archived_file(db, file_name)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Generator
+Produces PriceFull/PromoFull files and populated databases at configurable scale
+for load testing and benchmarks without touching the network.
+"""
+
+import argparse
+import datetime
+import gzip
+import io
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from database_setup import FoodChainDatabase
+from database_hierarchical import HierarchicalFoodDatabase
+from records import (
+    ProductRecord, PromotionRecord, PromotionItemRecord, normalize_product, normalize_promotion
+)
+
+PRODUCT_WORDS = [
+    "חלב", "גבינה", "יוגורט", "לחם", "פיתה", "אורז", "פסטה", "שמן זית", "סוכר", "קמח",
+    "קפה", "תה", "שוקולד", "במבה", "ביסלי", "עגבניה", "מלפפון", "תפוח", "בננה", "אבטיח",
+    "עוף", "שניצל", "טונה", "חומוס", "טחינה", "קוטג'", "שמנת", "חמאה", "ביצים", "מיץ",
+]
+PRODUCT_VARIANTS = ["", "לייט", "מלא", "3%", "1%", "אורגני", "טבעי", "קלאסי", "מהדרין", "משפחתי"]
+MANUFACTURERS = ["תנובה", "שטראוס", "אסם", "עלית", "טרה", "יטבתה", "סוגת", "וילי פוד", "לא ידוע"]
+COUNTRIES = ["IL", "IL", "IL", "PL", "IE", "DE", "IT", "TR", "US"]
+UNITS = [
+    ("גרם", "100 גרם", [100, 200, 250, 500, 750, 1000]),
+    ("מיליליטרים", "100 מ\"ל", [200, 330, 500, 1000, 1500, 2000]),
+    ("יחידה", "יחידה", [1, 2, 6, 12]),
+    ("קילוגרם", "ק\"ג", [1]),
+]
+CITIES = ["תל אביב", "ירושלים", "חיפה", "באר שבע", "נתניה", "אשדוד", "נצרת", "אום אלפחם", "טבריה", "אילת"]
+
+PRODUCT_FIELDS = [
+    "PriceUpdateDate", "ItemCode", "ItemType", "ItemNm", "ManufacturerName", "ManufactureCountry",
+    "ManufacturerItemDescription", "UnitQty", "Quantity", "UnitOfMeasure", "bIsWeighted",
+    "QtyInPackage", "ItemPrice", "UnitOfMeasurePrice", "AllowDiscount", "ItemStatus",
+]
+
+
+def log_message(message):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+class SyntheticDataGenerator:
+    def __init__(self, output_dir="synthetic", chains=40, branches_per_chain=50,
+                 catalogue_size=30000, items_per_branch=20000, promotions_per_branch=600,
+                 file_format="zip", seed=42):
+        self.output_dir = output_dir
+        self.downloads_dir = os.path.join(output_dir, "downloads")
+        self.data_dir = os.path.join(output_dir, "data")
+        self.chains = chains
+        self.branches_per_chain = branches_per_chain
+        self.catalogue_size = catalogue_size
+        self.items_per_branch = min(items_per_branch, catalogue_size)
+        self.promotions_per_branch = promotions_per_branch
+        self.file_format = file_format
+        self.rng = random.Random(seed)
+        self.file_time = datetime.datetime(2025, 8, 1, 10, 24)
+        self.catalogue = self.build_catalogue()
+
+    def build_catalogue(self):
+        """Build a shared barcode catalogue so the same item appears across chains"""
+        rng = self.rng
+        catalogue = []
+        used_codes = set()
+        while len(catalogue) < self.catalogue_size:
+            item_code = f"729{rng.randrange(10**9, 10**10)}"
+            if item_code in used_codes:
+                continue
+            used_codes.add(item_code)
+
+            unit_qty, unit_of_measure, quantities = rng.choice(UNITS)
+            name = f"{rng.choice(PRODUCT_WORDS)} {rng.choice(PRODUCT_VARIANTS)}".strip()
+            quantity = rng.choice(quantities)
+            catalogue.append({
+                "item_code": item_code,
+                "item_name": f"{name} {quantity}",
+                "manufacturer_name": rng.choice(MANUFACTURERS),
+                "manufacture_country": rng.choice(COUNTRIES),
+                "unit_qty": unit_qty,
+                "unit_of_measure": unit_of_measure,
+                "quantity": str(quantity),
+                "is_weighted": "1" if unit_qty == "קילוגרם" else "0",
+                "qty_in_package": str(rng.choice([0, 1, 6, 12])),
+                "base_price": round(rng.uniform(1.9, 120.0), 1),
+            })
+        return catalogue
+
+    # ========================================
+    # XML BUILDERS
+    # ========================================
+
+    def chain_id(self, chain_index):
+        return f"72900{chain_index:08d}"
+
+    def file_name(self, prefix, chain_index, branch_code, minutes_offset=0):
+        stamp = (self.file_time + datetime.timedelta(minutes=minutes_offset)).strftime("%Y%m%d%H%M")
+        extension = "xml" if self.file_format == "xml" else "gz"
+        return f"{prefix}{self.chain_id(chain_index)}-{int(branch_code):03d}-{stamp}.{extension}"
+
+    def branch_products(self, chain_index, branch_code):
+        """Pick this branch's slice of the catalogue with a per-branch price jitter"""
+        rng = random.Random(f"{chain_index}-{branch_code}")
+        chain_factor = 0.9 + (chain_index % 7) * 0.03
+        products = []
+        update_date = self.file_time.strftime("%Y-%m-%d %H:%M:%S")
+        for entry in rng.sample(self.catalogue, self.items_per_branch):
+            price = round(entry["base_price"] * chain_factor * rng.uniform(0.92, 1.12), 2)
+            quantity = float(entry["quantity"])
+            if entry["unit_qty"] in ("גרם", "מיליליטרים") and quantity:
+                unit_price = round(price * 100 / quantity, 4)
+            else:
+                unit_price = price
+            products.append(ProductRecord(
+                chain_id=self.chain_id(chain_index),
+                store_id=branch_code,
+                item_code=entry["item_code"],
+                item_name=entry["item_name"],
+                manufacturer_name=entry["manufacturer_name"],
+                manufacturer_item_description=entry["item_name"],
+                unit_qty=entry["unit_qty"],
+                quantity=entry["quantity"],
+                unit_of_measure=entry["unit_of_measure"],
+                is_weighted=entry["is_weighted"],
+                qty_in_package=entry["qty_in_package"],
+                item_price=str(price),
+                unit_of_measure_price=str(unit_price),
+                allow_discount="1",
+                item_status="1",
+                manufacture_country=entry["manufacture_country"],
+                price_update_date=update_date,
+            ))
+        return products
+
+    def branch_promotions(self, chain_index, branch_code, products):
+        """Build promotions that reference items actually sold in the branch"""
+        rng = random.Random(f"promo-{chain_index}-{branch_code}")
+        start = self.file_time.date()
+        promotions = []
+        for i in range(min(self.promotions_per_branch, len(products))):
+            items = rng.sample(products, min(len(products), rng.choice([1, 1, 2, 3, 8])))
+            min_qty = rng.choice([1, 2, 3])
+            discounted = round(float(items[0].item_price) * min_qty * rng.uniform(0.6, 0.9), 2)
+            promotions.append(PromotionRecord(
+                chain_id=self.chain_id(chain_index),
+                store_id=branch_code,
+                promotion_id=str(500000000 + chain_index * 100000 + int(branch_code) * 1000 + i),
+                promotion_description=f"{items[0].item_name} {min_qty} ב {discounted}",
+                promotion_update_date=self.file_time.strftime("%Y-%m-%d %H:%M:%S"),
+                promotion_start_date=start.isoformat(),
+                promotion_start_hour="00:00:00",
+                promotion_end_date=(start + datetime.timedelta(days=rng.choice([2, 7, 14]))).isoformat(),
+                promotion_end_hour="23:59:00",
+                discounted_price=str(discounted),
+                discounted_price_per_unit=str(round(discounted / min_qty, 2)),
+                discount_rate="0.00",
+                min_quantity=str(min_qty),
+                max_quantity="0",
+                min_purchase_amount="0",
+                allow_multiple_discounts="0",
+                reward_type="1",
+                discount_type="1",
+                remarks="",
+                items=tuple(PromotionItemRecord(item.item_code, "0", "1") for item in items),
+            ))
+        return promotions
+
+    def price_xml(self, chain_index, branch_code, products):
+        """Render a PriceFull document in the KingStore layout"""
+        out = io.StringIO()
+        out.write("<Root>\r\n")
+        out.write(f"  <ChainId>{self.chain_id(chain_index)}</ChainId>\r\n")
+        out.write("  <SubChainId>1</SubChainId>\r\n")
+        out.write(f"  <StoreId>{branch_code}</StoreId>\r\n")
+        out.write("  <BikoretNo>6</BikoretNo>\r\n")
+        out.write("  <Items>\r\n")
+        for product in products:
+            values = {
+                "PriceUpdateDate": product.price_update_date,
+                "ItemCode": product.item_code,
+                "ItemType": "1",
+                "ItemNm": product.item_name,
+                "ManufacturerName": product.manufacturer_name,
+                "ManufactureCountry": product.manufacture_country,
+                "ManufacturerItemDescription": product.manufacturer_item_description,
+                "UnitQty": product.unit_qty,
+                "Quantity": product.quantity,
+                "UnitOfMeasure": product.unit_of_measure,
+                "bIsWeighted": product.is_weighted,
+                "QtyInPackage": product.qty_in_package,
+                "ItemPrice": product.item_price,
+                "UnitOfMeasurePrice": product.unit_of_measure_price,
+                "AllowDiscount": product.allow_discount,
+                "ItemStatus": product.item_status,
+            }
+            out.write("    <Item>\r\n")
+            for field in PRODUCT_FIELDS:
+                out.write(f"      <{field}>{escape(values[field])}</{field}>\r\n")
+            out.write("    </Item>\r\n")
+        out.write("  </Items>\r\n</Root>")
+        return out.getvalue()
+
+    def promo_xml(self, chain_index, branch_code, promotions):
+        """Render a PromoFull document in the KingStore layout"""
+        out = io.StringIO()
+        out.write("<Root>\r\n")
+        out.write(f"  <ChainId>{self.chain_id(chain_index)}</ChainId>\r\n")
+        out.write("  <SubChainId>1</SubChainId>\r\n")
+        out.write(f"  <StoreId>{branch_code}</StoreId>\r\n")
+        out.write("  <BikoretNo>6</BikoretNo>\r\n")
+        out.write(f"  <Promotions count=\"{len(promotions)}\">\r\n")
+        for promo in promotions:
+            fields = [
+                ("PromotionId", promo.promotion_id),
+                ("PromotionDescription", promo.promotion_description),
+                ("PromotionUpdateDate", promo.promotion_update_date),
+                ("PromotionStartDate", promo.promotion_start_date),
+                ("PromotionStartHour", promo.promotion_start_hour),
+                ("PromotionEndDate", promo.promotion_end_date),
+                ("PromotionEndHour", promo.promotion_end_hour),
+                ("RewardType", promo.reward_type),
+                ("DiscountType", promo.discount_type),
+                ("DiscountRate", promo.discount_rate),
+                ("AllowMultipleDiscounts", promo.allow_multiple_discounts),
+                ("MinQty", promo.min_quantity),
+                ("MaxQty", promo.max_quantity),
+                ("DiscountedPrice", promo.discounted_price),
+                ("DiscountedPricePerMida", promo.discounted_price_per_unit),
+            ]
+            out.write("    <Promotion>\r\n")
+            for tag, value in fields:
+                out.write(f"      <{tag}>{escape(value)}</{tag}>\r\n")
+            out.write(f"      <PromotionItems count=\"{len(promo.items)}\">\r\n")
+            for item in promo.items:
+                out.write("        <Item>\r\n")
+                out.write(f"          <ItemCode>{item.item_code}</ItemCode>\r\n")
+                out.write(f"          <IsGiftItem>{item.is_gift_item}</IsGiftItem>\r\n")
+                out.write(f"          <ItemType>{item.item_type}</ItemType>\r\n")
+                out.write("        </Item>\r\n")
+            out.write("      </PromotionItems>\r\n")
+            out.write(f"      <Remarks>{escape(promo.remarks)}</Remarks>\r\n")
+            out.write(f"      <MinPurchaseAmnt>{promo.min_purchase_amount}</MinPurchaseAmnt>\r\n")
+            out.write("    </Promotion>\r\n")
+        out.write("  </Promotions>\r\n</Root>")
+        return out.getvalue()
+
+    def write_file(self, file_name, xml_content):
+        """Write XML as a ZIP (what the chains actually serve), gzip or plain file"""
+        path = os.path.join(self.downloads_dir, file_name)
+        data = xml_content.encode("utf-8")
+        if self.file_format == "zip":
+            member = os.path.splitext(file_name)[0] + ".xml"
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                zip_file.writestr(member, data)
+        elif self.file_format == "gz":
+            with gzip.open(path, "wb") as f:
+                f.write(data)
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+        return path
+
+    # ========================================
+    # DATABASE POPULATION
+    # ========================================
+
+    def generate(self, write_files=True, populate_databases=True):
+        """Generate all chains and branches, writing files and databases"""
+        os.makedirs(self.downloads_dir, exist_ok=True)
+        db = hierarchical_db = None
+        if populate_databases:
+            db = FoodChainDatabase(os.path.join(self.data_dir, "food_chains.db"))
+            hierarchical_db = HierarchicalFoodDatabase(os.path.join(self.data_dir, "hierarchical_food_chains.db"))
+
+        summary = {"chains": 0, "branches": 0, "products": 0, "promotions": 0, "files": 0}
+        city_rng = random.Random(f"cities-{self.chains}")
+
+        for chain_index in range(1, self.chains + 1):
+            chain_code = f"CHAIN_{chain_index:03d}"
+            chain_name = f"רשת סינתטית {chain_index}"
+            chain_url = f"https://synthetic-{chain_index}.example.com/Main.aspx"
+            log_message(f"🏢 Generating chain {chain_code} ({self.branches_per_chain} branches)")
+
+            if populate_databases:
+                db.add_food_chain(chain_code, chain_name, chain_url, self.chain_id(chain_index))
+                hierarchical_db.add_food_chain(chain_code, chain_name, chain_url)
+
+            branches_for_db = {}
+            for branch_index in range(1, self.branches_per_chain + 1):
+                branch_code = str(branch_index)
+                branch_name = f"{city_rng.choice(CITIES)} {branch_index}"
+                products = self.branch_products(chain_index, branch_code)
+                promotions = self.branch_promotions(chain_index, branch_code, products)
+                price_file = self.file_name("PriceFull", chain_index, branch_code)
+                promo_file = self.file_name("PromoFull", chain_index, branch_code, minutes_offset=13)
+
+                if write_files:
+                    self.write_file(price_file, self.price_xml(chain_index, branch_code, products))
+                    self.write_file(promo_file, self.promo_xml(chain_index, branch_code, promotions))
+                    summary["files"] += 2
+
+                branches_for_db[branch_code] = {
+                    "name": branch_name,
+                    "price_file": price_file,
+                    "price_date": price_file.rsplit("-", 1)[1].split(".")[0],
+                    "promo_file": promo_file,
+                    "promo_date": promo_file.rsplit("-", 1)[1].split(".")[0],
+                }
+
+                if populate_databases:
+                    self.store_branch(db, hierarchical_db, chain_code, branch_code, branch_name,
+                                      price_file, promo_file, products, promotions)
+
+                summary["branches"] += 1
+                summary["products"] += len(products)
+                summary["promotions"] += len(promotions)
+
+            if populate_databases:
+                db.insert_branches(chain_code, branches_for_db)
+            summary["chains"] += 1
+
+        log_message(f"🎉 Generated {summary['chains']} chains, {summary['branches']} branches, "
+                    f"{summary['products']:,} products, {summary['promotions']:,} promotions")
+        return summary
+
+    def store_branch(self, db, hierarchical_db, chain_code, branch_code, branch_name,
+                     price_file, promo_file, products, promotions):
+        """Store one branch through the same writers the ingest pipeline uses"""
+        db.insert_products(chain_code, branch_code, [normalize_product(p) for p in products])
+        db.insert_promotions(chain_code, branch_code, [normalize_promotion(p) for p in promotions])
+
+        hierarchical_db.add_branch_to_chain(chain_code, branch_code, branch_name, price_file, promo_file)
+        hierarchical_db.insert_branch_products(chain_code, branch_code, products)
+        hierarchical_db.insert_branch_promotions(chain_code, branch_code, promotions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic chain/branch price data")
+    parser.add_argument("--output-dir", default="synthetic")
+    parser.add_argument("--chains", type=int, default=40)
+    parser.add_argument("--branches", type=int, default=50, help="branches per chain")
+    parser.add_argument("--catalogue", type=int, default=30000, help="distinct barcodes across all chains")
+    parser.add_argument("--items", type=int, default=20000, help="items per branch PriceFull file")
+    parser.add_argument("--promotions", type=int, default=600, help="promotions per branch PromoFull file")
+    parser.add_argument("--format", choices=["zip", "gz", "xml"], default="zip")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-files", action="store_true", help="only populate the databases")
+    parser.add_argument("--no-db", action="store_true", help="only write the XML files")
+    args = parser.parse_args()
+
+    generator = SyntheticDataGenerator(
+        output_dir=args.output_dir,
+        chains=args.chains,
+        branches_per_chain=args.branches,
+        catalogue_size=args.catalogue,
+        items_per_branch=args.items,
+        promotions_per_branch=args.promotions,
+        file_format=args.format,
+        seed=args.seed,
+    )
+    generator.generate(write_files=not args.no_files, populate_databases=not args.no_db)
+    print(f"📁 Output written to: {os.path.abspath(args.output_dir)}")
@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+Schema Migrations
+Versioned, forward-only migrations for both database files. PRAGMA user_version
+holds the last migration applied and schema_migrations records when each one
+ran. Every migration runs in its own transaction together with the version
+bump, so an interrupted upgrade leaves the file at the previous version.
+
+    python migrations.py        # show versions and apply pending migrations
+
+Index choices are checked by verify_query_plans.py; add a migration here when it
+reports a full scan.
+"""
+
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+
+from name_matching import trigram_rows
+from product_catalogue import canonical_barcode, normalize_name
+from unit_normalization import canonical_unit_price
+
+Migration = namedtuple('Migration', 'version description apply')
+
+# ========================================
+# data/food_chains.db
+# ========================================
+
+def food_chains_baseline(cursor):
+    """Tables and indexes as originally created by FoodChainDatabase.init_database()"""
+    # Create metadata table to track food chains
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS food_chains_metadata (
+            chain_code TEXT PRIMARY KEY,
+            actual_chain_code TEXT,
+            chain_name TEXT NOT NULL,
+            chain_url TEXT NOT NULL,
+            last_updated TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create branches table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS branches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            branch_name TEXT NOT NULL,
+
+            price_file_name TEXT,
+            price_file_date TEXT,
+            price_file_status TEXT DEFAULT 'pending',
+
+            promo_file_name TEXT,
+            promo_file_date TEXT,
+            promo_file_status TEXT DEFAULT 'pending',
+
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+            FOREIGN KEY (chain_code) REFERENCES food_chains_metadata(chain_code),
+            UNIQUE(chain_code, branch_code)
+        )
+    ''')
+
+    # Create products table - stores all products with prices per branch
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+
+            -- Product identification
+            item_code TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            manufacturer_name TEXT,
+            manufacturer_item_description TEXT,
+
+            -- Pricing information
+            item_price REAL NOT NULL,
+            unit_of_measure_price REAL,
+            unit_qty TEXT,
+            quantity REAL,
+            unit_of_measure TEXT,
+
+            -- Product attributes
+            is_weighted INTEGER DEFAULT 0,
+            qty_in_package REAL,
+            allow_discount INTEGER DEFAULT 1,
+            item_status INTEGER DEFAULT 1,
+            manufacture_country TEXT,
+
+            -- Metadata
+            price_update_date TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+            FOREIGN KEY (chain_code, branch_code) REFERENCES branches(chain_code, branch_code),
+            UNIQUE(chain_code, branch_code, item_code)
+        )
+    ''')
+
+    # Create promotions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+
+            promotion_id TEXT NOT NULL,
+            promotion_description TEXT NOT NULL,
+
+            -- Date and time ranges
+            promotion_start_date DATE,
+            promotion_start_hour TIME,
+            promotion_end_date DATE,
+            promotion_end_hour TIME,
+
+            -- Discount details
+            reward_type INTEGER,
+            discount_type INTEGER,
+            discount_rate REAL,
+            discounted_price REAL,
+            discounted_price_per_mida REAL,
+
+            -- Quantity rules
+            min_qty INTEGER DEFAULT 1,
+            max_qty INTEGER DEFAULT 0,
+            min_purchase_amount REAL DEFAULT 0,
+
+            -- Metadata
+            promotion_update_date TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+            FOREIGN KEY (chain_code, branch_code) REFERENCES branches(chain_code, branch_code),
+            UNIQUE(chain_code, branch_code, promotion_id)
+        )
+    ''')
+
+    # Create promotion_items table - links promotions to products
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS promotion_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            promotion_id INTEGER NOT NULL,
+            item_code TEXT NOT NULL,
+            is_gift_item INTEGER DEFAULT 0,
+            item_type INTEGER DEFAULT 1,
+
+            FOREIGN KEY (promotion_id) REFERENCES promotions(id),
+            UNIQUE(promotion_id, item_code)
+        )
+    ''')
+
+    # Checkpoints of the chain/branch discovery so an interrupted run can resume
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS discovery_progress (
+            phase TEXT PRIMARY KEY,
+            details TEXT,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create indexes for fast lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item_code ON products(item_code)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item_name ON products(item_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_branch ON products(chain_code, branch_code)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_promotions_dates ON promotions(promotion_start_date, promotion_end_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_promotion_items_code ON promotion_items(item_code)')
+
+
+def food_chains_query_indexes(cursor):
+    """Replace the hand-picked indexes with ones the app's queries actually use"""
+    # item_name is only ever matched with LIKE '%x%', which no B-tree index serves
+    cursor.execute('DROP INDEX IF EXISTS idx_products_item_name')
+    # Same leading columns as the UNIQUE(chain_code, branch_code, item_code) index
+    cursor.execute('DROP INDEX IF EXISTS idx_products_branch')
+    # get_product_prices(): item_code IN (...) AND chain_code = ? ORDER BY item_code, item_price
+    cursor.execute('DROP INDEX IF EXISTS idx_products_item_code')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item_chain ON products(item_code, chain_code, item_price)')
+    # /process-branch looks a branch up by branch_code alone
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_branches_branch_code ON branches(branch_code)')
+
+
+def food_chains_product_catalogue(cursor):
+    """Canonical products keyed by barcode, linked from every products row by product_id"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_catalogue (
+            product_id INTEGER PRIMARY KEY,
+            barcode TEXT UNIQUE NOT NULL,
+            item_name TEXT NOT NULL,
+            normalized_name TEXT NOT NULL,
+            manufacturer_name TEXT,
+            unit_of_measure TEXT,
+            unit_qty TEXT,
+            quantity REAL,
+            is_weighted INTEGER DEFAULT 0,
+            first_seen TIMESTAMP,
+            last_seen TIMESTAMP
+        )
+    ''')
+    cursor.execute('ALTER TABLE products ADD COLUMN product_id INTEGER REFERENCES product_catalogue(product_id)')
+    # Cross-chain comparisons: product_id = ? [AND chain_code = ?], prices read from the index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_product ON products(product_id, chain_code, item_price)')
+
+    # Backfill from the rows already stored; the first name seen for a barcode wins
+    cursor.execute('''
+        SELECT chain_code, item_code, item_name, manufacturer_name, unit_of_measure,
+               unit_qty, quantity, is_weighted, last_updated
+        FROM products ORDER BY id
+    ''')
+    entries = {}
+    links = []
+    for row in cursor.fetchall():
+        chain_code, item_code = row[0], row[1]
+        barcode = canonical_barcode(chain_code, item_code)
+        entries.setdefault(barcode, (barcode, row[2] or '', normalize_name(row[2]), row[3] or '',
+                                     row[4] or '', row[5] or '', row[6], row[7] or 0, row[8], row[8]))
+        links.append((barcode, chain_code, item_code))
+    cursor.executemany('''
+        INSERT OR IGNORE INTO product_catalogue (
+            barcode, item_name, normalized_name, manufacturer_name, unit_of_measure,
+            unit_qty, quantity, is_weighted, first_seen, last_seen
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', list(entries.values()))
+    cursor.executemany('''
+        UPDATE products SET product_id = (SELECT product_id FROM product_catalogue WHERE barcode = ?)
+        WHERE chain_code = ? AND item_code = ?
+    ''', list(dict.fromkeys(links)))
+
+
+def food_chains_unit_prices(cursor):
+    """Price per kg / liter / unit / meter, computed at ingest and indexed per canonical unit"""
+    cursor.execute('ALTER TABLE products ADD COLUMN canonical_unit TEXT')
+    cursor.execute('ALTER TABLE products ADD COLUMN canonical_quantity REAL')
+    cursor.execute('ALTER TABLE products ADD COLUMN price_per_canonical_unit REAL')
+    # "Cheapest per liter": canonical_unit = ? ORDER BY price_per_canonical_unit LIMIT n
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_products_unit_price
+        ON products(canonical_unit, price_per_canonical_unit)
+    ''')
+
+    cursor.execute('''
+        SELECT id, item_price, quantity, unit_qty, unit_of_measure, unit_of_measure_price, item_name
+        FROM products
+    ''')
+    cursor.executemany('''
+        UPDATE products SET canonical_unit = ?, canonical_quantity = ?, price_per_canonical_unit = ?
+        WHERE id = ?
+    ''', [canonical_unit_price(*row[1:]) + (row[0],) for row in cursor.fetchall()])
+
+
+def food_chains_delta_ingest(cursor):
+    """File listing and per-branch ingest position for applying Price/Promo delta files"""
+    # What the chain's site currently lists per branch; replaced on every listing
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS published_files (
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            file_kind TEXT NOT NULL,
+            file_date TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            is_full INTEGER NOT NULL,
+            listed_at TIMESTAMP,
+
+            PRIMARY KEY (chain_code, branch_code, file_kind, file_date, file_name)
+        )
+    ''')
+    # Last Full file loaded and last file applied on top of it (YYYYMMDDHHMM from the name)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS branch_ingest_state (
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            file_kind TEXT NOT NULL,
+            full_file_name TEXT,
+            full_file_date TEXT,
+            applied_file_name TEXT,
+            applied_through TEXT,
+            deltas_applied INTEGER DEFAULT 0,
+            updated_at TIMESTAMP,
+
+            PRIMARY KEY (chain_code, branch_code, file_kind)
+        )
+    ''')
+
+
+def food_chains_refresh_scheduler(cursor):
+    """Per-chain listing cadence and the queue of branches waiting for an ingest"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refresh_schedule (
+            chain_code TEXT PRIMARY KEY,
+            interval_minutes INTEGER NOT NULL DEFAULT 60,
+            enabled INTEGER DEFAULT 1,
+            next_run_at TIMESTAMP NOT NULL,
+            last_run_at TIMESTAMP,
+            last_success_at TIMESTAMP,
+            consecutive_failures INTEGER DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refresh_queue (
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            enqueued_at TIMESTAMP,
+            next_attempt_at TIMESTAMP NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+
+            PRIMARY KEY (chain_code, branch_code)
+        )
+    ''')
+    # The scheduler polls both: enabled = 1 AND next_run_at <= ?, and
+    # next_attempt_at <= ? ORDER BY next_attempt_at LIMIT n
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refresh_schedule_due ON refresh_schedule(enabled, next_run_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refresh_queue_due ON refresh_queue(next_attempt_at)')
+
+
+def food_chains_file_archive(cursor):
+    """Index of the raw Price/Promo files kept in the compressed archive (file_archive.py)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_files (
+            file_stem TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            file_kind TEXT NOT NULL,
+            is_full INTEGER NOT NULL,
+            file_date TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            archive_path TEXT NOT NULL,
+            raw_size INTEGER,
+            stored_size INTEGER,
+            archived_at TIMESTAMP
+        )
+    ''')
+    # Replay: the files of one branch and kind up to a point in time
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archived_files_branch
+        ON archived_files(chain_code, branch_code, file_kind, file_date)
+    ''')
+    # Identical content is stored once; budget cleanup drops every row of a blob
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_archived_files_sha256 ON archived_files(sha256)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_archived_files_path ON archived_files(archive_path)')
+
+
+def food_chains_name_matching(cursor):
+    """Catalogue names in the new normalized form, and a trigram index over them for fuzzy matching"""
+    cursor.execute('ALTER TABLE product_catalogue ADD COLUMN trigram_count INTEGER')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalogue_trigrams (
+            trigram TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, product_id)
+        ) WITHOUT ROWID
+    ''')
+    # Entries added at ingest whose trigrams are not indexed yet
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_product_catalogue_unindexed
+        ON product_catalogue(product_id) WHERE trigram_count IS NULL
+    ''')
+
+    cursor.execute('SELECT product_id, item_name FROM product_catalogue')
+    entries = []
+    index_rows = []
+    for product_id, item_name in cursor.fetchall():
+        normalized = normalize_name(item_name)
+        rows = trigram_rows(product_id, normalized)
+        entries.append((normalized, len(rows), product_id))
+        index_rows.extend(rows)
+    cursor.executemany('UPDATE product_catalogue SET normalized_name = ?, trigram_count = ? WHERE product_id = ?',
+                       entries)
+    cursor.executemany('INSERT OR IGNORE INTO catalogue_trigrams (trigram, product_id) VALUES (?, ?)', index_rows)
+
+
+FOOD_CHAINS_MIGRATIONS = [
+    Migration(1, "baseline schema", food_chains_baseline),
+    Migration(2, "indexes for the app's lookups", food_chains_query_indexes),
+    Migration(3, "product catalogue keyed by barcode", food_chains_product_catalogue),
+    Migration(4, "canonical unit prices", food_chains_unit_prices),
+    Migration(5, "published files and ingest state for delta files", food_chains_delta_ingest),
+    Migration(6, "refresh schedule and branch refresh queue", food_chains_refresh_scheduler),
+    Migration(7, "index of archived raw files", food_chains_file_archive),
+    Migration(8, "normalized catalogue names and trigram index", food_chains_name_matching),
+]
+
+# ========================================
+# data/hierarchical_food_chains.db
+# ========================================
+
+# (table suffix, index suffix, indexed expression) created on every branch's tables
+BRANCH_TABLE_INDEXES = [
+    # /hierarchical-branch: ORDER BY CAST(item_price AS REAL) DESC LIMIT 50
+    ('products', 'price', 'CAST(item_price AS REAL)'),
+    # /hierarchical-branch: ORDER BY CAST(discounted_price AS REAL) DESC LIMIT 50
+    ('promotions', 'discounted_price', 'CAST(discounted_price AS REAL)'),
+    # /hierarchical-branch: items of each listed promotion
+    ('promotion_items', 'promotion_id', 'promotion_id'),
+    # Delta ingest replaces the rows of the items and promotions a delta file lists
+    ('products', 'item_code', 'item_code'),
+    ('promotions', 'promotion_id', 'promotion_id'),
+]
+
+
+def create_branch_indexes(cursor, table_prefix, existing_tables=None, schema='main'):
+    """Create BRANCH_TABLE_INDEXES on the tables of one branch (prefix 'branch_<chain>_<branch>')"""
+    for table_suffix, index_suffix, expression in BRANCH_TABLE_INDEXES:
+        table_name = f"{table_prefix}_{table_suffix}"
+        if existing_tables is not None and table_name not in existing_tables:
+            continue
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_{table_name}_{index_suffix} '
+                       f'ON {table_name}({expression})')
+
+
+def hierarchical_baseline(cursor):
+    """Tables as originally created by HierarchicalFoodDatabase.init_database()"""
+    # ========================================
+    # MAIN INDEX TABLE
+    # ========================================
+    # Metadata: Root URL, total number of food chains
+    # Rows: One row per food chain
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS main_index (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chain_code TEXT UNIQUE NOT NULL,
+            chain_name TEXT NOT NULL,
+            chain_url TEXT NOT NULL,
+            last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+            -- Table metadata (stored as JSON for flexibility)
+            table_metadata TEXT DEFAULT '{}',
+
+            UNIQUE(chain_code)
+        )
+    ''')
+
+    # Metadata table for main_index
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS main_index_metadata (
+            id INTEGER PRIMARY KEY,
+            root_url TEXT NOT NULL,
+            total_chains INTEGER DEFAULT 0,
+            last_discovery_update TIMESTAMP,
+            notes TEXT DEFAULT ''
+        )
+    ''')
+
+    # Create metadata for main_index table
+    cursor.execute('''
+        INSERT OR REPLACE INTO main_index_metadata (
+            id, root_url, total_chains, last_discovery_update
+        ) VALUES (1, ?, ?, ?)
+    ''', (
+        'https://www.gov.il/he/pages/cpfta_prices_regulations',
+        0,  # Will be updated when we populate
+        datetime.now().isoformat()
+    ))
+
+
+def hierarchical_branch_indexes(cursor):
+    """Index the per-branch tables created before create_branch_table() did it"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+    for table_name in sorted(tables):
+        if table_name.startswith('branch_') and table_name.endswith('_products'):
+            create_branch_indexes(cursor, table_name[:-len('_products')], tables)
+
+
+def hierarchical_branch_locations(cursor):
+    """Branch coordinates plus an R*Tree over them for radius / nearest-branch lookups"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS branch_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chain_code TEXT NOT NULL,
+            branch_code TEXT NOT NULL,
+            branch_name TEXT DEFAULT '',
+            address TEXT DEFAULT '',
+            city TEXT DEFAULT '',
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            source TEXT DEFAULT '',
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+            UNIQUE(chain_code, branch_code)
+        )
+    ''')
+    # One point-sized box per branch_locations row (same id); R*Tree stores
+    # 32-bit floats, so exact distances are computed from branch_locations
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS branch_locations_rtree
+        USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    ''')
+
+
+HIERARCHICAL_MIGRATIONS = [
+    Migration(1, "baseline schema", hierarchical_baseline),
+    Migration(2, "per-branch indexes", hierarchical_branch_indexes),
+    Migration(3, "branch locations with an R*Tree index", hierarchical_branch_locations),
+    Migration(4, "per-branch item code and promotion id indexes", hierarchical_branch_indexes),
+]
+
+# ========================================
+# RUNNER
+# ========================================
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def latest_version(migrations):
+    return migrations[-1].version if migrations else 0
+
+
+def apply_migrations(conn, migrations, label="database"):
+    """Apply every migration newer than PRAGMA user_version; returns the versions applied"""
+    current = schema_version(conn)
+    pending = [migration for migration in migrations if migration.version > current]
+    if not pending:
+        return []
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    for migration in pending:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            migration.apply(cursor)
+            cursor.execute('''
+                INSERT OR REPLACE INTO schema_migrations (version, description, applied_at)
+                VALUES (?, ?, ?)
+            ''', (migration.version, migration.description, datetime.now().isoformat()))
+            cursor.execute(f'PRAGMA user_version = {int(migration.version)}')
+            conn.commit()
+        except BaseException:
+            # Data transforms run Python code, so any error must undo the step, not only sqlite3's
+            conn.rollback()
+            print(f"❌ {label}: migration {migration.version} ({migration.description}) failed")
+            raise
+        applied.append(migration.version)
+        print(f"🔧 {label}: applied migration {migration.version} ({migration.description})")
+    return applied
+
+
+def migrate_all(food_chains_path="data/food_chains.db",
+                hierarchical_path="data/hierarchical_food_chains.db"):
+    """Bring both database files to their latest schema version"""
+    for db_path, migrations in ((food_chains_path, FOOD_CHAINS_MIGRATIONS),
+                                (hierarchical_path, HIERARCHICAL_MIGRATIONS)):
+        conn = sqlite3.connect(db_path)
+        before = schema_version(conn)
+        apply_migrations(conn, migrations, db_path)
+        print(f"✅ {db_path}: schema version {before} -> {schema_version(conn)} "
+              f"(latest {latest_version(migrations)})")
+        conn.close()
+
+
+if __name__ == "__main__":
+    migrate_all()
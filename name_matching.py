@@ -0,0 +1,94 @@
+"""
+Name Matching
+Normalizes Hebrew product names and free text for matching, and breaks them
+into trigrams for the fuzzy lookup behind /catalogue/match.
+
+ItemNm values spell the same thing many ways: ק"ג / ק״ג / ק'ג / קילו,
+"1.5ל" / "1.5 ליטר", niqqud on some chains' names, hyphens, doubled spaces.
+normalize_text() folds all of these to one form:
+
+    1. NFKD, then drop niqqud, cantillation and other combining marks
+       (also unpacks Hebrew presentation forms such as שּׁ)
+    2. case-fold; drop quote marks, geresh and gershayim (' " ` ׳ ״ ‘ ’ “ ”)
+    3. decimal commas become points; other punctuation, maqaf and
+       hyphens become spaces; digits and letters are split ("500גר")
+    4. a unit spelling after a number becomes one canonical token
+       (unit_normalization.UNIT_ALIASES): 1 ל / 1 ליטר / 1 l → 1 ליטר
+
+Catalogue names are stored in this form (product_catalogue.normalized_name)
+and search terms go through it too, so LIKE search matches across spellings.
+A search term's last word may be a unit still being typed, so search_terms()
+only canonicalizes units followed by another word, and keeps the last one as
+typed next to each canonical unit it can begin: "3 ג" stays a prefix of
+"3 גביעים" and also finds "3 גרם", "1 קיל" finds "1 קג".
+
+Trigrams follow pg_trgm: each word, with final letters folded (ך→כ, ם→מ, ...)
+and padded as "  word ", contributes its 3-letter windows. A query is scored
+against a name by the share of the query's trigrams the name has (coverage),
+then by Jaccard similarity, so "חלב תנובה" ranks a 1-liter Tnuva milk above
+"שוקו תנובה" and shorter names above longer ones with the same coverage.
+"""
+
+import re
+import unicodedata
+
+from unit_normalization import ALIAS_TO_UNIT
+
+# Canonical token per unit, used for the many spellings of each
+UNIT_TOKENS = {'g': 'גרם', 'kg': 'קג', 'ml': 'מל', 'l': 'ליטר', 'unit': 'יח', 'cm': 'סמ', 'm': 'מטר'}
+
+QUOTE_MARKS = re.compile(r"[\"'`׳״‘’“”′″]")
+DECIMAL_COMMA = re.compile(r"(?<=\d),(?=\d)")
+# Everything but letters, digits, % and a decimal point becomes a word break
+WORD_BREAKS = re.compile(r"[^\w%.]|_|(?<!\d)\.|\.(?!\d)")
+DIGIT_LETTER = re.compile(r"(?<=\d)(?=[^\d\s.%])|(?<=[^\d\s.])(?=\d)")
+NUMBER = re.compile(r"\d+(?:\.\d+)?%?")
+
+FINAL_LETTERS = str.maketrans('ךםןףץ', 'כמנפצ')
+
+
+def normalize_text(text, last_unit=True):
+    """Matching form of a product name or free-text entry (see the module docstring)
+
+    last_unit=False leaves the last word as it is, for a term still being typed.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = QUOTE_MARKS.sub('', text.casefold())
+    text = DECIMAL_COMMA.sub('.', text)
+    text = DIGIT_LETTER.sub(' ', WORD_BREAKS.sub(' ', text))
+
+    words = text.split()
+    for index in range(1, len(words) if last_unit else len(words) - 1):
+        unit = ALIAS_TO_UNIT.get(words[index])
+        if unit and NUMBER.fullmatch(words[index - 1]):
+            words[index] = UNIT_TOKENS[unit]
+    return ' '.join(words)
+
+
+def search_terms(text):
+    """Normalized forms a search-as-you-type term may take in stored names, the typed form first"""
+    normalized = normalize_text(text, last_unit=False)
+    words = normalized.split()
+    if len(words) < 2 or not NUMBER.fullmatch(words[-2]):
+        return (normalized,)
+    typed = words[-1]
+    units = sorted({UNIT_TOKENS[unit] for alias, unit in ALIAS_TO_UNIT.items() if alias.startswith(typed)})
+    number = ' '.join(words[:-1])
+    # A unit the typed form is already a prefix of needs no term of its own
+    terms = (f"{number} {unit}" for unit in units)
+    return (normalized,) + tuple(term for term in terms if normalized not in term)
+
+
+def trigrams(normalized):
+    """Set of pg_trgm-style trigrams of a normalized name"""
+    grams = set()
+    for word in normalized.translate(FINAL_LETTERS).split():
+        padded = f"  {word} "
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def trigram_rows(product_id, normalized):
+    """(trigram, product_id) rows of catalogue_trigrams for one catalogue entry"""
+    return [(gram, product_id) for gram in sorted(trigrams(normalized))]
@@ -0,0 +1,141 @@
+"""
+Parallel PriceFull Parsing
+Splits the Items section of a large decompressed PriceFull document into byte
+ranges on <Item> boundaries and parses them in a process pool. Small files, and
+encodings where byte searching is unsafe (UTF-16), use the serial parser.
+"""
+
+import marshal
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from chain_formats import CHAIN_FORMATS, get_chain_format
+from records import ProductRecord
+from xml_stream import detect_file_format, detect_xml_encoding, open_xml_stream, uncompressed_size
+
+# Decompressed size from which a PriceFull file is parsed in parallel
+PARALLEL_PARSE_MIN_BYTES = int(os.environ.get("PARALLEL_PARSE_MIN_BYTES", 32 * 1024 * 1024))
+# Aim for a few chunks per worker so uneven chunks still balance out
+CHUNKS_PER_WORKER = 4
+MIN_CHUNK_BYTES = 1024 * 1024
+
+BYTE_SAFE_ENCODINGS = {'utf-8', 'utf-8-sig', 'ascii', 'cp1255', 'iso8859-8', 'latin-1', 'iso8859-1'}
+
+
+def parse_products_serial(filepath, chain_format=None):
+    """Parse a PriceFull file in this process; returns a list of ProductRecords"""
+    with open_xml_stream(filepath) as stream:
+        root = ET.parse(stream).getroot()
+    if chain_format is None:
+        chain_format = get_chain_format(root=root)
+    return chain_format.parse_products(root)
+
+
+def parse_item_range(task):
+    """Worker: parse one byte range of <Item> elements and return a marshalled batch of rows"""
+    path, start, end, declaration, container_tag, format_name = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+
+    document = b''.join([declaration, b'<', container_tag, b'>', chunk, b'</', container_tag, b'>'])
+    container = ET.fromstring(document)
+    rows = CHAIN_FORMATS[format_name].product_extractor.extract_all(list(container))
+    # marshal is the cheapest way to ship flat tuples of str back to the parent
+    return marshal.dumps([tuple(values) for values in rows])
+
+
+def find_chunk_ranges(data, item_pattern, start, end, chunk_bytes):
+    """Split data[start:end] into ranges that each begin at an item start tag"""
+    ranges = []
+    position = start
+    while position < end:
+        match = item_pattern.search(data, min(position + chunk_bytes, end), end)
+        boundary = match.start() if match else end
+        ranges.append((position, boundary))
+        position = boundary
+    return ranges
+
+
+def parse_products_parallel(xml_path, chain_format=None, workers=None):
+    """Parse a plain (decompressed) PriceFull XML file with a process pool"""
+    workers = workers or os.cpu_count() or 1
+
+    with open(xml_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        encoding = detect_xml_encoding(data[:256])
+        if encoding not in BYTE_SAFE_ENCODINGS:
+            return parse_products_serial(xml_path, chain_format)
+
+        body_start = 3 if data[:3] == b'\xef\xbb\xbf' else 0
+        declaration = b''
+        if data[body_start:body_start + 5] == b'<?xml':
+            declaration = data[body_start:data.find(b'?>', body_start) + 2]
+
+        # The document minus the items themselves is the header (ChainId, StoreId, ...)
+        candidates = [chain_format] if chain_format else list(CHAIN_FORMATS.values())[::-1]
+        container_open = None
+        for candidate in candidates:
+            container_name, _, item_name = candidate.item_paths[0].rpartition('/')
+            container_name = container_name.rpartition('/')[2]
+            pattern = re.compile(rb'<(' + container_name.encode() + rb')(?:\s[^>/]*)?>', re.I)
+            container_open = pattern.search(data)
+            if container_open:
+                break
+        if container_open is None:
+            return parse_products_serial(xml_path, chain_format)
+        container_tag = container_open.group(1)
+        container_close = data.rfind(b'</' + container_tag + b'>')
+        if container_close < container_open.end():
+            return parse_products_serial(xml_path, chain_format)
+
+        header = ET.fromstring(data[body_start:container_open.end()] + data[container_close:])
+        if chain_format is None:
+            chain_format = get_chain_format(root=header)
+        chain_id, store_id = chain_format.read_metadata(header)
+
+        item_pattern = re.compile(rb'<' + item_name.encode() + rb'[\s>/]', re.I)
+        items_start, items_end = container_open.end(), container_close
+        chunk_bytes = max(MIN_CHUNK_BYTES, (items_end - items_start) // (workers * CHUNKS_PER_WORKER))
+        ranges = find_chunk_ranges(data, item_pattern, items_start, items_end, chunk_bytes)
+    finally:
+        data.close()
+
+    tasks = [(xml_path, start, end, declaration, container_tag, chain_format.name) for start, end in ranges]
+    print(f"⚙️ Parsing {len(tasks)} chunks of {os.path.basename(xml_path)} across {workers} processes")
+
+    new_record = tuple.__new__
+    products = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in executor.map(parse_item_range, tasks):
+            products.extend(new_record(ProductRecord, (chain_id, store_id, *values))
+                            for values in marshal.loads(batch))
+    return products
+
+
+def parse_price_file(filepath, chain_format=None, workers=None, min_parallel_bytes=None):
+    """Parse a downloaded PriceFull file, in parallel when it is large enough"""
+    threshold = PARALLEL_PARSE_MIN_BYTES if min_parallel_bytes is None else min_parallel_bytes
+    size = uncompressed_size(filepath)
+    if size < threshold or (workers or os.cpu_count() or 1) < 2:
+        return parse_products_serial(filepath, chain_format)
+
+    with open(filepath, 'rb') as f:
+        compressed = detect_file_format(f.read(2)) != 'xml'
+    if not compressed:
+        return parse_products_parallel(filepath, chain_format, workers)
+
+    # Workers read byte ranges, so decompress once to a temporary plain XML file
+    fd, xml_path = tempfile.mkstemp(suffix='.xml')
+    try:
+        with os.fdopen(fd, 'wb') as out, open_xml_stream(filepath) as stream:
+            shutil.copyfileobj(stream, out, 1024 * 1024)
+        return parse_products_parallel(xml_path, chain_format, workers)
+    finally:
+        os.remove(xml_path)
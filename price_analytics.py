@@ -0,0 +1,348 @@
+"""
+Price Analytics
+Vectorized cross-branch price comparisons over the columnar products snapshot
+(see product_snapshot.py). Every branch is a column of the item x branch price
+matrix; statistics are computed with grouped NumPy reductions over the snapshot's
+item-sorted rows instead of Python loops over SQLite rows.
+
+Results are cached per snapshot and the cache is dropped whenever an ingest
+publishes a new snapshot.
+"""
+
+import threading
+
+import numpy as np
+
+from product_snapshot import (
+    export_products_snapshot, latest_snapshot_path, load_products_snapshot, snapshot_root_for
+)
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+# Parameterised queries (items, branch pairs) are unbounded, so cap the result cache
+MAX_CACHED_RESULTS = 1024
+
+
+class PriceMatrix:
+    """Item x branch prices held as parallel arrays (one entry per priced product row)"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        price = np.asarray(snapshot['price'], dtype=np.float64)
+        valid = np.isfinite(price) & (price > 0)
+
+        self.item = np.asarray(snapshot['item'])[valid]
+        self.price = price[valid]
+        self.name = np.asarray(snapshot['name'])[valid]
+
+        # A branch column is a (chain, branch) pair; branch codes repeat across chains
+        branch_count = max(len(snapshot.dictionaries['branch']), 1)
+        pair = (np.asarray(snapshot['chain'])[valid].astype(np.int64) * branch_count
+                + np.asarray(snapshot['branch'])[valid])
+        pairs, self.column = np.unique(pair, return_inverse=True)
+        chains = snapshot.decode('chain', pairs // branch_count)
+        branches = snapshot.decode('branch', pairs % branch_count)
+        self.branches = list(zip(chains, branches))
+        self.branch_index = {branch: index for index, branch in enumerate(self.branches)}
+
+        # Rows are sorted by item, so each item is one contiguous group
+        if len(self.item):
+            self.starts = np.concatenate(([0], np.flatnonzero(np.diff(self.item)) + 1))
+        else:
+            self.starts = np.empty(0, dtype=np.int64)
+        self.counts = np.diff(np.append(self.starts, len(self.item)))
+        self.group_items = self.item[self.starts]
+
+        # Prices sorted within each item group, for percentiles
+        self.sorted_price = self.price[np.lexsort((self.price, self.item))]
+
+    @property
+    def branch_count(self):
+        return len(self.branches)
+
+    def item_labels(self, groups):
+        """Return (item_code, item_name) for group indexes"""
+        codes = self.snapshot.decode('item', self.group_items[groups])
+        names = self.snapshot.decode('name', self.name[self.starts[groups]])
+        return list(zip(codes, names))
+
+    def group_percentiles(self, percentiles=DEFAULT_PERCENTILES):
+        """Linear-interpolated percentiles of every item group; shape (groups, len(percentiles))"""
+        q = np.asarray(percentiles, dtype=np.float64)[None, :] / 100.0
+        position = self.starts[:, None] + q * (self.counts[:, None] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        return self.sorted_price[lower] * (1 - fraction) + self.sorted_price[upper] * fraction
+
+    def group_stats(self):
+        """Per-item min, max and mean price across branches"""
+        minimum = np.minimum.reduceat(self.price, self.starts)
+        maximum = np.maximum.reduceat(self.price, self.starts)
+        mean = np.add.reduceat(self.price, self.starts) / self.counts
+        return minimum, maximum, mean
+
+    def branch_vector(self, branch):
+        """Dense price vector over all item codes for one branch (NaN where not sold)"""
+        vector = np.full(len(self.snapshot.dictionaries['item']), np.nan)
+        rows = self.column == self.branch_index[branch]
+        vector[self.item[rows]] = self.price[rows]
+        return vector
+
+    # ========================================
+    # ANALYTICS
+    # ========================================
+
+    def summary(self):
+        return {
+            "snapshot": self.snapshot.path,
+            "snapshot_created_at": self.snapshot.manifest.get('created_at'),
+            "price_points": int(len(self.price)),
+            "items": int(len(self.starts)),
+            "branches": self.branch_count,
+            "items_in_multiple_branches": int(np.count_nonzero(self.counts > 1)),
+        }
+
+    def price_spread(self, limit=50, min_branches=2, sort_by='ratio'):
+        """Items with the largest price spread across branches"""
+        if not len(self.starts):
+            return []
+        minimum, maximum, mean = self.group_stats()
+        percentiles = self.group_percentiles()
+        spread = maximum - minimum
+        ratio = maximum / minimum
+
+        eligible = np.flatnonzero(self.counts >= min_branches)
+        key = ratio if sort_by == 'ratio' else spread
+        top = eligible[np.argsort(-key[eligible], kind='stable')[:limit]]
+
+        labels = self.item_labels(top)
+        return [{
+            "item_code": code,
+            "item_name": name,
+            "branches": int(self.counts[group]),
+            "min_price": round(float(minimum[group]), 2),
+            "max_price": round(float(maximum[group]), 2),
+            "mean_price": round(float(mean[group]), 2),
+            "spread": round(float(spread[group]), 2),
+            "spread_ratio": round(float(ratio[group]), 3),
+            "percentiles": {f"p{p}": round(float(value), 2)
+                            for p, value in zip(DEFAULT_PERCENTILES, percentiles[group])},
+        } for group, (code, name) in zip(top.tolist(), labels)]
+
+    def item_prices(self, item_code):
+        """Distribution of one item's price across branches"""
+        code = self.snapshot.item_code_index(item_code)
+        if code is None:
+            return None
+        group = int(np.searchsorted(self.group_items, code))
+        if group >= len(self.group_items) or self.group_items[group] != code:
+            return None
+        rows = slice(int(self.starts[group]), int(self.starts[group] + self.counts[group]))
+        percentiles = np.percentile(self.sorted_price[rows], DEFAULT_PERCENTILES)
+        prices = self.price[rows]
+        order = np.argsort(prices, kind='stable')
+        return {
+            "item_code": item_code,
+            "item_name": self.item_labels([group])[0][1],
+            "branches": int(self.counts[group]),
+            "percentiles": {f"p{p}": round(float(value), 2) for p, value in zip(DEFAULT_PERCENTILES, percentiles)},
+            "prices": [{
+                "chain_code": self.branches[column][0],
+                "branch_code": self.branches[column][1],
+                "price": float(price),
+            } for column, price in zip(self.column[rows][order].tolist(), prices[order].tolist())],
+        }
+
+    def price_index(self, min_branches=2):
+        """
+        Per-branch price index: geometric mean of (branch price / item median)
+        over the branch's items sold in at least min_branches branches, x100.
+        Below 100 means cheaper than the typical branch.
+        """
+        if not len(self.starts):
+            return []
+        median = self.group_percentiles((50,))[:, 0]
+        row_median = np.repeat(median, self.counts)
+        shared = np.repeat(self.counts >= min_branches, self.counts)
+
+        log_ratio = np.log(self.price[shared] / row_median[shared])
+        columns = self.column[shared]
+        items = np.bincount(columns, minlength=self.branch_count)
+        totals = np.bincount(columns, weights=log_ratio, minlength=self.branch_count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            index = np.exp(totals / items) * 100
+
+        order = np.argsort(np.where(items > 0, index, np.inf), kind='stable')
+        return [{
+            "chain_code": self.branches[column][0],
+            "branch_code": self.branches[column][1],
+            "price_index": round(float(index[column]), 2) if items[column] else None,
+            "items_compared": int(items[column]),
+        } for column in order.tolist()]
+
+    def compare_branches(self, branch_a, branch_b, limit=10):
+        """How much cheaper branch A is than branch B on their common catalogue"""
+        prices_a = self.branch_vector(branch_a)
+        prices_b = self.branch_vector(branch_b)
+        common = np.flatnonzero(~np.isnan(prices_a) & ~np.isnan(prices_b))
+        a = prices_a[common]
+        b = prices_b[common]
+
+        result = {
+            "branch_a": {"chain_code": branch_a[0], "branch_code": branch_a[1],
+                         "items": int(np.count_nonzero(~np.isnan(prices_a)))},
+            "branch_b": {"chain_code": branch_b[0], "branch_code": branch_b[1],
+                         "items": int(np.count_nonzero(~np.isnan(prices_b)))},
+            "common_items": int(len(common)),
+        }
+        if not len(common):
+            return result
+
+        total_a = float(a.sum())
+        total_b = float(b.sum())
+        difference = a - b
+        result.update({
+            "basket_total_a": round(total_a, 2),
+            "basket_total_b": round(total_b, 2),
+            "a_vs_b_percent": round((total_a - total_b) / total_b * 100, 2),
+            "geometric_mean_ratio": round(float(np.exp(np.log(a / b).mean())), 4),
+            "a_cheaper_items": int(np.count_nonzero(difference < 0)),
+            "b_cheaper_items": int(np.count_nonzero(difference > 0)),
+            "equal_items": int(np.count_nonzero(difference == 0)),
+        })
+
+        def describe(indexes):
+            codes = self.snapshot.decode('item', common[indexes])
+            return [{"item_code": code, "price_a": float(a[i]), "price_b": float(b[i]),
+                     "difference": round(float(difference[i]), 2)}
+                    for code, i in zip(codes, indexes.tolist())]
+
+        order = np.argsort(difference, kind='stable')
+        result["largest_savings_at_a"] = describe(order[:limit][difference[order[:limit]] < 0])
+        result["largest_savings_at_b"] = describe(order[::-1][:limit][difference[order[::-1][:limit]] > 0])
+        return result
+
+    def pairwise_comparison(self, branches):
+        """Matrix of basket differences (%) between every pair of the given branches"""
+        vectors = np.vstack([self.branch_vector(branch) for branch in branches])
+        present = ~np.isnan(vectors)
+        filled = np.nan_to_num(vectors)
+
+        # common[i, j]: items both sell; totals[i, j]: branch i's total on those items
+        common = present.astype(np.int64) @ present.T.astype(np.int64)
+        totals = filled @ present.T.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent = (totals - totals.T) / totals.T * 100
+
+        return {
+            "branches": [{"chain_code": chain, "branch_code": branch} for chain, branch in branches],
+            "common_items": common.tolist(),
+            "percent_difference": [[round(float(value), 2) if np.isfinite(value) else None for value in row]
+                                   for row in percent],
+        }
+
+    def basket_totals(self, item_codes, branches):
+        """Basket total at each given branch, with the items that branch doesn't price"""
+        item_codes = list(dict.fromkeys(item_codes))
+        groups = []
+        for item_code in item_codes:
+            code = self.snapshot.item_code_index(item_code)
+            group = -1
+            if code is not None:
+                group = int(np.searchsorted(self.group_items, code))
+                if group >= len(self.group_items) or self.group_items[group] != code:
+                    group = -1
+            groups.append(group)
+        found = np.array([group for group in groups if group >= 0], dtype=np.int64)
+
+        # Rows of the basket's items, tagged with the item's position in the basket
+        rows = (np.concatenate([np.arange(self.starts[group], self.starts[group] + self.counts[group])
+                                for group in found.tolist()]) if len(found) else np.empty(0, dtype=np.int64))
+        positions = np.repeat(np.flatnonzero(np.array(groups) >= 0), self.counts[found])
+
+        # Map matrix columns to positions in the requested branch list
+        target_of_column = np.full(self.branch_count, -1, dtype=np.int64)
+        for target, branch in enumerate(branches):
+            if branch in self.branch_index:
+                target_of_column[self.branch_index[branch]] = target
+        targets = target_of_column[self.column[rows]]
+        keep = targets >= 0
+
+        totals = np.bincount(targets[keep], weights=self.price[rows][keep], minlength=len(branches))
+        priced = np.zeros((len(branches), len(item_codes)), dtype=bool)
+        priced[targets[keep], positions[keep]] = True
+
+        return [{
+            "basket_total": round(float(totals[target]), 2),
+            "items_priced": int(priced[target].sum()),
+            "missing_items": [code for code, present in zip(item_codes, priced[target].tolist()) if not present],
+        } for target in range(len(branches))]
+
+
+class PriceAnalytics:
+    """Caches a PriceMatrix and analytics results for the latest snapshot"""
+
+    def __init__(self, db_path="data/food_chains.db"):
+        self.db_path = db_path
+        # Snapshots of this database only, next to its file
+        self.snapshot_root = snapshot_root_for(db_path)
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._results = {}
+
+    def invalidate(self):
+        """Drop cached results (called after an ingest publishes a new snapshot)"""
+        with self._lock:
+            self._matrix = None
+            self._results = {}
+
+    def matrix(self):
+        with self._lock:
+            path = latest_snapshot_path(self.snapshot_root)
+            if self._matrix is not None and self._matrix.snapshot.path == path:
+                return self._matrix
+
+            snapshot = load_products_snapshot(path)
+            if snapshot is None:
+                snapshot = load_products_snapshot(export_products_snapshot(self.db_path, self.snapshot_root))
+            self._matrix = PriceMatrix(snapshot)
+            self._results = {}
+            return self._matrix
+
+    def cached(self, key, compute):
+        """Return a cached result for key, computing it from the current matrix on a miss"""
+        matrix = self.matrix()
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        result = compute(matrix)
+        with self._lock:
+            if self._matrix is matrix:
+                if len(self._results) >= MAX_CACHED_RESULTS:
+                    self._results = {}
+                self._results[key] = result
+        return result
+
+    def summary(self):
+        return self.cached(('summary',), lambda matrix: matrix.summary())
+
+    def price_spread(self, limit=50, min_branches=2, sort_by='ratio'):
+        return self.cached(('spread', limit, min_branches, sort_by),
+                           lambda matrix: matrix.price_spread(limit, min_branches, sort_by))
+
+    def item_prices(self, item_code):
+        return self.cached(('item', item_code), lambda matrix: matrix.item_prices(item_code))
+
+    def price_index(self, min_branches=2):
+        return self.cached(('index', min_branches), lambda matrix: matrix.price_index(min_branches))
+
+    def compare_branches(self, branch_a, branch_b, limit=10):
+        return self.cached(('compare', branch_a, branch_b, limit),
+                           lambda matrix: matrix.compare_branches(branch_a, branch_b, limit))
+
+    def pairwise_comparison(self, branches):
+        return self.cached(('pairwise', tuple(branches)), lambda matrix: matrix.pairwise_comparison(branches))
+
+    def basket_totals(self, item_codes, branches):
+        return self.cached(('basket', tuple(item_codes), tuple(branches)),
+                           lambda matrix: matrix.basket_totals(item_codes, branches))
@@ -0,0 +1,54 @@
+"""
+Product Catalogue
+One canonical entry per product across all chains, keyed by barcode. PriceFull
+item codes are usually GTIN/EAN barcodes; those are normalized to 14 digits so
+the same product matches whatever width a chain reports it in. Codes that are
+not valid barcodes (weighed goods, deposits, chain-internal codes) only
+identify a product within one chain, so their key is scoped as
+'<chain_code>:<item_code>'.
+
+Every products row links to its entry through an integer product_id
+(see migrations.py), so cross-chain comparisons join on small integer keys.
+"""
+
+from name_matching import normalize_text
+
+GTIN_LENGTHS = (8, 12, 13, 14)
+
+
+def is_gtin(code):
+    """True for an 8/12/13/14 digit code with a valid GS1 check digit"""
+    if not code.isdigit() or len(code) not in GTIN_LENGTHS:
+        return False
+    digits = [int(digit) for digit in code.zfill(14)]
+    total = sum(digit * (3 if position % 2 == 0 else 1) for position, digit in enumerate(digits[:-1]))
+    return (10 - total % 10) % 10 == digits[-1]
+
+
+def canonical_barcode(chain_code, item_code):
+    """Catalogue key of an item: GTIN-14 for barcodes, chain-scoped otherwise"""
+    code = (item_code or '').strip()
+    if is_gtin(code):
+        return code.zfill(14)
+    return f"{chain_code}:{code}"
+
+
+def normalize_name(name):
+    """Matching form of a name: no niqqud, quote marks or punctuation, one spelling per unit (name_matching.py)"""
+    return normalize_text(name)
+
+
+def catalogue_entry(chain_code, product, seen_at):
+    """Row for product_catalogue from a (normalized) ProductRecord"""
+    return (
+        canonical_barcode(chain_code, product.item_code),
+        product.item_name or '',
+        normalize_name(product.item_name),
+        product.manufacturer_name or '',
+        product.unit_of_measure or '',
+        product.unit_qty or '',
+        float(product.quantity or 0),
+        int(product.is_weighted or 0),
+        seen_at,
+        seen_at,
+    )
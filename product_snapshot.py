@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Columnar Product Snapshots
+Exports the products table of food_chains.db to one NumPy .npy file per column,
+with item codes, names, chains and branches dictionary-encoded to integer codes.
+Snapshots are memory-mapped on load, so analytics can run vectorized over
+millions of price points without going through SQLite row tuples.
+
+Layout: snapshots/products-<timestamp>/ next to the database file
+(data/snapshots/ for data/food_chains.db), so each database has its own:
+    manifest.json       row count, source database, column dtypes
+    dictionaries.json   code -> string lists for the encoded columns
+    <column>.npy        one array per column, rows sorted by item code
+    snapshots/LATEST names the newest complete snapshot
+
+Each export reads the whole products table, so ingests do not export directly:
+they call SnapshotExporter.request(), which runs at most one export per
+SNAPSHOT_EXPORT_SECONDS in the background and serves every request made
+before it starts.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+SNAPSHOT_PREFIX = "products-"
+KEEP_SNAPSHOTS = 3
+# Back-to-back ingests (the refresh scheduler, delta batches) share one export per interval
+EXPORT_INTERVAL_SECONDS = float(os.environ.get("SNAPSHOT_EXPORT_SECONDS", 60))
+
+# Encoded columns store int32 codes into dictionaries.json
+DICTIONARY_COLUMNS = ['item', 'name', 'chain', 'branch']
+VALUE_COLUMNS = {
+    'price': np.float64,
+    'unit_price': np.float64,
+    'quantity': np.float64,
+    'is_weighted': np.int8,
+}
+
+
+def snapshot_root_for(db_path):
+    """Snapshot directory of a database: snapshots/ next to its file"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'snapshots')
+
+
+def encode(values):
+    """Dictionary-encode values in order of first appearance; returns (codes, dictionary)"""
+    index = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values),
+                        dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+def export_products_snapshot(db_path="data/food_chains.db", snapshot_root=None, keep=KEEP_SNAPSHOTS):
+    """Write a columnar snapshot of the products table and return its directory"""
+    snapshot_root = snapshot_root or snapshot_root_for(db_path)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('''
+        SELECT item_code, item_name, chain_code, branch_code,
+               item_price, unit_of_measure_price, quantity, is_weighted
+        FROM products
+        ORDER BY item_code, chain_code, branch_code
+    ''').fetchall()
+    conn.close()
+
+    columns = list(zip(*rows)) or [()] * 8
+    del rows
+
+    name = SNAPSHOT_PREFIX + datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    final_dir = os.path.join(snapshot_root, name)
+    work_dir = final_dir + '.tmp'
+    os.makedirs(work_dir)
+
+    dictionaries = {}
+    for column, values in zip(DICTIONARY_COLUMNS, columns[:4]):
+        # Rows are ordered by item code, so item codes come out sorted as well
+        codes, dictionaries[column] = encode(values)
+        np.save(os.path.join(work_dir, f"{column}.npy"), codes)
+    for (column, dtype), values in zip(VALUE_COLUMNS.items(), columns[4:]):
+        array = np.array([value if value is not None else np.nan for value in values], dtype=np.float64)
+        if dtype is not np.float64:
+            array = np.nan_to_num(array).astype(dtype)
+        np.save(os.path.join(work_dir, f"{column}.npy"), array)
+
+    manifest = {
+        'rows': len(columns[0]),
+        'created_at': datetime.datetime.now().isoformat(),
+        'source': os.path.abspath(db_path),
+        'columns': {column: 'int32' for column in DICTIONARY_COLUMNS},
+    }
+    manifest['columns'].update({column: np.dtype(dtype).name for column, dtype in VALUE_COLUMNS.items()})
+    with open(os.path.join(work_dir, 'dictionaries.json'), 'w', encoding='utf-8') as f:
+        json.dump(dictionaries, f, ensure_ascii=False)
+    with open(os.path.join(work_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Publish: rename the finished directory, then repoint LATEST atomically
+    os.rename(work_dir, final_dir)
+    latest_tmp = os.path.join(snapshot_root, 'LATEST.tmp')
+    with open(latest_tmp, 'w') as f:
+        f.write(name)
+    os.replace(latest_tmp, os.path.join(snapshot_root, 'LATEST'))
+
+    remove_old_snapshots(snapshot_root, keep)
+    print(f"📸 Products snapshot: {manifest['rows']:,} rows → {final_dir}")
+    return final_dir
+
+
+def remove_old_snapshots(snapshot_root, keep=KEEP_SNAPSHOTS):
+    """Delete all but the newest `keep` snapshots (loaders already mapping them keep working)"""
+    names = sorted(name for name in os.listdir(snapshot_root)
+                   if name.startswith(SNAPSHOT_PREFIX) and not name.endswith('.tmp'))
+    for name in names[:-keep]:
+        shutil.rmtree(os.path.join(snapshot_root, name), ignore_errors=True)
+
+
+class SnapshotExporter:
+    """Exports snapshots of one database in the background, at most one per interval"""
+
+    def __init__(self, db_path, interval=EXPORT_INTERVAL_SECONDS, on_export=None):
+        self.db_path = db_path
+        self.snapshot_root = snapshot_root_for(db_path)
+        self.interval = interval
+        self.on_export = on_export
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.timer = None
+        self.last_started = None
+
+    def request(self):
+        """Schedule an export; requests made before it starts are served by the same snapshot"""
+        with self.lock:
+            if self.timer is not None:
+                return
+            delay = 0.0
+            if self.last_started is not None:
+                delay = max(0.0, self.last_started + self.interval - time.monotonic())
+            self.timer = threading.Timer(delay, self.export)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def export(self):
+        with self.lock:
+            self.timer = None
+            self.last_started = time.monotonic()
+        with self.export_lock:
+            try:
+                snapshot_dir = export_products_snapshot(self.db_path, self.snapshot_root)
+                if self.on_export:
+                    self.on_export()
+                return snapshot_dir
+            except Exception as e:
+                print(f"⚠️ Products snapshot export failed: {str(e)}")
+
+
+class ProductSnapshot:
+    """A loaded snapshot: memory-mapped column arrays plus their dictionaries"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'dictionaries.json'), encoding='utf-8') as f:
+            self.dictionaries = json.load(f)
+
+        self.rows = self.manifest['rows']
+        self.columns = {
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r') if self.rows else
+            np.empty(0, dtype=dtype)
+            for column, dtype in self.manifest['columns'].items()
+        }
+        self._item_codes = None
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        return self.rows
+
+    def decode(self, column, codes):
+        """Map integer codes of a dictionary column back to strings"""
+        dictionary = self.dictionaries[column]
+        return [dictionary[code] for code in np.asarray(codes).tolist()]
+
+    def item_code_index(self, item_code):
+        """Return the integer code of an item code string, or None"""
+        if self._item_codes is None:
+            self._item_codes = {code: index for index, code in enumerate(self.dictionaries['item'])}
+        return self._item_codes.get(item_code)
+
+    def item_rows(self, item_code):
+        """Return the row slice holding every branch price of one item"""
+        code = self.item_code_index(item_code)
+        if code is None:
+            return slice(0, 0)
+        items = self.columns['item']
+        return slice(int(np.searchsorted(items, code, 'left')), int(np.searchsorted(items, code, 'right')))
+
+
+def latest_snapshot_path(snapshot_root):
+    """Directory LATEST names under snapshot_root, or None before the first export"""
+    try:
+        with open(os.path.join(snapshot_root, 'LATEST')) as f:
+            return os.path.join(snapshot_root, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def load_products_snapshot(path=None, snapshot_root=None):
+    """Memory-map a snapshot (the latest one under snapshot_root by default); returns None when none exists"""
+    path = path or (snapshot_root and latest_snapshot_path(snapshot_root))
+    if not path or not os.path.isdir(path):
+        return None
+    return ProductSnapshot(path)
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "data/food_chains.db"
+    snapshot_dir = export_products_snapshot(db_path)
+    snapshot = load_products_snapshot(snapshot_dir)
+
+    print(f"📊 Rows: {len(snapshot):,}")
+    for column, dictionary in snapshot.dictionaries.items():
+        print(f"   {column:<8} {len(dictionary):,} distinct values")
+    if len(snapshot):
+        prices = snapshot['price']
+        print(f"💰 Price range: {prices.min():.2f} - {prices.max():.2f} (mean {prices.mean():.2f})")
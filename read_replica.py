@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Read Replicas
+With SQLITE_READ_REPLICAS=1 (wsgi.py --read-replicas) the serving workers do
+not read food_chains.db itself. After each ingest the writer copies it with the
+SQLite backup API into a new file and repoints LATEST at it; workers open the
+newest copy immutable (no locks, no change detection), so nothing they do ever
+waits on, or holds up, an ingest transaction.
+
+Layout: data/replicas/ next to the database file
+    food_chains-<timestamp>.db   consistent copies, never written after publishing
+    LATEST                       names the newest complete copy
+
+Workers notice a new LATEST on their next query and reopen; the oldest copies
+beyond KEEP_REPLICAS are deleted (open handles on POSIX keep working).
+"""
+
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+READ_REPLICAS = os.environ.get("SQLITE_READ_REPLICAS") == "1"
+REPLICA_DIRECTORY = "replicas"
+KEEP_REPLICAS = 3
+# Back-to-back ingests (the refresh scheduler) share one copy per interval
+PUBLISH_INTERVAL_SECONDS = float(os.environ.get("REPLICA_PUBLISH_SECONDS", 10))
+
+
+def replica_root(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), REPLICA_DIRECTORY)
+
+
+def replica_prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + '-'
+
+
+def publish_read_replica(db_path, keep=KEEP_REPLICAS):
+    """Copy db_path into a new replica, make it the LATEST one and return its path"""
+    root = replica_root(db_path)
+    os.makedirs(root, exist_ok=True)
+    name = replica_prefix(db_path) + datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f') + '.db'
+    final_path = os.path.join(root, name)
+    work_path = final_path + '.tmp'
+
+    # One backup step copies every page inside a single read transaction: a
+    # consistent state, and under WAL the writer is never blocked meanwhile
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(work_path)
+    try:
+        source.backup(target)
+        # Immutable readers need a rollback-journal file with no -wal beside it
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+
+    # Publish: rename the finished copy, then repoint LATEST atomically
+    os.rename(work_path, final_path)
+    latest_tmp = os.path.join(root, 'LATEST.tmp')
+    with open(latest_tmp, 'w') as f:
+        f.write(name)
+    os.replace(latest_tmp, os.path.join(root, 'LATEST'))
+
+    remove_old_replicas(db_path, keep)
+    print(f"🪞 Read replica: {os.path.getsize(final_path):,} bytes → {final_path}")
+    return final_path
+
+
+def remove_old_replicas(db_path, keep=KEEP_REPLICAS):
+    """Delete all but the newest `keep` replicas, plus copies left unfinished by a crash"""
+    root = replica_root(db_path)
+    prefix = replica_prefix(db_path)
+    names = sorted(name for name in os.listdir(root) if name.startswith(prefix))
+    finished = [name for name in names if not name.endswith('.tmp')]
+    unfinished = [name for name in names if name.endswith('.tmp')]
+    for name in finished[:-keep] + unfinished:
+        try:
+            os.remove(os.path.join(root, name))
+        except OSError as e:
+            # Windows refuses to delete open files; the next publish retries
+            print(f"⚠️ Could not remove old replica {name}: {str(e)}")
+
+
+class ReplicaPointer:
+    """Resolves LATEST to a replica path, re-reading it only when the pointer file changes"""
+
+    def __init__(self, db_path):
+        self.latest = os.path.join(replica_root(db_path), 'LATEST')
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.path = None
+
+    def current(self):
+        """Path of the newest replica, or None before the first one is published"""
+        try:
+            stat = os.stat(self.latest)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp != self.stamp:
+            with self.lock:
+                with open(self.latest) as f:
+                    self.path = os.path.join(os.path.dirname(self.latest), f.read().strip())
+                self.stamp = stamp
+        return self.path
+
+
+class ReplicaPublisher:
+    """Publishes replicas of one database in the background, at most one per interval"""
+
+    def __init__(self, db_path, interval=PUBLISH_INTERVAL_SECONDS, keep=KEEP_REPLICAS):
+        self.db_path = db_path
+        self.interval = interval
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.timer = None
+        self.last_started = None
+
+    def request(self):
+        """Schedule a publish; requests made before it starts are served by the same copy"""
+        with self.lock:
+            if self.timer is not None:
+                return
+            delay = 0.0
+            if self.last_started is not None:
+                delay = max(0.0, self.last_started + self.interval - time.monotonic())
+            self.timer = threading.Timer(delay, self.publish)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def publish(self):
+        with self.lock:
+            self.timer = None
+            self.last_started = time.monotonic()
+        with self.publish_lock:
+            try:
+                return publish_read_replica(self.db_path, self.keep)
+            except Exception as e:
+                print(f"❌ Read replica publish failed: {str(e)}")
+
+
+if __name__ == "__main__":
+    publish_read_replica(sys.argv[1] if len(sys.argv) > 1 else "data/food_chains.db")
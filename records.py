@@ -0,0 +1,99 @@
+"""
+Pipeline Records
+Compact tuple-based record types shared by the XML parser, the normalizer and
+both database writers. Fields are addressed by position, so a parsed product is
+a single tuple instead of a 17-key dict.
+"""
+
+from collections import namedtuple
+
+PRODUCT_COLUMNS = [
+    'item_code', 'item_name', 'manufacturer_name', 'manufacturer_item_description',
+    'unit_qty', 'quantity', 'unit_of_measure', 'is_weighted', 'qty_in_package',
+    'item_price', 'unit_of_measure_price', 'allow_discount', 'item_status',
+    'manufacture_country', 'price_update_date'
+]
+
+PROMOTION_COLUMNS = [
+    'promotion_id', 'promotion_description', 'promotion_update_date',
+    'promotion_start_date', 'promotion_start_hour', 'promotion_end_date', 'promotion_end_hour',
+    'discounted_price', 'discounted_price_per_unit', 'discount_rate',
+    'min_quantity', 'max_quantity', 'min_purchase_amount', 'allow_multiple_discounts',
+    'reward_type', 'discount_type', 'remarks', 'items'
+]
+
+PROMOTION_ITEM_COLUMNS = ['item_code', 'is_gift_item', 'item_type']
+
+ProductRecord = namedtuple('ProductRecord', ['chain_id', 'store_id'] + PRODUCT_COLUMNS)
+PromotionRecord = namedtuple('PromotionRecord', ['chain_id', 'store_id'] + PROMOTION_COLUMNS)
+PromotionItemRecord = namedtuple('PromotionItemRecord', PROMOTION_ITEM_COLUMNS)
+
+
+def record_to_dict(record):
+    """Convert a record (and nested promotion items) to a plain dict for JSON responses"""
+    data = record._asdict()
+    if isinstance(record, PromotionRecord):
+        data['items'] = [item._asdict() for item in record.items]
+    return data
+
+
+def safe_num(val, default='0', as_int=False):
+    """Return a stripped numeric string, or default when empty/invalid"""
+    if not val or not val.strip():
+        return default
+    try:
+        if as_int:
+            # Convert to float first, then to int to handle '1.1' -> 1
+            return str(int(float(val.strip())))
+        return val.strip()
+    except (ValueError, TypeError):
+        return default
+
+
+# ========================================
+# NORMALIZATION (defaults for the flat food_chains.db schema)
+# ========================================
+
+def normalize_product(product):
+    """Fill the defaults food_chains.db expects for missing product fields"""
+    return product._replace(
+        unit_of_measure_price=product.unit_of_measure_price or product.item_price,
+        unit_qty=product.unit_qty or 'יחידה',
+        quantity=product.quantity or '1',
+        unit_of_measure=product.unit_of_measure or 'יחידה',
+        is_weighted=product.is_weighted or '0',
+        qty_in_package=product.qty_in_package or '1',
+        allow_discount=product.allow_discount or '1',
+        item_status=product.item_status or '1',
+        manufacture_country=product.manufacture_country or 'IL',
+    )
+
+
+def normalize_promotion(promotion):
+    """Fill the defaults food_chains.db expects for missing promotion fields"""
+    discounted_price = safe_num(promotion.discounted_price, '0.00')
+    return promotion._replace(
+        promotion_id=promotion.promotion_id or '0',
+        promotion_description=promotion.promotion_description or 'No description',
+        promotion_start_date=promotion.promotion_start_date or '2025-01-01',
+        promotion_start_hour=promotion.promotion_start_hour or '00:00:00',
+        promotion_end_date=promotion.promotion_end_date or '2025-12-31',
+        promotion_end_hour=promotion.promotion_end_hour or '23:59:00',
+        reward_type=safe_num(promotion.reward_type, '1', as_int=True),
+        discount_type=safe_num(promotion.discount_type, '1', as_int=True),
+        discount_rate=safe_num(promotion.discount_rate, '0.00'),
+        discounted_price=discounted_price,
+        discounted_price_per_unit=safe_num(promotion.discounted_price_per_unit, discounted_price),
+        min_quantity=safe_num(promotion.min_quantity, '1', as_int=True),
+        max_quantity=safe_num(promotion.max_quantity, '0', as_int=True),
+        min_purchase_amount=safe_num(promotion.min_purchase_amount, '0.00'),
+        promotion_update_date=promotion.promotion_update_date or '2025-01-01 00:00:00',
+        items=tuple(
+            item._replace(
+                item_code=item.item_code or '',
+                is_gift_item=safe_num(item.is_gift_item, '0', as_int=True),
+                item_type=safe_num(item.item_type, '1', as_int=True),
+            )
+            for item in promotion.items
+        ),
+    )
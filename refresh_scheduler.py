@@ -0,0 +1,177 @@
+"""
+Refresh Scheduler
+Keeps branch data current without restarts. Every chain in refresh_schedule is
+re-listed on its own cadence; branches whose listing shows files newer than
+what was loaded (delta_ingest.plan_refresh) go into refresh_queue, and a small
+worker pool ingests them under a concurrency and rate budget. Failed listings
+and failed ingests back off exponentially. Both tables live in food_chains.db
+(see migrations.py), so the schedule, the queue and the backoff survive restarts.
+
+The app supplies the two chain-specific steps:
+
+    list_chain_files(chain_code)          -> {branch_code: [file_name, ...]}
+    refresh_branch(chain_code, branch_code)  raises on failure
+
+Settings: REFRESH_INTERVAL_MINUTES, REFRESH_MAX_CONCURRENT, REFRESH_MAX_PER_MINUTE.
+"""
+
+import datetime
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from delta_ingest import parse_file_name, plan_refresh
+
+DEFAULT_INTERVAL_MINUTES = int(os.environ.get("REFRESH_INTERVAL_MINUTES", 60))
+# Every ingest drives a headless Chrome download, so keep the pool small
+MAX_CONCURRENT = int(os.environ.get("REFRESH_MAX_CONCURRENT", 1))
+MAX_INGESTS_PER_MINUTE = int(os.environ.get("REFRESH_MAX_PER_MINUTE", 6))
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+POLL_SECONDS = 5
+
+
+def backoff_delay(failures, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """Seconds to wait after the n-th consecutive failure: base * 2^(n-1), capped, with jitter"""
+    delay = min(cap, base * 2 ** max(0, failures - 1))
+    # Half fixed, half random, so failed branches do not all retry in the same tick
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def branches_with_new_files(db, chain_code, listing):
+    """Branch codes whose listed files are newer than what was loaded for them"""
+    stale = []
+    for branch_code, file_names in listing.items():
+        published = [f for f in map(parse_file_name, file_names) if f]
+        state = db.get_ingest_state(chain_code, branch_code)
+        if any(plan_refresh(state.get(kind), [f for f in published if f.file_kind == kind]).mode in ('full', 'delta')
+               for kind in ('price', 'promo')):
+            stale.append(branch_code)
+    return stale
+
+
+class RateLimiter:
+    """Spaces calls to acquire() at least 60 / per_minute seconds apart, across threads"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RefreshScheduler:
+    """Background loop: list due chains, queue branches with new files, ingest the due ones"""
+
+    def __init__(self, db, list_chain_files, refresh_branch, max_concurrent=MAX_CONCURRENT,
+                 max_per_minute=MAX_INGESTS_PER_MINUTE, poll_seconds=POLL_SECONDS, is_paused=None):
+        self.db = db
+        self.list_chain_files = list_chain_files
+        self.refresh_branch = refresh_branch
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate_limiter = RateLimiter(max_per_minute)
+        self.poll_seconds = poll_seconds
+        self.is_paused = is_paused or (lambda: False)
+        self.executor = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.in_flight = set()
+
+    def start(self):
+        """Start the loop in a daemon thread; returns False if it is already running"""
+        if self.thread and self.thread.is_alive():
+            return False
+        self.stopping.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="branch-refresh")
+        self.thread = threading.Thread(target=self.run, name="refresh-scheduler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self, wait=True):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+
+    def run(self):
+        print(f"⏰ Refresh scheduler started ({self.max_concurrent} concurrent ingests, "
+              f"{self.rate_limiter.interval:.0f}s between starts)")
+        while not self.stopping.is_set():
+            try:
+                if not self.is_paused():
+                    self.run_once()
+            except Exception as e:
+                print(f"❌ Refresh scheduler tick failed: {str(e)}")
+            self.stopping.wait(self.poll_seconds)
+
+    def run_once(self, now=None):
+        """One tick: re-list every due chain, then hand due queue entries to free workers"""
+        now = now or datetime.datetime.now()
+        for chain_code, interval_minutes, failures in self.db.due_refresh_chains(now):
+            self.list_chain(chain_code, interval_minutes, failures, now)
+
+        with self.lock:
+            free = self.max_concurrent - len(self.in_flight)
+        if free <= 0 or self.executor is None:
+            return
+        for chain_code, branch_code, attempts in self.db.due_branch_refreshes(now, free + len(self.in_flight)):
+            key = (chain_code, branch_code)
+            with self.lock:
+                if key in self.in_flight or len(self.in_flight) >= self.max_concurrent:
+                    continue
+                self.in_flight.add(key)
+            self.executor.submit(self.ingest, chain_code, branch_code, attempts)
+
+    def list_chain(self, chain_code, interval_minutes, failures, now):
+        try:
+            listing = self.list_chain_files(chain_code)
+            if not listing:
+                raise RuntimeError("no files listed")
+        except Exception as e:
+            delay = backoff_delay(failures + 1, cap=max(BACKOFF_MAX_SECONDS, interval_minutes * 60))
+            self.db.record_chain_listing(chain_code, now + datetime.timedelta(seconds=delay), error=str(e))
+            print(f"⚠️ {chain_code}: file listing failed ({str(e)}) - retrying in {delay / 60:.0f} min")
+            return
+
+        stale = branches_with_new_files(self.db, chain_code, listing)
+        self.db.enqueue_branch_refreshes(chain_code, stale, now)
+        self.db.record_chain_listing(chain_code, now + datetime.timedelta(minutes=interval_minutes))
+        print(f"📋 {chain_code}: {len(listing)} branches listed, {len(stale)} with new files queued")
+
+    def ingest(self, chain_code, branch_code, attempts):
+        try:
+            self.rate_limiter.acquire()
+            if self.stopping.is_set():
+                return
+            self.refresh_branch(chain_code, branch_code)
+            self.db.complete_branch_refresh(chain_code, branch_code)
+        except Exception as e:
+            delay = backoff_delay(attempts + 1)
+            retry_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+            self.db.fail_branch_refresh(chain_code, branch_code, str(e), retry_at)
+            print(f"⚠️ {chain_code}/{branch_code}: refresh failed ({str(e)}) - retrying in {delay / 60:.0f} min")
+        finally:
+            with self.lock:
+                self.in_flight.discard((chain_code, branch_code))
+
+    def status(self):
+        with self.lock:
+            in_flight = sorted(self.in_flight)
+        return {
+            "running": bool(self.thread and self.thread.is_alive()),
+            "paused": bool(self.is_paused()),
+            "max_concurrent": self.max_concurrent,
+            "seconds_between_ingests": round(self.rate_limiter.interval, 1),
+            "in_flight": [{"chain_code": chain_code, "branch_code": branch_code} for chain_code, branch_code in in_flight],
+        }
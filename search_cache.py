@@ -0,0 +1,126 @@
+"""
+Search Cache
+Search-as-you-type sends "ח", "חל", "חלב", ... and each call used to run the
+catalogue LIKE query from scratch. FoodChainDatabase.search_products() keeps
+recent results here, LRU with a TTL, keyed by chain and search term.
+
+A term is a substring match on the normalized name or the barcode, so the
+rows for "חלב" are exactly the rows for "חל" that also contain "חלב". When a
+shorter prefix of the term is cached (with at most SEARCH_CACHE_MAX_ROWS
+rows), the result is filtered from it in Python instead of queried. A term
+ending in a partly typed unit matches several names (name_matching.search_terms),
+and a prefix is used only when each of them contains one of the prefix's.
+
+Every entry carries the ingest stamp of its chain (the latest
+branch_ingest_state update, see FoodChainDatabase.ingest_stamp()) read before
+the query ran. A lookup under a newer stamp is a miss, so an ingest
+invalidates its chain's entries in every process, serving workers included.
+The TTL bounds anything the stamp does not see, such as a catalogue name
+changed by another chain's ingest.
+
+Settings: SEARCH_CACHE_ENTRIES, SEARCH_CACHE_SECONDS, SEARCH_CACHE_MAX_ROWS.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from name_matching import search_terms
+
+SEARCH_CACHE_ENTRIES = int(os.environ.get("SEARCH_CACHE_ENTRIES", 512))
+SEARCH_CACHE_SECONDS = float(os.environ.get("SEARCH_CACHE_SECONDS", 300))
+# Larger results (one- and two-letter terms) are neither kept nor filtered
+SEARCH_CACHE_MAX_ROWS = int(os.environ.get("SEARCH_CACHE_MAX_ROWS", 5000))
+
+# LIKE wildcards: a term holding one is not a plain substring, so it is never derived
+LIKE_WILDCARDS = ('%', '_')
+
+
+def search_key(search_term):
+    """(normalized name terms, barcode term) as matched by the LIKE query"""
+    return search_terms(search_term), search_term.strip()
+
+
+def row_matches(row, name_terms, code_term):
+    """Python version of the query's WHERE; rows end with (normalized_name, barcode)"""
+    # LIKE ignores ASCII case; normalized names are already case-folded
+    return any(term in row[-2] for term in name_terms) or code_term.lower() in row[-1].lower()
+
+
+class SearchCache:
+    """LRU + TTL cache of search_products() rows per (chain, term), reusing shorter-prefix results"""
+
+    def __init__(self, max_entries=SEARCH_CACHE_ENTRIES, ttl=SEARCH_CACHE_SECONDS, max_rows=SEARCH_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.derived = 0
+        self.misses = 0
+
+    def _current(self, key, stamp, now):
+        """Entry for key if it is still valid, else None (dropping it when stale)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        rows, entry_stamp, expires_at = entry
+        if entry_stamp != stamp or expires_at <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, chain_code, search_term, stamp):
+        """Cached or derived rows for a search, or None when it has to be queried"""
+        name_terms, code_term = search_key(search_term)
+        now = time.monotonic()
+        with self.lock:
+            entry = self._current((chain_code, name_terms, code_term), stamp, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+
+            terms = name_terms + (code_term,)
+            if not any(wildcard in term for term in terms for wildcard in LIKE_WILDCARDS):
+                for length in range(len(code_term) - 1, 0, -1):
+                    prefix_names, prefix_code = search_key(code_term[:length])
+                    if not prefix_names[0]:
+                        continue
+                    if not all(any(prefix in term for prefix in prefix_names) for term in name_terms):
+                        continue
+                    entry = self._current((chain_code, prefix_names, prefix_code), stamp, now)
+                    if entry is None:
+                        continue
+                    rows = tuple(row for row in entry[0] if row_matches(row, name_terms, code_term))
+                    # Expires with the entry it came from, so the TTL still bounds staleness
+                    self._store((chain_code, name_terms, code_term), (rows, stamp, entry[2]))
+                    self.derived += 1
+                    return rows
+
+            self.misses += 1
+            return None
+
+    def put(self, chain_code, search_term, stamp, rows):
+        """Keep the rows of a search queried under stamp (an ingest stamp read before the query)"""
+        if len(rows) > self.max_rows:
+            return
+        name_terms, code_term = search_key(search_term)
+        with self.lock:
+            self._store((chain_code, name_terms, code_term), (tuple(rows), stamp, time.monotonic() + self.ttl))
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "derived": self.derived, "misses": self.misses}
@@ -0,0 +1,110 @@
+"""
+Unit Normalization
+Parses the Hebrew (and occasional English) unit strings found in PriceFull
+files - גרם, ק"ג, מ"ל, ליטר, יחידה and their many spellings - into canonical
+units, and derives a price per canonical unit (per kg, per liter, per unit,
+per meter) at ingest time, so "cheapest per liter" is an indexed lookup.
+"""
+
+import re
+
+# Canonical unit and the factor converting one parsed unit into it
+UNITS = {
+    'g': ('kg', 0.001),
+    'kg': ('kg', 1.0),
+    'ml': ('l', 0.001),
+    'l': ('l', 1.0),
+    'unit': ('unit', 1.0),
+    'cm': ('m', 0.01),
+    'm': ('m', 1.0),
+}
+
+# Spellings after stripping quotes, geresh/gershayim, dots and spaces
+UNIT_ALIASES = {
+    'g': ('גרם', 'גר', 'ג', 'גרמים', 'g', 'gr', 'gram', 'grams'),
+    'kg': ('קג', 'קילו', 'קילוגרם', 'קילוגרמים', 'kg', 'kilo'),
+    'ml': ('מל', 'מיליליטר', 'מיליטר', 'ml'),
+    'l': ('ליטר', 'ל', 'ליטרים', 'ליט', 'l', 'lt', 'liter', 'litre'),
+    'unit': ('יחידה', 'יח', 'יחדיה', 'יחידות', 'יחי', 'unit', 'units', 'pcs', 'pc'),
+    'cm': ('סמ', 'סנטימטר', 'cm'),
+    'm': ('מטר', 'מ', 'מטרים', 'm', 'meter'),
+}
+ALIAS_TO_UNIT = {alias: unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+
+UNIT_NOISE = re.compile(r"[\"'`׳״.\s]")
+MEASURE = re.compile(r"^\s*(\d+(?:\.\d+)?)?\s*(.*?)\s*$")
+# A size written in the item name: "מים 0.5 ליטר", "רוטב 4 ל'", "300 ג'"
+NAME_SIZE = re.compile(r"(\d+(?:\.\d+)?)\s*([א-תa-zA-Z\"'׳״]{1,9})")
+
+
+def parse_unit(text):
+    """(canonical_unit, factor) for a unit string such as 'ק"ג' or 'מ"ל', else None"""
+    key = UNIT_NOISE.sub('', (text or '').casefold())
+    unit = ALIAS_TO_UNIT.get(key)
+    return UNITS[unit] if unit else None
+
+
+def parse_measure(text):
+    """(amount, canonical_unit, factor) for strings like '100 גרם' or '1 ליטר', else None"""
+    match = MEASURE.match(text or '')
+    if not match:
+        return None
+    unit = parse_unit(match.group(2))
+    if unit is None:
+        return None
+    amount = float(match.group(1)) if match.group(1) else 1.0
+    return (amount,) + unit if amount > 0 else None
+
+
+def name_quantity(item_name):
+    """(canonical_unit, canonical_quantity) of the first size written in an item name, else None"""
+    for amount, unit_text in NAME_SIZE.findall(item_name or ''):
+        unit = parse_unit(unit_text)
+        if unit and float(amount) > 0:
+            return unit[0], float(amount) * unit[1]
+    return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def canonical_unit_price(item_price, quantity, unit_qty, unit_of_measure, unit_of_measure_price, item_name=None):
+    """
+    Return (canonical_unit, canonical_quantity, price_per_canonical_unit).
+
+    The package contents (quantity in unit_qty) give the canonical quantity and
+    price / quantity. A quantity exactly 1000x off the size in the item name is
+    a grams/kg or ml/liter mix-up, and the name wins. Some chains copy ItemPrice
+    into UnitOfMeasurePrice, so the stated price per unit_of_measure ('100 גרם')
+    is only a fallback for rows without a usable quantity. Unknown units give
+    (None, None, None).
+    """
+    item_price = to_float(item_price)
+    quantity = to_float(quantity)
+    unit = parse_unit(unit_qty)
+    if unit and quantity > 0 and item_price > 0:
+        canonical, factor = unit
+        canonical_quantity = quantity * factor
+        named = name_quantity(item_name)
+        if named and named[0] == canonical:
+            ratio = canonical_quantity / named[1]
+            if abs(ratio - 1000) < 10 or abs(ratio - 0.001) < 0.00001:
+                canonical_quantity = named[1]
+        return canonical, round(canonical_quantity, 6), round(item_price / canonical_quantity, 4)
+
+    unit_of_measure_price = to_float(unit_of_measure_price)
+    measure = parse_measure(unit_of_measure)
+    if measure and unit_of_measure_price > 0:
+        amount, canonical, factor = measure
+        return canonical, None, round(unit_of_measure_price / (amount * factor), 4)
+    return None, None, None
+
+
+def product_unit_price(product):
+    """canonical_unit_price() for a ProductRecord"""
+    return canonical_unit_price(product.item_price, product.quantity, product.unit_qty,
+                                product.unit_of_measure, product.unit_of_measure_price, product.item_name)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Query Plan Verifier
+Runs the API endpoints, the database methods they don't reach and (with the
+local files in downloads/) the /process-branch ingest against migrated copies
+of both databases, recording every statement SQLite executes. Each distinct
+query is then checked with EXPLAIN QUERY PLAN:
+
+    ❌ a query with a WHERE/ON filter that scans a whole table (missing index)
+    ⚠️ a full scan listed in KNOWN_SCANS (no index can serve it yet)
+    ✅ everything else; listings without a filter may scan, that is their job
+
+    python verify_query_plans.py [--data-dir data] [--downloads downloads] [--no-ingest]
+
+Exits with status 1 on any ❌, so it can gate index changes as the data grows.
+"""
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import app as app_module
+from branch_writer import HIERARCHICAL_SCHEMA
+from db_connections import ConnectionProvider
+from delta_ingest import parse_file_name
+from file_archive import enforce_budget
+
+# (regex on the normalized statement, reason) for full scans that are expected
+KNOWN_SCANS = [
+    (r"LIKE \?", "leading-wildcard LIKE '%term%' cannot use a B-tree index"),
+    (r"FROM (\w+\.)?sqlite_master", "the schema table has no indexes"),
+    (r"WHERE trigram_count IS NULL", "walks a partial index holding only entries awaiting trigrams"),
+]
+
+EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+def normalize_sql(sql):
+    """Collapse literals, whitespace and per-chain/per-branch table names so one query shape is checked once"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"-?\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\bbranch_\w+?_(products_metadata|products|promotions|promotion_items)\b",
+                 r"branch_<chain>_<branch>_\1", sql)
+    sql = re.sub(r"\bchain_\w+?_(branches_metadata|branches)\b", r"chain_<chain>_\1", sql)
+    sql = re.sub(r"\(\?(?:,\s*\?)*\)", "(?)", sql)
+    sql = re.sub(r"\s*(<=|>=|!=|<>|=)\s*", r" \1 ", sql)
+    return " ".join(sql.split())
+
+
+class QueryRecorder:
+    """Collects the distinct statements run on traced connections, keyed by normalized SQL"""
+
+    def __init__(self):
+        self.queries = OrderedDict()
+
+    def __call__(self, db_path, sql):
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return
+        if sql.lstrip().upper().startswith('INSERT') and ' SELECT ' not in sql.upper():
+            return
+        self.queries.setdefault((db_path, normalize_sql(sql)), sql)
+
+
+def local_branch_files(downloads_dir):
+    """Stand-in for download_branch_files() that serves files already in downloads/"""
+    def download_branch_files(branch_code, price_filename, promo_filename):
+        files = {}
+        for key, filename in (('price_file', price_filename), ('promo_file', promo_filename)):
+            path = os.path.join(downloads_dir, filename or '')
+            if filename and os.path.exists(path):
+                files[key] = path
+        return files
+    return download_branch_files
+
+
+def stage_delta_file(downloads_dir, price_filename, target_dir):
+    """Copy a local Price delta file of the branch into target_dir, renamed one minute after its PriceFull file"""
+    full = parse_file_name(price_filename)
+    if not full:
+        return None
+    for path in sorted(glob.glob(os.path.join(downloads_dir, f"Price{full.chain_id}-{full.store_id}-*"))):
+        published = parse_file_name(os.path.basename(path))
+        if published and not published.is_full:
+            stamp = datetime.strptime(full.file_date, '%Y%m%d%H%M') + timedelta(minutes=1)
+            name = f"Price{full.chain_id}-{full.store_id}-{stamp:%Y%m%d%H%M}{os.path.splitext(path)[1]}"
+            shutil.copy(path, os.path.join(target_dir, name))
+            return name
+    return None
+
+
+def lookup(db_path, sql):
+    """Untraced helper query, so the verifier's own lookups are not checked as app queries"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def exercise_app(food_chains_path, hierarchical_path, downloads_dir=None):
+    """Issue the app's queries: ingest one branch, hit every read endpoint and the DB helpers"""
+    application = app_module.create_app(food_chains_path, hierarchical_path)
+    client = application.test_client()
+    db = app_module.db
+    hierarchical_db = app_module.hierarchical_db
+
+    # Ingest the first branch whose files are available locally, then apply a delta file on top
+    if downloads_dir:
+        app_module.download_branch_files = local_branch_files(downloads_dir)
+        branches = lookup(food_chains_path, 'SELECT branch_code, price_file_name, promo_file_name FROM branches')
+        for branch_code, price_filename, promo_filename in branches:
+            if price_filename and os.path.exists(os.path.join(downloads_dir, price_filename)):
+                print(f"📦 Ingesting branch {branch_code} from {downloads_dir}/")
+                client.get(f'/process-branch/{branch_code}')
+                staged_dir = os.path.abspath('staged_downloads')
+                os.makedirs(staged_dir, exist_ok=True)
+                delta_filename = stage_delta_file(downloads_dir, price_filename, staged_dir)
+                if delta_filename:
+                    app_module.download_branch_files = local_branch_files(staged_dir)
+                    db.record_published_files('CHAIN_001', {branch_code: [price_filename, promo_filename, delta_filename]})
+                    client.get(f'/refresh-branch/{branch_code}')
+                    # Both files are archived by now, so the replay reads them from archive/
+                    client.get(f'/replay-branch/{branch_code}?as_of={parse_file_name(delta_filename).file_date}')
+                else:
+                    print(f"⚠️ No Price delta file for branch {branch_code} in {downloads_dir}/ - delta queries not checked")
+                break
+        else:
+            print(f"⚠️ No branch files found in {downloads_dir}/ - ingest queries not checked")
+
+    for path in ('/status', '/ready', '/food-chains', '/get-branches', '/hierarchical-overview'):
+        client.get(path)
+
+    for (chain_code,) in lookup(hierarchical_path, 'SELECT chain_code FROM main_index'):
+        client.get(f'/hierarchical-chain/{chain_code}')
+        branches = lookup(hierarchical_path, f'SELECT branch_code FROM chain_{chain_code}_branches LIMIT 1')
+        if branches:
+            client.get(f'/hierarchical-branch/{chain_code}/{branches[0][0]}')
+
+    # Database methods used by discovery and search, on sample values
+    sample = lookup(food_chains_path, 'SELECT chain_code, branch_code, item_code, item_name FROM products LIMIT 1')
+    chain_code, branch_code, item_code, item_name = sample[0] if sample else ('CHAIN_001', '1', '0', 'x')
+    db.search_products(item_name[:3])
+    db.search_products(item_name[:3], chain_code)
+    db.get_product_prices([item_code, item_code + '0'], chain_code)
+    db.match_products(item_name)
+    client.get(f'/catalogue/match?q={item_name[:8]}&chain={chain_code}')
+    client.get(f'/catalogue/{item_code}?chain={chain_code}')
+    client.get('/products/cheapest-per-unit/l')
+    client.get(f'/products/cheapest-per-unit/kg?chain={chain_code}')
+    db.get_food_chains()
+    db.count_branches()
+    now = datetime.now()
+    db.ensure_refresh_schedule(chain_code, 60)
+    db.due_refresh_chains(now)
+    db.record_chain_listing(chain_code, now + timedelta(minutes=60))
+    db.enqueue_branch_refreshes(chain_code, [branch_code], now)
+    db.due_branch_refreshes(now, 1)
+    db.fail_branch_refresh(chain_code, branch_code, 'verify', now)
+    client.get('/refresh-scheduler')
+    db.complete_branch_refresh(chain_code, branch_code)
+    # backfill.py lookups
+    db.get_chains_by_actual_code()
+    db.get_branch_files(chain_code)
+    db.list_archived_sources()
+    enforce_budget(db, max_bytes=0)
+    db.save_discovery_phase('verify', {})
+    db.get_discovery_progress()
+    db.update_actual_chain_code('VERIFY_PLACEHOLDER', 'VERIFY_CODE')
+    db.clear_discovery_progress()
+    hierarchical_db.get_database_overview()
+    hierarchical_db.upsert_branch_locations([{'chain_code': chain_code, 'branch_code': branch_code,
+                                              'latitude': 32.08, 'longitude': 34.78}])
+    client.get(f'/branches/nearby?lat=32.08&lon=34.78&k=5&items={item_code}')
+    client.get('/branches/nearby?lat=32.08&lon=34.78&radius_km=5')
+
+
+def explain(db_path, sql, attached=None):
+    conn = sqlite3.connect(db_path)
+    try:
+        # The branch writer's connection has the hierarchical DB attached (branch_writer.py)
+        for schema, path in (attached or {}).items():
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+        return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    finally:
+        conn.close()
+
+
+def check_plan(normalized, plan):
+    """Return ('ok' | 'known' | 'scan', note) for one query's plan"""
+    # Walking a whole index is a full scan too, unless a LIMIT stops it early
+    limited = re.search(r"\bLIMIT\b", normalized)
+    full_scans = [step for step in plan
+                  if re.fullmatch(r"SCAN \S+", step)
+                  or (not limited and re.fullmatch(r"SCAN \S+ USING (COVERING )?INDEX \S+", step))]
+    if not full_scans:
+        return 'ok', ''
+    if not re.search(r"\b(WHERE|ON)\b", normalized):
+        return 'ok', 'listing, reads every row by design'
+    for pattern, reason in KNOWN_SCANS:
+        if re.search(pattern, normalized):
+            return 'known', reason
+    return 'scan', ', '.join(full_scans)
+
+
+def verify(recorder, attached=None):
+    failures = 0
+    icons = {'ok': '✅', 'known': '⚠️', 'scan': '❌'}
+    for (db_path, normalized), sql in recorder.queries.items():
+        try:
+            plan = explain(db_path, sql, attached)
+        except Exception as e:
+            print(f"⚠️ Could not explain ({e}): {normalized}")
+            continue
+        verdict, note = check_plan(normalized, plan)
+        failures += verdict == 'scan'
+        print(f"{icons[verdict]} [{os.path.basename(db_path)}] {normalized}")
+        for step in plan:
+            print(f"      {step}")
+        if note:
+            print(f"      → {note}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag app queries whose plan scans a whole table")
+    parser.add_argument("--data-dir", default="data", help="directory holding both database files")
+    parser.add_argument("--downloads", default="downloads", help="local PriceFull/PromoFull files for the ingest run")
+    parser.add_argument("--no-ingest", action="store_true", help="skip /process-branch")
+    args = parser.parse_args()
+
+    downloads_dir = None if args.no_ingest else os.path.abspath(args.downloads)
+    work_dir = tempfile.mkdtemp(prefix="verify_query_plans_")
+    original_dir = os.getcwd()
+    try:
+        # Copies, so the ingest run and migrations never touch the real files
+        os.makedirs(os.path.join(work_dir, "data"))
+        for db_file in glob.glob(os.path.join(args.data_dir, "*.db")):
+            shutil.copy(db_file, os.path.join(work_dir, "data"))
+        food_chains_path = os.path.join(work_dir, "data", "food_chains.db")
+        hierarchical_path = os.path.join(work_dir, "data", "hierarchical_food_chains.db")
+
+        # Snapshots and other relative paths written by the app land in the copy
+        os.chdir(work_dir)
+        recorder = QueryRecorder()
+        ConnectionProvider.tracer = recorder
+        try:
+            exercise_app(food_chains_path, hierarchical_path, downloads_dir)
+        finally:
+            ConnectionProvider.tracer = None
+
+        print(f"\n🔍 QUERY PLANS: {len(recorder.queries)} distinct queries")
+        print("=" * 60)
+        failures = verify(recorder, {HIERARCHICAL_SCHEMA: hierarchical_path})
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"\n❌ {failures} queries scan a whole table - add an index in migrations.py")
+        return 1
+    print("\n✅ Every filtered query is served by an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
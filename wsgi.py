@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Production Serving Entry Point
+Read endpoints are served by a preforking gunicorn pool whose workers open both
+databases read-only (mode=ro, mmap, one shared connection per thread). Ingest
+(/process-branch, /start-discovery) runs in a separate single-worker writer, so
+readers never contend with it for the write lock.
+
+    python wsgi.py --workers 4                    # readers on :8000 + writer on 127.0.0.1:5001
+    python wsgi.py --workers 4 --read-replicas    # readers serve copies published after each ingest
+    gunicorn -w 4 -b 0.0.0.0:8000 wsgi:application
+    gunicorn -w 1 -k gthread --threads 1 -t 3600 -b 127.0.0.1:5001 wsgi:writer_application
+
+Settings can also come from WEB_WORKERS, WEB_BIND, WRITER_BIND, SQLITE_MMAP_SIZE
+and SQLITE_IMMUTABLE (only for databases nothing writes while serving). The
+writer also runs the periodic refresh scheduler unless REFRESH_SCHEDULER=0.
+The writer uses a gthread worker, which keeps heartbeating while an ingest
+runs, and a WRITER_TIMEOUT (seconds, default 3600) instead of gunicorn's 30 s,
+so a long download or Full parse does not get it killed mid-ingest.
+SQLITE_READ_REPLICAS=1 (--read-replicas) points the readers at copies of
+food_chains.db that the writer publishes after each ingest (read_replica.py).
+"""
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+
+DEFAULT_WORKERS = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count()))
+DEFAULT_BIND = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+DEFAULT_WRITER_BIND = os.environ.get("WRITER_BIND", "127.0.0.1:5001")
+REFRESH_SCHEDULER = os.environ.get("REFRESH_SCHEDULER", "1") != "0"
+WRITER_TIMEOUT = int(os.environ.get("WRITER_TIMEOUT", 3600))
+
+_applications = {}
+
+
+def __getattr__(name):
+    """
+    Build 'application' (read-only) or 'writer_application' on first access.
+    create_app() configures the shared app-level DB handles, so a process only
+    ever builds the one its server asks for.
+    """
+    if name not in ('application', 'writer_application'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name not in _applications:
+        from app import create_app, start_refresh_scheduler
+        _applications[name] = create_app(read_only=(name == 'application'))
+        # Periodic refreshes ingest, so they run in the writer only
+        if name == 'writer_application' and REFRESH_SCHEDULER:
+            start_refresh_scheduler(_applications[name])
+    return _applications[name]
+
+
+def run_gunicorn(app_name, bind, workers, threads=1, worker_class=None, timeout=None):
+    """Serve wsgi:<app_name> with gunicorn in this process (gunicorn's worker class and timeout by default)"""
+    from gunicorn.app.base import BaseApplication
+
+    class WSGIServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('proc_name', f"food-chains-{app_name}")
+            if worker_class:
+                self.cfg.set('worker_class', worker_class)
+            if timeout:
+                self.cfg.set('timeout', timeout)
+
+        def load(self):
+            return getattr(sys.modules[__name__], app_name)
+
+    WSGIServer().run()
+
+
+def prepare_databases():
+    """Create/upgrade the schema and switch both files to WAL before any reader starts"""
+    from database_setup import FoodChainDatabase
+    from database_hierarchical import HierarchicalFoodDatabase
+
+    from read_replica import READ_REPLICAS, publish_read_replica
+
+    for database in (FoodChainDatabase(), HierarchicalFoodDatabase()):
+        mode = database.connections.enable_wal()
+        print(f"✅ {database.db_path}: journal_mode={mode}")
+
+    # Readers start on a replica of the current data; the writer publishes the next ones
+    if READ_REPLICAS:
+        publish_read_replica(FoodChainDatabase().db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the food chain API with multiple workers")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="read-only worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="threads per read-only worker")
+    parser.add_argument("--bind", default=DEFAULT_BIND, help="address of the read-only pool")
+    parser.add_argument("--writer-bind", default=DEFAULT_WRITER_BIND, help="address of the ingest writer")
+    parser.add_argument("--no-writer", action="store_true", help="only run the read-only pool")
+    parser.add_argument("--writer-only", action="store_true", help="only run the ingest writer")
+    parser.add_argument("--writer-timeout", type=int, default=WRITER_TIMEOUT,
+                        help="seconds an ingest request may run before gunicorn restarts the writer")
+    parser.add_argument("--read-replicas", action="store_true",
+                        help="serve food_chains.db from copies published after each ingest")
+    args = parser.parse_args()
+
+    # Set before the database modules are imported; the writer subprocess inherits it
+    if args.read_replicas:
+        os.environ["SQLITE_READ_REPLICAS"] = "1"
+
+    if args.writer_only:
+        # One request thread keeps ingests serialized; the gthread main loop heartbeats meanwhile
+        run_gunicorn('writer_application', args.writer_bind, 1,
+                     worker_class='gthread', timeout=args.writer_timeout)
+        return
+
+    prepare_databases()
+
+    writer = None
+    if not args.no_writer:
+        # A separate interpreter, so forked readers inherit nothing of the writer
+        writer = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                   "--writer-only", "--writer-bind", args.writer_bind,
+                                   "--writer-timeout", str(args.writer_timeout)])
+        print(f"✍️ Ingest writer on http://{args.writer_bind} (1 worker)")
+
+    print(f"🌐 Read-only pool on http://{args.bind} ({args.workers} workers x {args.threads} threads)")
+    arbiter_pid = os.getpid()
+    try:
+        run_gunicorn('application', args.bind, args.workers, args.threads)
+    finally:
+        # Forked workers unwind through here too; only the arbiter owns the writer
+        if writer is not None and os.getpid() == arbiter_pid:
+            writer.terminate()
+            writer.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+XML Stream Reader
+Opens downloaded price/promo files (.gz that is really ZIP, gzip, or plain XML)
+and archived ones (.xml.xz, see file_archive.py) as binary streams that feed
+straight into the XML parser, without decoding the whole document into a
+Python string first.
+"""
+
+import codecs
+import contextlib
+import gzip
+import lzma
+import mmap
+import re
+import zipfile
+
+ZIP_SIGNATURE = b'PK'
+GZIP_SIGNATURE = b'\x1f\x8b'
+# First bytes of the xz magic b'\xfd7zXZ\x00'
+XZ_SIGNATURE = b'\xfd7'
+
+XML_DECLARATION_ENCODING = re.compile(rb'^<\?xml[^>]*encoding\s*=\s*["\']([A-Za-z0-9._\-]+)["\']')
+
+
+def detect_file_format(signature):
+    """Return 'zip', 'gzip', 'xz' or 'xml' for the first bytes of a file"""
+    if signature.startswith(ZIP_SIGNATURE):
+        return 'zip'
+    if signature.startswith(GZIP_SIGNATURE):
+        return 'gzip'
+    if signature.startswith(XZ_SIGNATURE):
+        return 'xz'
+    return 'xml'
+
+
+def detect_xml_encoding(prefix):
+    """Detect the document encoding from a BOM or the XML prolog (defaults to UTF-8)"""
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if prefix.startswith(codecs.BOM_UTF16_LE) or prefix.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    if prefix.startswith(b'<\x00?\x00'):
+        return 'utf-16-le'
+    if prefix.startswith(b'\x00<\x00?'):
+        return 'utf-16-be'
+
+    match = XML_DECLARATION_ENCODING.match(prefix.lstrip())
+    if match:
+        declared = match.group(1).decode('ascii')
+        try:
+            return codecs.lookup(declared).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+@contextlib.contextmanager
+def open_xml_stream(filepath):
+    """
+    Open a downloaded file as a binary XML stream.
+
+    ZIP members, gzip and xz payloads are decompressed incrementally as the parser
+    reads; plain XML files are memory-mapped. The parser sees raw bytes, so the
+    encoding declared in the XML prolog (UTF-16, windows-1255, ...) is honoured
+    by expat itself.
+    """
+    with open(filepath, 'rb') as raw:
+        file_format = detect_file_format(raw.read(2))
+        raw.seek(0)
+
+        if file_format == 'zip':
+            with zipfile.ZipFile(raw) as zip_file:
+                xml_files = [name for name in zip_file.namelist() if name.lower().endswith('.xml')]
+                if not xml_files:
+                    raise Exception("No XML file found in ZIP archive")
+                with zip_file.open(xml_files[0]) as stream:
+                    yield stream
+
+        elif file_format == 'gzip':
+            with gzip.GzipFile(fileobj=raw, mode='rb') as stream:
+                yield stream
+
+        elif file_format == 'xz':
+            with lzma.LZMAFile(raw, mode='rb') as stream:
+                yield stream
+
+        else:
+            try:
+                mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be memory-mapped
+                yield raw
+                return
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+
+def uncompressed_size(filepath):
+    """Return the size of the XML document inside a downloaded file, without decompressing it"""
+    with open(filepath, 'rb') as raw:
+        file_format = detect_file_format(raw.read(2))
+        if file_format == 'zip':
+            raw.seek(0)
+            with zipfile.ZipFile(raw) as zip_file:
+                xml_infos = [info for info in zip_file.infolist() if info.filename.lower().endswith('.xml')]
+                return xml_infos[0].file_size if xml_infos else 0
+        if file_format == 'gzip':
+            # ISIZE trailer: uncompressed length modulo 2**32
+            raw.seek(-4, 2)
+            return int.from_bytes(raw.read(4), 'little')
+        if file_format == 'xz':
+            return xz_uncompressed_size(raw)
+        raw.seek(0, 2)
+        return raw.tell()
+
+
+def read_varint(data, pos):
+    """xz multibyte integer at data[pos:]; returns (value, next position)"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7f) << shift
+        pos += 1
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def xz_uncompressed_size(raw):
+    """Sum the block sizes recorded in the index of a single-stream .xz file"""
+    # Stream footer: CRC32, backward size (index length / 4 - 1), flags, 'YZ'
+    raw.seek(-12, 2)
+    footer = raw.read(12)
+    index_size = (int.from_bytes(footer[4:8], 'little') + 1) * 4
+    raw.seek(-12 - index_size, 2)
+    index = raw.read(index_size)
+    records, pos = read_varint(index, 1)
+    size = 0
+    for _ in range(records):
+        _, pos = read_varint(index, pos)
+        uncompressed, pos = read_varint(index, pos)
+        size += uncompressed
+    return size
+
+
+def read_xml_text(filepath):
+    """Decode a whole file to text using its declared encoding (for callers that need a str)"""
+    with open_xml_stream(filepath) as stream:
+        data = stream.read()
+    return data.decode(detect_xml_encoding(data[:256]))